@@ -0,0 +1,73 @@
+import nltk
+import re
+
+
+# Tokens as found by nltk.wordpunct_tokenize: runs of word characters and runs of punctuation
+_wordPunct = re.compile(r"\w+|[^\w\s]+")
+
+# Whether terms are stemmed (Porter stemmer), at indexing and at query time: an index must be queried with the
+# setting it was built with
+stemming = False
+
+
+def tokenize(text):
+    """ Tokens of a text, like nltk.wordpunct_tokenize """
+    return _wordPunct.findall(text)
+
+
+def stemmer():
+    """ Stemmer of the terms, None when stemming is off """
+    return nltk.stem.PorterStemmer() if stemming else None
+
+
+class Analyzer:
+    """ Text analysis shared by the indexers and the requests: a text is lowercased, tokenized in one pass, common
+    words are filtered out with a set lookup, and the remaining tokens are stemmed if a stemmer is given (each token is
+    only stemmed once, stems are kept in a cache) """
+
+    def __init__(self, stopWords, stemmer=None):
+        self.stopWords = frozenset(stopWords)
+        self.stemmer = stemmer
+        self.stemCache = {}
+
+    def normalize(self, token):
+        """ Term of a token """
+        token = token.lower()
+        if self.stemmer is None:
+            return token
+        stem = self.stemCache.get(token)
+        if stem is None:
+            stem = self.stemmer.stem(token)
+            self.stemCache[token] = stem
+        return stem
+
+    def stems(self, tokens):
+        """ Stem cache holding every token of a list (lowercased tokens): only the distinct tokens not seen before are
+        looked up and stemmed, so that the terms of a text can then be read from the cache without a call per token """
+        stemCache = self.stemCache
+        for token in set(tokens).difference(stemCache):
+            stemCache[token] = self.stemmer.stem(token)
+        return stemCache
+
+    def analyze(self, text):
+        """ Terms of a text """
+        stopWords = self.stopWords
+        tokens = [token for token in _wordPunct.findall(text.lower()) if token not in stopWords]
+        if self.stemmer is None:
+            return tokens
+        stemCache = self.stems(tokens)
+        return [stemCache[token] for token in tokens]
+
+    def analyzeWithPositions(self, text):
+        """ Terms of a text with their positions, counted before common words are removed """
+        stopWords = self.stopWords
+        tokens = [(position, token) for position, token in enumerate(_wordPunct.findall(text.lower()))
+                  if token not in stopWords]
+        if self.stemmer is None:
+            return tokens
+        stemCache = self.stems([token for position, token in tokens])
+        return [(position, stemCache[token]) for position, token in tokens]
+
+    def analyzeDocuments(self, texts):
+        """ Terms of each text of a batch """
+        return [self.analyze(text) for text in texts]
@@ -0,0 +1,259 @@
+from Collection import *
+from Analysis import Analyzer, stemmer, tokenize
+import Analysis
+import Collection as collection_settings
+from BooleanRequest import BooleanRequest
+import io
+import nltk
+import random
+import shutil
+import timeit
+import tracemalloc
+
+
+def postings_lists(collection):
+    """ Posting lists of all terms of a loaded collection """
+    return [postings for termId, postings in collection.invertedIndex]
+
+
+def random_postings_lists(nbTerms=2000, nbDocuments=100000):
+    """ Random posting lists, with df following a power law and small tf like in a real index """
+    lists = []
+    for termId in range(nbTerms):
+        df = min(nbDocuments, int(random.paretovariate(0.7)))
+        docIds = sorted(random.sample(range(nbDocuments), df))
+        lists.append([(docId, int(random.paretovariate(2))) for docId in docIds])
+    return lists
+
+
+def postings_numbers(lists):
+    """ Gaps and tf of all postings, in the order they are written in a VB code index """
+    numbers = []
+    for postings in lists:
+        previous_posting_id = 0
+        for posting in postings:
+            numbers.append(posting[0] - previous_posting_id)
+            numbers.append(posting[1])
+            previous_posting_id = posting[0]
+    return numbers
+
+
+def vb_codec_benchmark(numbers, repeat=3):
+    """ Time the number by number VB code functions against the bulk codec on the same numbers """
+    code = bytes(VBEncode(numbers))
+
+    def encode_one_by_one():
+        result = bytearray([])
+        for number in numbers:
+            result.extend(intToVBCode(number))
+        return result
+
+    def decode_one_by_one():
+        file = io.BytesIO(code)
+        return [VBCodeToFirstInt(file) for _ in numbers]
+
+    timings = [("intToVBCode", encode_one_by_one),
+               ("VBEncode", lambda: VBEncode(numbers)),
+               ("VBCodeToFirstInt", decode_one_by_one),
+               ("VBDecode", lambda: VBDecode(code))]
+
+    print(f"{len(numbers)} numbers, {len(code)} bytes in VB code")
+    for name, function in timings:
+        elapsed = min(timeit.repeat(function, number=1, repeat=repeat))
+        print(f"    {name:<20} {elapsed:.4f}s    {len(numbers) / elapsed / 1000000:.2f}M numbers/s")
+
+
+def codec_benchmark(lists, repeat=3):
+    """ Size (bits per posting) and decoding speed of each codec, on postings cut in blocks as in the index """
+    blocks = []
+    for postings in lists:
+        previous_posting_id = 0
+        for start in range(0, len(postings), postingBlockSize):
+            block = postings[start:start + postingBlockSize]
+            gaps = [block[0][0] - previous_posting_id] + [block[i][0] - block[i - 1][0] for i in range(1, len(block))]
+            blocks.append((gaps, [x[1] for x in block], previous_posting_id))
+            previous_posting_id = block[-1][0]
+    nbPostings = sum([len(x[0]) for x in blocks])
+
+    print(f"{nbPostings} postings in {len(blocks)} blocks of at most {postingBlockSize} postings")
+    for codec in codecs:
+        start_time = timeit.default_timer()
+        encoded = [(codec.encodePostings(gaps, tfs), len(gaps), previous) for gaps, tfs, previous in blocks]
+        encoding_time = timeit.default_timer() - start_time
+        size = sum([len(x[0]) for x in encoded])
+
+        def decode_all():
+            for code, count, previous in encoded:
+                codec.decodePostings(code, count, previous)
+
+        decoding_time = min(timeit.repeat(decode_all, number=1, repeat=repeat))
+        print(f"    {codec.name:<10} {8 * size / nbPostings:6.2f} bits/posting    "
+              f"encoding {nbPostings / encoding_time / 1000000:.2f}M postings/s    "
+              f"decoding {nbPostings / decoding_time / 1000000:.2f}M postings/s")
+
+
+def memory_benchmark(lists):
+    """ Memory used by an inverted index kept as lists of (docId, tf) tuples, as it was loaded before, against the
+    arrays of PostingArrays """
+    arrays = PostingArrays.fromPostingLists(enumerate(lists))
+    nbPostings = len(arrays.docIds)
+    tracemalloc.start()
+    tuples = [(termId, [(docId, tf) for docId, tf in postings]) for termId, postings in arrays]
+    tuples_size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del tuples
+    arrays_size = sum([x.itemsize * len(x) for x in (arrays.docIds, arrays.tfs, arrays.offsets)])
+
+    print(f"{nbPostings} postings, tf on {arrays.tfs.itemsize} bytes")
+    for name, size in [("tuples", tuples_size), ("PostingArrays", arrays_size)]:
+        print(f"    {name:<20} {size / 1000000:8.2f} MB    {size / nbPostings:6.2f} bytes/posting")
+    print(f"    {tuples_size / arrays_size:.1f}x less memory")
+
+
+def collection_texts(collection_name, nbTexts=2000):
+    """ Texts to tokenize: CACM documents, CS276 documents, or random texts """
+    if collection_name == 'CACM':
+        return [documentText(fields) for docId, fields in readCACMDocuments()]
+    if collection_name == 'CS276':
+        return [documentText(fields) for documentName, fields in readCS276Documents()]
+    words = ["word" + str(int(random.paretovariate(1))) for _ in range(5000)] + ["the", "of", ",", "."]
+    return [" ".join(random.choices(words, k=100)) for _ in range(nbTexts)]
+
+
+def analysis_benchmark(texts, repeat=3):
+    """ Tokens per second of the shared analyzer against tokenization with nltk and a linear common words lookup """
+    with open("Data/CACM/common_words", mode='r') as file:
+        common_words = file.read().splitlines() + list(string.punctuation)
+    analyzer = Analyzer(common_words)
+    nb_tokens = sum([len(tokenize(text)) for text in texts])
+
+    def nltk_list():
+        return [[x for x in nltk.wordpunct_tokenize(text.lower()) if x not in common_words] for text in texts]
+
+    timings = [("nltk + list", nltk_list),
+               ("Analyzer", lambda: analyzer.analyzeDocuments(texts))]
+    if Analysis.stemming:
+        timings.append(("Analyzer + stems", lambda: Analyzer(common_words, stemmer()).analyzeDocuments(texts)))
+
+    print(f"{len(texts)} texts, {nb_tokens} tokens")
+    for name, function in timings:
+        elapsed = min(timeit.repeat(function, number=1, repeat=repeat))
+        print(f"    {name:<20} {elapsed:.4f}s    {nb_tokens / elapsed / 1000000:.2f}M tokens/s")
+
+
+def positional_benchmark(collection, nbQueries=200, minDf=10, distance=5, repeat=3, index_location="indexBenchmark"):
+    """ Size of the positions against the postings, and latency of phrase and NEAR queries against the AND of the
+    same two terms, on random pairs of frequent terms of a positional index. The positional index of a collection
+    indexed without positions is built in a temporary index location """
+    if not collection.positional:
+        print("Constructing a positional index...")
+        shutil.rmtree(index_location, ignore_errors=True)
+        try:
+            positional_collection = type(collection)(index_location, positional=True)
+            positional_collection.constructIndex()
+            positional_collection.saveIndex()
+            positional_collection.loadIndex()
+            positional_benchmark(positional_collection, nbQueries, minDf, distance, repeat)
+        finally:
+            shutil.rmtree(index_location, ignore_errors=True)
+        return
+
+    postings_size = os.path.getsize(collection.indexLocation + "/invertedIndex")
+    positions_size = os.path.getsize(collection.indexLocation + "/positions")
+    print(f"postings {postings_size} bytes, positions {positions_size} bytes "
+          f"(+{100 * positions_size / postings_size:.0f}% index size)")
+
+    request = BooleanRequest(collection)
+    term_by_id = {collection.termId[term]: term for term in collection.termId}
+    frequent_terms = [term_by_id[termId] for termId in range(len(collection.documentFrequency))
+                      if collection.documentFrequency[termId] >= minDf and termId in term_by_id]
+    pairs = [(random.choice(frequent_terms), random.choice(frequent_terms)) for _ in range(nbQueries)]
+
+    timings = [("AND", lambda a, b: request.andRequest(request.termRequest(collection.termId[a]),
+                                                       request.termRequest(collection.termId[b]))),
+               ("phrase", lambda a, b: request.phraseRequest([a, b])),
+               (f"NEAR/{distance}", lambda a, b: request.nearRequest(a, b, distance))]
+
+    for name, function in timings:
+        matches = sum([len(list(function(a, b))) for a, b in pairs])
+        elapsed = min(timeit.repeat(lambda: [list(function(a, b)) for a, b in pairs], number=1, repeat=repeat))
+        print(f"    {name:<10} {1000 * elapsed / nbQueries:.3f}ms/query    {matches / nbQueries:.1f} documents/query")
+
+
+def indexing_benchmark(process_counts=None, index_location="indexBenchmark"):
+    """ Throughput of the construction of the CS276 index for an increasing number of worker processes, in a
+    temporary index location. Documents are parsed and inverted in parallel: mapping the term ids of the workers and
+    merging the runs stay in the main process """
+    if process_counts is None:
+        process_counts = [1]
+        while process_counts[-1] * 2 <= (os.cpu_count() or 1):
+            process_counts.append(process_counts[-1] * 2)
+    default_processes = collection_settings.nbProcesses
+    base_time = None
+    try:
+        for processes in process_counts:
+            collection_settings.nbProcesses = processes
+            shutil.rmtree(index_location, ignore_errors=True)
+            collection = CS276Collection(index_location)
+            start_time = timeit.default_timer()
+            collection.constructIndex()
+            elapsed = timeit.default_timer() - start_time
+            base_time = base_time or elapsed
+            print(f"    {processes:>3} processes {elapsed:8.2f}s    {collection.docLen / elapsed:8.0f} documents/s    "
+                  f"speedup {base_time / elapsed:.2f}    efficiency {base_time / elapsed / processes:.2f}")
+    finally:
+        collection_settings.nbProcesses = default_processes
+        shutil.rmtree(index_location, ignore_errors=True)
+
+
+if __name__ == "__main__":
+
+    # Collection choice
+    collection_name = ""
+    while collection_name not in ['CACM', 'CS276', 'RANDOM']:
+        collection_name = input("Choose a collection among 'CACM', 'CS276' and 'RANDOM' (random postings)\n> ").upper()
+
+    collection = None
+    if collection_name == 'CS276':
+        collection = CS276Collection()
+    elif collection_name == 'CACM':
+        collection = CACMCollection()
+
+    if collection is not None:
+        if os.path.isfile('index' + collection_name + '/docId') and os.path.isfile('index' + collection_name + '/terms') \
+                and os.path.isfile('index' + collection_name + '/invertedIndex'):
+            collection.loadIndex()
+        else:
+            collection.constructIndex()
+            collection.saveIndex()
+        lists = postings_lists(collection)
+    else:
+        lists = random_postings_lists()
+    numbers = postings_numbers(lists)
+
+    while True:
+        action = input("Select a benchmark:\nV: variable byte codec\nC: compression codecs\n"
+                       "P: positional index (phrase and NEAR queries)\nT: text analysis\n"
+                       "I: parallel indexing (CS276)\nM: memory of the in-memory index\n> ").lower()
+        if action == "v":
+            vb_codec_benchmark(numbers)
+        elif action == "c":
+            codec_benchmark(lists)
+        elif action == "m":
+            memory_benchmark(lists)
+        elif action == "t":
+            analysis_benchmark(collection_texts(collection_name))
+        elif action == "i":
+            if collection_name != 'CS276':
+                print("The parallel indexing benchmark needs CS276.")
+                continue
+            indexing_benchmark()
+        elif action == "p":
+            if collection is None:
+                print("The positional benchmark needs a collection.")
+                continue
+            positional_benchmark(collection)
+        elif "quit" in action:
+            break
+        else:
+            print("Invalid option.")
@@ -0,0 +1,160 @@
+from bisect import bisect_left
+from itertools import groupby
+
+
+# Maximum number of doc ids in an array container, a container with more doc ids is a bitset
+arrayContainerMax = 4096
+
+# Size in bytes of a bitset container (2^16 bits)
+_bitsetSize = 8192
+
+# Positions of the bits set in each byte value
+_bitsOfByte = [[bit for bit in range(8) if byte >> bit & 1] for byte in range(256)]
+
+
+def _cardinality(bitset):
+    return bin(bitset).count("1")
+
+
+def _arrayToBitset(values):
+    """ Bitset (as a Python int) of a list of 16 bits values """
+    bitset = bytearray(_bitsetSize)
+    for value in values:
+        bitset[value >> 3] |= 1 << (value & 7)
+    return int.from_bytes(bitset, byteorder='little')
+
+
+def _bitsetToArray(bitset):
+    """ Sorted list of the values of a bitset """
+    values = []
+    for index, byte in enumerate(bitset.to_bytes(_bitsetSize, byteorder='little')):
+        if byte:
+            values.extend([8 * index + bit for bit in _bitsOfByte[byte]])
+    return values
+
+
+def _normalize(container):
+    """ Array container if sparse enough, bitset container otherwise (None if empty) """
+    if isinstance(container, int):
+        if _cardinality(container) > arrayContainerMax:
+            return container
+        container = _bitsetToArray(container)
+    if len(container) > arrayContainerMax:
+        return _arrayToBitset(container)
+    if len(container) == 0:
+        return None
+    return container
+
+
+def _arrayAndBitset(values, bitset):
+    bitset = bitset.to_bytes(_bitsetSize, byteorder='little')
+    return [value for value in values if bitset[value >> 3] >> (value & 7) & 1]
+
+
+def _arrayAndNotBitset(values, bitset):
+    bitset = bitset.to_bytes(_bitsetSize, byteorder='little')
+    return [value for value in values if not bitset[value >> 3] >> (value & 7) & 1]
+
+
+def _and(x, y):
+    if isinstance(x, int) and isinstance(y, int):
+        return x & y
+    if isinstance(x, int):
+        x, y = y, x
+    if isinstance(y, int):
+        return _arrayAndBitset(x, y)
+    y = set(y)
+    return [value for value in x if value in y]
+
+
+def _or(x, y):
+    if isinstance(x, int) and isinstance(y, int):
+        return x | y
+    if isinstance(x, int):
+        x, y = y, x
+    if isinstance(y, int):
+        return y | _arrayToBitset(x)
+    return sorted(set(x) | set(y))
+
+
+def _andNot(x, y):
+    if isinstance(x, int) and isinstance(y, int):
+        return x & ~y
+    if isinstance(x, int):
+        return x & ~_arrayToBitset(y)
+    if isinstance(y, int):
+        return _arrayAndNotBitset(x, y)
+    y = set(y)
+    return [value for value in x if value not in y]
+
+
+class RoaringBitmap:
+    """ Compressed bitmap of doc ids (Roaring-style). Doc ids are grouped by their 16 high bits: the group (container)
+    of their 16 low bits is a sorted list when it is sparse, or a bitset of 2^16 bits when it is dense. Bitsets are
+    Python ints so that AND, OR and AND NOT between them run word by word. """
+
+    def __init__(self, containers=None):
+        self.containers = containers if containers is not None else {}
+
+    @classmethod
+    def fromSorted(cls, docIds):
+        """ Bitmap of a sorted sequence of doc ids """
+        containers = {}
+        for high, group in groupby(docIds, key=lambda x: x >> 16):
+            container = _normalize([docId & 0xFFFF for docId in group])
+            if container is not None:
+                containers[high] = container
+        return cls(containers)
+
+    def __iter__(self):
+        for high in sorted(self.containers):
+            container = self.containers[high]
+            base = high << 16
+            for low in (_bitsetToArray(container) if isinstance(container, int) else container):
+                yield base | low
+
+    def __len__(self):
+        return sum([_cardinality(x) if isinstance(x, int) else len(x) for x in self.containers.values()])
+
+    def __contains__(self, docId):
+        container = self.containers.get(docId >> 16)
+        if container is None:
+            return False
+        low = docId & 0xFFFF
+        if isinstance(container, int):
+            return bool(container >> low & 1)
+        position = bisect_left(container, low)
+        return position < len(container) and container[position] == low
+
+    def __and__(self, other):
+        containers = {}
+        for high in self.containers.keys() & other.containers.keys():
+            container = _normalize(_and(self.containers[high], other.containers[high]))
+            if container is not None:
+                containers[high] = container
+        return RoaringBitmap(containers)
+
+    def __or__(self, other):
+        containers = dict(self.containers)
+        for high, container in other.containers.items():
+            containers[high] = _normalize(_or(containers[high], container)) if high in containers else container
+        return RoaringBitmap(containers)
+
+    def __sub__(self, other):
+        """ AND NOT """
+        containers = {}
+        for high, container in self.containers.items():
+            if high in other.containers:
+                container = _normalize(_andNot(container, other.containers[high]))
+            if container is not None:
+                containers[high] = container
+        return RoaringBitmap(containers)
+
+    def filter(self, docIds):
+        """ Doc ids of a sorted sequence that are in the bitmap """
+        result = []
+        for high, group in groupby(docIds, key=lambda x: x >> 16):
+            if high in self.containers:
+                base = high << 16
+                result.extend([base | low for low in _and([docId & 0xFFFF for docId in group], self.containers[high])])
+        return result
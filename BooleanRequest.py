@@ -1,35 +1,269 @@
-from collections import deque
+from bisect import bisect_left
+from collections import OrderedDict
 from Collection import *
+from Bitmap import RoaringBitmap
+from QueryPlanner import QueryPlanner
+from Wildcard import isWildcard
 import datetime
 from functools import reduce
+import heapq
 import logging
 
+# Size ratio between two sorted lists of doc ids from which their intersection uses a galloping search instead of a
+# linear merge
+gallopingRatio = 8
+
+# Minimum df, as a fraction of the number of documents, from which a term (or a complement) is evaluated as a
+# compressed bitmap instead of a list of doc ids
+bitmapDensity = 1 / 32
+
+# Maximum number of term bitmaps kept in cache
+bitmapCacheSize = 100
+
+# Maximum number of terms a wildcard pattern is expanded to (None for no limit)
+wildcardExpansionLimit = 50
+
+# Whether a query term which is not in the collection is replaced by its spelling correction
+spellingCorrection = True
+
+
 class BooleanRequest:
     def __init__(self, Collection):
         self.collection = Collection
-        self.allTerms = range(collection.termLen)
+        self.allTerms = range(self.collection.termLen)
+        self.allDocuments = sorted(self.collection.docId.values())
+        self.allDocumentsBitmap = None
+        self.bitmapCache = OrderedDict()
+        self.corrections = {}
 
     def simpleRequest(self, termId):
         try:
-            return [x[0] for x in self.collection.invertedIndex[int(termId)][1]]
+            return self.collection.invertedIndex[int(termId)][1].docIds.tolist()
         except TypeError:
-            return self.orRequest([termId])
+            return reduce(self.orRequest, [self.simpleRequest(x) for x in termId], [])
+
+    def useBitmap(self, df):
+        """ Whether a set of df documents is dense enough to be evaluated as a bitmap """
+        return df >= bitmapDensity * self.collection.docLen
+
+    def termRequest(self, termId):
+        """ Documents of a term, as a bitmap (kept in cache) for a frequent term or as a list otherwise """
+        if not self.useBitmap(self.collection.getDocumentFrequency(termId)):
+            return self.simpleRequest(termId)
+        if termId in self.bitmapCache:
+            self.bitmapCache.move_to_end(termId)
+            return self.bitmapCache[termId]
+        bitmap = RoaringBitmap.fromSorted(self.simpleRequest(termId))
+        self.bitmapCache[termId] = bitmap
+        if len(self.bitmapCache) > bitmapCacheSize:
+            self.bitmapCache.popitem(last=False)
+        return bitmap
+
+    def _allDocumentsBitmap(self):
+        if self.allDocumentsBitmap is None:
+            self.allDocumentsBitmap = RoaringBitmap.fromSorted(self.allDocuments)
+        return self.allDocumentsBitmap
+
+    def andRequest(self, a, b):
+        """ Intersection of two sorted sequences of doc ids: bitwise between bitmaps, linear merge for lists of similar
+        sizes, galloping (exponential) search of the doc ids of the smaller list in the larger one otherwise """
+        if isinstance(a, RoaringBitmap) and isinstance(b, RoaringBitmap):
+            return a & b
+        if isinstance(a, RoaringBitmap):
+            a, b = b, a
+        if isinstance(b, RoaringBitmap):
+            return b.filter(a)
+        a = a if isinstance(a, list) else list(a)
+        b = b if isinstance(b, list) else list(b)
+        if len(a) > len(b):
+            a, b = b, a
+        if len(b) >= gallopingRatio * len(a):
+            return self._gallopingIntersection(a, b)
+        result = []
+        i, j = 0, 0
+        while i < len(a) and j < len(b):
+            if a[i] < b[j]:
+                i += 1
+            elif a[i] > b[j]:
+                j += 1
+            else:
+                result.append(a[i])
+                i += 1
+                j += 1
+        return result
+
+    @staticmethod
+    def _gallopingIntersection(small, large):
+        """ Intersection of a small sorted list with a large one, each doc id of the small list being searched in the
+        large one by doubling steps from the previous position, then by binary search """
+        result = []
+        low = 0
+        n = len(large)
+        for docId in small:
+            if low < n and large[low] < docId:
+                bound = 1
+                while low + bound < n and large[low + bound] < docId:
+                    bound *= 2
+                low = bisect_left(large, docId, low + bound // 2, min(low + bound + 1, n))
+            if low == n:
+                break
+            if large[low] == docId:
+                result.append(docId)
+        return result
+
+    def orRequest(self, a, b):
+        """ Union of two sorted sequences of doc ids, bitwise if one of them is a bitmap, by linear merge otherwise """
+        if isinstance(a, RoaringBitmap) or isinstance(b, RoaringBitmap):
+            a = a if isinstance(a, RoaringBitmap) else RoaringBitmap.fromSorted(a)
+            b = b if isinstance(b, RoaringBitmap) else RoaringBitmap.fromSorted(b)
+            return a | b
+        result = []
+        for docId in heapq.merge(a, b):
+            if len(result) == 0 or result[-1] != docId:
+                result.append(docId)
+        return result
+
+    def andNotRequest(self, a, b):
+        """ Documents of a which are not in b """
+        if isinstance(a, RoaringBitmap):
+            return a - (b if isinstance(b, RoaringBitmap) else RoaringBitmap.fromSorted(b))
+        if isinstance(b, RoaringBitmap):
+            return [docId for docId in a if docId not in b]
+        return list(self._complement(a, b))
+
+    def notRequest(self, a):
+        """ Complement of a sorted sequence of doc ids among all documents: a bitmap if it is dense, doc ids given one
+        by one in order otherwise """
+        if isinstance(a, RoaringBitmap) or (isinstance(a, list) and self.useBitmap(self.collection.docLen - len(a))):
+            return self.andNotRequest(self._allDocumentsBitmap(), a)
+        return self._complement(self.allDocuments, a)
+
+    @staticmethod
+    def _complement(docIds, a):
+        """ Lazy difference between two sorted sequences of doc ids """
+        excluded = iter(a)
+        nextExcluded = next(excluded, None)
+        for docId in docIds:
+            while nextExcluded is not None and nextExcluded < docId:
+                nextExcluded = next(excluded, None)
+            if docId != nextExcluded:
+                yield docId
+
+    def andTermRequest(self, docIds, termId):
+        """ Intersection of a sorted list of doc ids with the postings of a term, jumping over the blocks of postings
+        which cannot contain the next doc id """
+        cursor = PostingCursor(self.collection, termId)
+        result = []
+        for docId in docIds:
+            cursor.skipTo(docId)
+            if cursor.docId is None:
+                break
+            if cursor.docId == docId:
+                result.append(docId)
+        return result
+
+    def termIdOf(self, token):
+        """ Term id of a query token, normalized like the terms of the collection, or of its spelling correction if it
+        is not in the collection (kept in self.corrections). None if there is none """
+        term = self.collection.analyzer.normalize(token)
+        termId = self.collection.termId.get(term)
+        if termId is None and spellingCorrection:
+            correction = self.collection.correctTerm(term)
+            if correction is not None:
+                self.corrections[token] = correction
+                termId = self.collection.termId.get(correction)
+        return termId
+
+    def wildcardTerms(self, pattern):
+        """ Term ids of the terms matching a wildcard pattern, at most wildcardExpansionLimit of them """
+        return [termId for term, termId in self.collection.getWildcardIndex().expand(pattern.lower(),
+                                                                                     wildcardExpansionLimit)]
+
+    def wildcardRequest(self, pattern):
+        """ Documents of the terms matching a wildcard pattern: the OR of these terms """
+        return reduce(self.orRequest, [self.termRequest(x) for x in self.wildcardTerms(pattern)], [])
+
+    def _positionalTerms(self, terms):
+        """ Term ids of terms for a phrase or NEAR query, None if a term is not in the collection """
+        if not self.collection.positional:
+            raise ValueError("phrase and NEAR queries need a positional index")
+        if any([term not in self.collection.termId for term in terms]):
+            return None
+        return [self.collection.termId[term] for term in terms]
+
+    def _candidates(self, termIds):
+        """ Documents containing all the terms, the rarest first """
+        termIds = sorted(termIds, key=self.collection.getDocumentFrequency)
+        return list(reduce(self.andRequest, [self.termRequest(x) for x in termIds[1:]], self.termRequest(termIds[0])))
+
+    def phraseRequest(self, words):
+        """ Documents where the words (a list of tokens) appear consecutively. Common words are not indexed: they only
+        count in the offsets of the other words. Positions are only decoded for the documents containing all the
+        words, and for the documents still matching after each word """
+        terms = self.collection.analyzer.analyzeWithPositions(" ".join(words))
+        if len(terms) == 0:
+            return []
+        termIds = self._positionalTerms([word for offset, word in terms])
+        if termIds is None:
+            return []
+        terms = sorted(zip([offset for offset, word in terms], termIds),
+                       key=lambda x: self.collection.getDocumentFrequency(x[1]))
+        # Possible start positions of the phrase in each document, narrowed word by word from the rarest one
+        offset, termId = terms[0]
+        starts = {docId: {x - offset for x in positions}
+                  for docId, positions in self.collection.getPositions(termId, self._candidates(termIds)).items()}
+        for offset, termId in terms[1:]:
+            positions = self.collection.getPositions(termId, sorted(starts))
+            starts = {docId: starts[docId] & {x - offset for x in positions[docId]} for docId in starts}
+            starts = {docId: start for docId, start in starts.items() if len(start) > 0}
+        return sorted(starts)
+
+    @staticmethod
+    def _near(a, b, k):
+        """ Whether two sorted lists of positions have positions at most k apart """
+        i = j = 0
+        while i < len(a) and j < len(b):
+            if abs(a[i] - b[j]) <= k:
+                return True
+            if a[i] < b[j]:
+                i += 1
+            else:
+                j += 1
+        return False
+
+    def nearRequest(self, a, b, k):
+        """ Documents where the words a and b appear at most k positions apart, in any order """
+        analyzer = self.collection.analyzer
+        termIds = self._positionalTerms([analyzer.normalize(a), analyzer.normalize(b)])
+        if termIds is None:
+            return []
+        docIds = self._candidates(termIds)
+        positionsA = self.collection.getPositions(termIds[0], docIds)
+        positionsB = self.collection.getPositions(termIds[1], docIds)
+        return [docId for docId in docIds if self._near(positionsA[docId], positionsB[docId], k)]
 
     def polishNotationRequest(self, tokens):
+        """ Evaluate a request in Polish notation, the result is a sorted sequence of doc ids (a list, a bitmap, or an
+        iterator for a negation) """
         token = tokens.popleft().lower()
         if token == 'or':
-            return list(set(self.polishNotationRequest(tokens) + self.polishNotationRequest(tokens)))
+            return self.orRequest(self.polishNotationRequest(tokens), self.polishNotationRequest(tokens))
         if token == 'and':
-            a, b = self.polishNotationRequest(tokens), self.polishNotationRequest(tokens)
-            return list(set([x for x in a if x in b]))
-        if token == 'not':
             a = self.polishNotationRequest(tokens)
-            return [x for x in range(1, self.collection.docLen) if x not in a]
+            if len(tokens) > 0 and tokens[0].lower() not in ['or', 'and', 'not'] and not isWildcard(tokens[0]):
+                termId = self.termIdOf(tokens[0])
+                if termId is not None and not self.useBitmap(self.collection.getDocumentFrequency(termId)):
+                    # The second operand is a term with a list of doc ids: its postings are skipped block by block
+                    tokens.popleft()
+                    return self.andTermRequest(a, termId)
+            return self.andRequest(a, self.polishNotationRequest(tokens))
+        if token == 'not':
+            return self.notRequest(self.polishNotationRequest(tokens))
+        if isWildcard(token):
+            return self.wildcardRequest(token)
         else:
-            try:
-                return self.simpleRequest(self.collection.termId[token.lower()])
-            except KeyError:
-                return []
+            termId = self.termIdOf(token)
+            return self.termRequest(termId) if termId is not None else []
 
 
 if __name__ == "__main__":
@@ -44,7 +278,7 @@ if __name__ == "__main__":
     else:
         collection = CACMCollection()
 
-    if os.path.isfile('index' + collection_name + '/docId') and os.path.isfile('index' + collection_name + '/termId') \
+    if os.path.isfile('index' + collection_name + '/docId') and os.path.isfile('index' + collection_name + '/terms') \
             and os.path.isfile('index' + collection_name + '/invertedIndex'):
         collection.loadIndex()
     else:
@@ -57,28 +291,33 @@ if __name__ == "__main__":
 
     # Initiate boolean request
     request = BooleanRequest(collection)
-    #print(request.simpleRequest(0))
-    #print(request.simpleRequest(1))
-    #print(request.simpleRequest(2))
-    #print(request.parseRequest(["NOT",["AND",[[0], [1], [2]]]]))
-    #print(request.parseRequest(request.parseInput("NOT AND 0 OR 1 2")))
+    planner = QueryPlanner(request)
     while True:
-        query = input("Please enter your query in Polish notation:\n> ")
+        query = input("Please enter your query in Polish (prefix) or infix notation "
+                      "(start it with 'explain' to see how it is evaluated):\n> ")
         start_time = datetime.datetime.now()
+        request.corrections = {}
         if '!' in query:
             print("Exiting...")
             break
+        explain = query.lower().startswith("explain ")
+        if explain:
+            query = query[len("explain "):]
         try:
-            response = request.polishNotationRequest(deque(query.split(" ")))
-            # response = request.parseRequest(request.parseInput(query))
-        except(IndentationError):
+            response = list(planner.request(query))
+        except ValueError as error:
             response = None
-            print("Invalid request. Valid operations are 'or', 'and' and 'not'. Enter '!' to quit.")
+            print(f"Invalid request ({error}). Valid operations are 'or', 'and', 'not', "
+                  f"'near/k', \"phrases\" in quotes and wildcards (comp*). Enter '!' to quit.")
 
+        if len(request.corrections) > 0:
+            print("Showing results for " + ", ".join([f"'{correction}' instead of '{token}'"
+                                                      for token, correction in request.corrections.items()]))
+        if explain and response is not None:
+            print(planner.explain())
         if response == []:
             print("No results found. Try being less specific. Some of the terms you looked for might not exist.")
         elif response is not None:
             print(f"Request found in {len(response)} documents in {(datetime.datetime.now()-start_time).seconds}s:")
             for doc_and_measure in response:
                 print(doc_by_id[doc_and_measure])
-
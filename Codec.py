@@ -0,0 +1,322 @@
+import re
+import struct
+from itertools import accumulate
+
+
+def intToVBCode(number):
+    """ Convert an integer into a byte array in Variable Byte Code (VBC) """
+    if not isinstance(number, int):
+        raise TypeError("number converted in VB code must be an integer")
+    if number < 0:
+        raise ValueError("number converted in VB code must be positive")
+    result = [128 + number % 128]
+    number = number // 128
+    while number > 0:
+        result.append(number % 128)
+        number = number // 128
+    result.reverse()
+    return bytearray(result)
+
+
+def VBCodeToFirstInt(file):
+    """ Read an open file to get the first number in VB code into an integer """
+    value = 0
+    byte = file.read(1)
+    if byte==b'':
+        return None
+    while byte[0] < 128:
+        value = 128 * value + byte[0]
+        byte = file.read(1)
+    value = 128 * value + (byte[0] - 128)
+    return value
+
+
+# Numbers written on more than one byte in VB code, and translation of the last byte of a number into its value
+_multiByteVBCode = re.compile(rb'[\x00-\x7f]+[\x80-\xff]')
+_lastByteValue = bytes([byte % 128 for byte in range(256)])
+
+
+def VBEncode(numbers):
+    """ Convert a whole list of integers into a byte array in VB code, in one call """
+    code = bytearray([])
+    for number in numbers:
+        if 0 <= number < 128:
+            code.append(128 + number)
+        else:
+            code.extend(intToVBCode(number))
+    return code
+
+
+def VBDecode(buffer):
+    """ Decode all the numbers in VB code of a buffer (bytes, bytearray, memoryview or mmap slice) in one call.
+    Numbers written on a single byte, the most frequent ones for gaps and tf, are translated by runs at once, and only
+    the numbers written on several bytes are rebuilt one by one """
+    buffer = bytes(buffer)
+    numbers = []
+    position = 0
+    for match in _multiByteVBCode.finditer(buffer):
+        numbers.extend(buffer[position:match.start()].translate(_lastByteValue))
+        value = 0
+        for byte in match.group():
+            value = 128 * value + (byte & 127)
+        numbers.append(value)
+        position = match.end()
+    numbers.extend(buffer[position:].translate(_lastByteValue))
+    return numbers
+
+
+def postingsFromGaps(gaps, tfs, previousPostingId=0):
+    """ List of (docId, tf) from the doc id gaps and the tf of postings """
+    gaps = list(gaps)
+    if len(gaps) > 0:
+        gaps[0] += previousPostingId
+    return list(zip(accumulate(gaps), tfs))
+
+
+def VBDecodePostings(buffer, previousPostingId=0):
+    """ Decode a buffer of (gap, tf) pairs in VB code into a list of (docId, tf) """
+    numbers = VBDecode(buffer)
+    return postingsFromGaps(numbers[0::2], numbers[1::2], previousPostingId)
+
+
+def encodePositions(positions):
+    """ Sorted positions of a term in a document as gaps in VB code, preceded by their size in bytes so that the
+    positions of a document can be jumped over without being decoded """
+    code = VBEncode([positions[0]] + [positions[i] - positions[i - 1] for i in range(1, len(positions))])
+    return intToVBCode(len(code)) + code
+
+
+def decodePositions(buffer):
+    """ Positions of a term in a document from their gaps in VB code """
+    return list(accumulate(VBDecode(buffer)))
+
+
+def VBCodeToIntAt(buffer, position):
+    """ Read the number in VB code starting at a position of a buffer, returns it with the position following it """
+    value = 0
+    byte = buffer[position]
+    while byte < 128:
+        value = 128 * value + byte
+        position += 1
+        byte = buffer[position]
+    return 128 * value + (byte - 128), position + 1
+
+
+class Codec:
+    """ Compression of lists of positive integers. A block of postings is written as its doc id gaps followed by its
+    tf, each list being compressed separately """
+
+    name = None
+
+    def encode(self, numbers):
+        """ Compress a list of positive integers into bytes """
+        raise NotImplementedError
+
+    def decode(self, buffer, count, position=0):
+        """ Decompress count integers from a position of a buffer, returns them with the position following them """
+        raise NotImplementedError
+
+    def encodePostings(self, gaps, tfs):
+        """ Compress a block of postings """
+        return self.encode(gaps) + self.encode(tfs)
+
+    def decodePostings(self, buffer, count, previousPostingId=0):
+        """ Decompress a block of count postings into a list of (docId, tf) """
+        gaps, position = self.decode(buffer, count)
+        tfs, _ = self.decode(buffer, count, position)
+        return postingsFromGaps(gaps, tfs, previousPostingId)
+
+
+class VBCodec(Codec):
+    """ Variable byte code. Postings are written as (gap, tf) pairs, as in the indexes saved before codecs could be
+    chosen """
+
+    name = 'vb'
+
+    def encode(self, numbers):
+        return bytes(VBEncode(numbers))
+
+    def decode(self, buffer, count, position=0):
+        end = position
+        found = 0
+        while found < count:
+            if buffer[end] >= 128:
+                found += 1
+            end += 1
+        return VBDecode(buffer[position:end]), end
+
+    def encodePostings(self, gaps, tfs):
+        numbers = []
+        for gap, tf in zip(gaps, tfs):
+            numbers.append(gap)
+            numbers.append(tf)
+        return self.encode(numbers)
+
+    def decodePostings(self, buffer, count, previousPostingId=0):
+        return VBDecodePostings(buffer, previousPostingId)
+
+
+class _BitCodec(Codec):
+    """ Codes written bit by bit: each list is handled as a string of '0' and '1', padded with zeros to a whole number
+    of bytes """
+
+    def _numberToBits(self, number):
+        raise NotImplementedError
+
+    def _bitsToNumber(self, bits, position):
+        """ Read a number from a position of a bit string, returns it with the position following it """
+        raise NotImplementedError
+
+    def encode(self, numbers):
+        bits = "".join([self._numberToBits(number) for number in numbers])
+        size = -(-len(bits) // 8)
+        return int(bits + "0" * (8 * size - len(bits)), 2).to_bytes(size, byteorder='big') if size > 0 else b''
+
+    def decode(self, buffer, count, position=0):
+        if count == 0:
+            return [], position
+        buffer = bytes(buffer[position:])
+        bits = format(int.from_bytes(buffer, byteorder='big'), "0" + str(8 * len(buffer)) + "b")
+        numbers = []
+        bitPosition = 0
+        for i in range(count):
+            number, bitPosition = self._bitsToNumber(bits, bitPosition)
+            numbers.append(number)
+        return numbers, position + -(-bitPosition // 8)
+
+
+class EliasGammaCodec(_BitCodec):
+    """ Elias gamma code of number + 1 (gaps can be 0): the length of the binary writing in unary, then the binary
+    writing without its leading 1 """
+
+    name = 'gamma'
+
+    def _numberToBits(self, number):
+        if number < 0:
+            raise ValueError("number converted in Elias gamma code must be positive")
+        binary = format(number + 1, "b")
+        return "0" * (len(binary) - 1) + binary
+
+    def _bitsToNumber(self, bits, position):
+        start = bits.index("1", position)
+        end = 2 * start - position + 1
+        return int(bits[start:end], 2) - 1, end
+
+
+class EliasDeltaCodec(_BitCodec):
+    """ Elias delta code of number + 1: the length of the binary writing in Elias gamma code, then the binary writing
+    without its leading 1 """
+
+    name = 'delta'
+
+    def _numberToBits(self, number):
+        if number < 0:
+            raise ValueError("number converted in Elias delta code must be positive")
+        binary = format(number + 1, "b")
+        length = format(len(binary), "b")
+        return "0" * (len(length) - 1) + length + binary[1:]
+
+    def _bitsToNumber(self, bits, position):
+        start = bits.index("1", position)
+        end = 2 * start - position + 1
+        length = int(bits[start:end], 2)
+        return int("1" + bits[end:end + length - 1], 2) - 1, end + length - 1
+
+
+class Simple8bCodec(Codec):
+    """ Simple-8b: 64 bits words made of a 4 bits selector and as many numbers of the same width as fit in 60 bits """
+
+    name = 'simple8b'
+
+    # (count of numbers, width in bits) for each selector, selectors 0 and 1 being runs of zeros
+    selectors = [(240, 0), (120, 0), (60, 1), (30, 2), (20, 3), (15, 4), (12, 5), (10, 6), (8, 7), (7, 8), (6, 10),
+                 (5, 12), (4, 15), (3, 20), (2, 30), (1, 60)]
+
+    def encode(self, numbers):
+        words = []
+        i = 0
+        while i < len(numbers):
+            for selector, (count, width) in enumerate(self.selectors):
+                # The last word can be incomplete, the number of values to decode is known
+                group = numbers[i:i + count]
+                if max(group) < (1 << width) and min(group) >= 0:
+                    break
+            else:
+                raise ValueError("number converted in Simple-8b must be positive and lower than 2**60")
+            word = selector << 60
+            for j, number in enumerate(group):
+                word |= number << (j * width)
+            words.append(word)
+            i += len(group)
+        return struct.pack("<" + str(len(words)) + "Q", *words)
+
+    def decode(self, buffer, count, position=0):
+        numbers = []
+        while len(numbers) < count:
+            word, = struct.unpack_from("<Q", buffer, position)
+            position += 8
+            number, width = self.selectors[word >> 60]
+            number = min(number, count - len(numbers))
+            if width == 0:
+                numbers.extend([0] * number)
+            else:
+                mask = (1 << width) - 1
+                numbers.extend([(word >> (j * width)) & mask for j in range(number)])
+        return numbers, position
+
+
+class PForDeltaCodec(Codec):
+    """ Patched frame of reference: numbers are cut in frames of 128, written on the smallest width that fits 90% of
+    the frame. The high bits of the other numbers (exceptions) are written in VB code after the frame width """
+
+    name = 'pfordelta'
+
+    frameSize = 128
+    exceptionRate = 0.1
+
+    def encode(self, numbers):
+        code = bytearray([])
+        for start in range(0, len(numbers), self.frameSize):
+            frame = numbers[start:start + self.frameSize]
+            if min(frame) < 0:
+                raise ValueError("number converted in PForDelta must be positive")
+            widths = sorted([number.bit_length() for number in frame])
+            width = widths[min(len(frame) - 1, int(len(frame) * (1 - self.exceptionRate)))]
+            exceptions = [(i, number >> width) for i, number in enumerate(frame) if number >> width > 0]
+            packed = 0
+            mask = (1 << width) - 1
+            for i, number in enumerate(frame):
+                packed |= (number & mask) << (i * width)
+            code.append(width)
+            code.extend(intToVBCode(len(exceptions)))
+            for i, high in exceptions:
+                code.extend(intToVBCode(i))
+                code.extend(intToVBCode(high))
+            code.extend(packed.to_bytes(-(-len(frame) * width // 8), byteorder='little'))
+        return bytes(code)
+
+    def decode(self, buffer, count, position=0):
+        numbers = []
+        while len(numbers) < count:
+            frameLength = min(self.frameSize, count - len(numbers))
+            width = buffer[position]
+            nbExceptions, position = VBCodeToIntAt(buffer, position + 1)
+            exceptions = []
+            for i in range(nbExceptions):
+                index, position = VBCodeToIntAt(buffer, position)
+                high, position = VBCodeToIntAt(buffer, position)
+                exceptions.append((index, high))
+            size = -(-frameLength * width // 8)
+            packed = int.from_bytes(buffer[position:position + size], byteorder='little')
+            position += size
+            mask = (1 << width) - 1
+            frame = [(packed >> (i * width)) & mask for i in range(frameLength)]
+            for index, high in exceptions:
+                frame[index] |= high << width
+            numbers.extend(frame)
+        return numbers, position
+
+
+# Codecs by id, the id being written in the header of index files
+codecs = [VBCodec(), EliasGammaCodec(), EliasDeltaCodec(), Simple8bCodec(), PForDeltaCodec()]
+codecIds = {codec.name: codecId for codecId, codec in enumerate(codecs)}
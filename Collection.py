@@ -1,114 +1,631 @@
 import datetime
-import nltk
+import heapq
 import string
 import os
 import math
+import mmap
+import struct
+import zlib
 import matplotlib.pyplot as plt
-from itertools import groupby
-from threading import Thread, RLock
-from queue import Queue
-
-
-nbThreadMap = 2
-nbThreadReduce = 2
-
-
-def intToVBCode(number):
-    """ Convert an integer into a byte array in Variable Byte Code (VBC) """
-    if not isinstance(number, int):
-        raise TypeError("number converted in VB code must be an integer")
-    if number < 0:
-        raise ValueError("number converted in VB code must be positive")
-    b = number % 128
-    a = number // 128
-    result = [128 + b]
-    while a > 0:
-        b = a % 128
-        a = a // 128
-        result.insert(0, b)
-    return bytearray(result)
-
-
-def VBCodeToFirstInt(file):
-    """ Read an open file to get the first number in VB code into an integer """
-    value = 0
-    byte = file.read(1)
-    if byte==b'':
-        return None
-    while int.from_bytes(byte, byteorder='big') < 128:
-        value = 128 * value + int.from_bytes(byte, byteorder='big')
-        byte = file.read(1)
-    value = 128 * value + (int.from_bytes(byte, byteorder='big') - 128)
-    return value
-
-
-class Collection:
-    """ Main class to deal with collections """
-
-    def __init__(self, indexLocation = None):
+from Codec import *
+from Analysis import Analyzer, stemmer
+from Dictionary import TermDictionary, writeTermDictionary
+from Spelling import KgramIndex, kgramIndexToBinary
+from Wildcard import PermutermIndex, writePermutermIndex
+from Documents import cs276DocumentNames, documentText, readCACMDocuments, readCS276Documents
+from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+from multiprocessing import Pool
+
+
+# Number of worker processes parsing the documents of CS276, and number of documents parsed in each task
+nbProcesses = os.cpu_count() or 1
+documentsPerTask = 100
+
+# Estimated memory (in bytes) of the postings kept in memory while indexing CS276, a run is written to hard-drive
+# each time it is reached
+indexMemoryBudget = 64 * 1024 * 1024
+
+# Number of postings in each block of a postings list (blocks can be skipped without being decoded)
+postingBlockSize = 128
+
+# Codec used to compress postings in the index files written (see Codec.codecs), the codec of a file is read from
+# its header
+postingCodec = 'vb'
+
+# Maximum number of posting lists (and block headers) kept decoded when the index is read lazily (0 for no cache)
+postingCacheSize = 1000
+
+# Size in bytes of the read buffer of each block index file during a merge
+mergeBufferSize = 1 << 16
+
+# Maximum edit distance of the spelling correction of a query term which is not in the collection (one edit per 3
+# characters of the term at most), and minimum length of a corrected term
+spellingMaxDistance = 2
+spellingMinLength = 3
+
+# Weighting schemes whose document norms are precomputed with the index
+statisticsWeightTypes = ('tf_idf', 'normalized_tf', 'normalized_tf_idf')
+
+
+# First bytes of index files, followed by the codec id and the number of postings per block
+indexMagic = b"RIWB"
+
+
+def indexHeader(codec):
+    """ Header of an index file written with a codec """
+    return indexMagic + bytes([codecIds[codec.name]]) + intToVBCode(postingBlockSize)
+
+
+def readIndexHeader(buffer):
+    """ Codec of an index file and position of its first term, from the first bytes of the file. Files without a
+    header were written in VB code """
+    if bytes(buffer[:len(indexMagic)]) != indexMagic:
+        return codecs[codecIds['vb']], 0
+    blockSize, position = VBCodeToIntAt(buffer, len(indexMagic) + 1)
+    if blockSize != postingBlockSize:
+        raise ValueError(f"index written with blocks of {blockSize} postings instead of {postingBlockSize}")
+    return codecs[buffer[len(indexMagic)]], position
+
+
+def decodeBlocks(codec, buffer, blocks, nbPostings):
+    """ Decode all the blocks of postings of a term """
+    postings = []
+    for block in range(len(blocks)):
+        end = blocks[block + 1][1] if block + 1 < len(blocks) else len(buffer)
+        postings.extend(codec.decodePostings(buffer[blocks[block][1]:end],
+                                             min(postingBlockSize, nbPostings - block * postingBlockSize),
+                                             blocks[block - 1][0] if block > 0 else 0))
+    return postings
+
+
+def compactArray(values):
+    """ Array of non-negative integers with the smallest item size which holds all of them: tf are almost always
+    below 256, so that they take one byte instead of four """
+    maxValue = max(values, default=0)
+    typeCode = 'B' if maxValue < 1 << 8 else 'H' if maxValue < 1 << 16 else 'I'
+    return array(typeCode, values)
+
+
+class PostingList:
+    """ Read-only view over the postings of a term kept in two arrays, one of doc ids and one of tf. It can be used
+    like a list of (docId, tf) tuples, while the docIds and tfs arrays can be read in tight loops without building a
+    tuple per posting. Slices are views over the same arrays """
+
+    __slots__ = ('docIds', 'tfs')
+
+    def __init__(self, docIds, tfs):
+        self.docIds = memoryview(docIds)
+        self.tfs = memoryview(tfs)
+
+    @classmethod
+    def fromPostings(cls, postings):
+        """ View over a list of (docId, tf) """
+        return cls(array('I', [x[0] for x in postings]), compactArray([x[1] for x in postings]))
+
+    def __len__(self):
+        return len(self.docIds)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return PostingList(self.docIds[index], self.tfs[index])
+        return self.docIds[index], self.tfs[index]
+
+    def __iter__(self):
+        return zip(self.docIds, self.tfs)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class PostingArrays:
+    """ Inverted index kept in memory as arrays: the doc ids and the tf of all the postings, term after term in term id
+    order, and the offset of the first posting of each term. It can be used like the list of (termId, postings) of a
+    collection, the postings of a term being a PostingList view over the arrays """
+
+    def __init__(self, docIds, tfs, offsets):
+        self.docIds = docIds
+        self.tfs = tfs
+        self.offsets = offsets
+
+    @classmethod
+    def fromPostingLists(cls, postingLists):
+        """ Arrays of an inverted index given as (termId, postings) in term id order, without missing term id """
+        docIds = array('I')
+        tfs = array('I')
+        offsets = array('Q', [0])
+        for termId, postings in postingLists:
+            docIds.extend([x[0] for x in postings])
+            tfs.extend([x[1] for x in postings])
+            offsets.append(len(docIds))
+        return cls(docIds, compactArray(tfs), offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        for termId in range(len(self)):
+            yield self[termId]
+
+    def __getitem__(self, termId):
+        if termId < 0:
+            termId += len(self)
+        if not 0 <= termId < len(self):
+            raise IndexError("term id out of range")
+        start, end = self.offsets[termId], self.offsets[termId + 1]
+        return termId, PostingList(memoryview(self.docIds)[start:end], memoryview(self.tfs)[start:end])
+
+
+class InvertedIndexFile:
+    """ Inverted index read lazily from a memory-mapped file: a posting list (or a block of postings) is only decoded
+    when it is first accessed, using the term offset table to find it. It can be used like the list of
+    (termId, postings) built in memory. """
+
+    def __init__(self, fileName, termOffsets, cacheSize):
+        with open(fileName, mode="rb") as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.codec, _ = readIndexHeader(self.buffer)
+        self.termOffsets = termOffsets
+        self.cacheSize = cacheSize
+        self.cache = OrderedDict()
+
+    def __len__(self):
+        return len(self.termOffsets)
+
+    def __iter__(self):
+        for termId in range(len(self)):
+            yield self[termId]
+
+    def __getitem__(self, termId):
+        return termId, self._cached(("postings", termId), self._readPostings)
+
+    def _cached(self, key, read):
+        """ Get a decoded value from the cache (least recently used values are dropped) or read it """
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        value = read(key[1:])
+        if self.cacheSize > 0:
+            self.cache[key] = value
+            if len(self.cache) > self.cacheSize:
+                self.cache.popitem(last=False)
+        return value
+
+    def _readHeader(self, key):
+        """ Number of postings, block headers, position and size of the postings of a term """
+        position = self.termOffsets[key[0]]
+        nbPostings, position = VBCodeToIntAt(self.buffer, position)
+        _, position = VBCodeToIntAt(self.buffer, position)  # Term id
+        size, position = VBCodeToIntAt(self.buffer, position)
+        blocks = []
+        lastPostingId = 0
+        for i in range(-(-nbPostings // postingBlockSize)):
+            lastPostingIdDiff, position = VBCodeToIntAt(self.buffer, position)
+            lastPostingId += lastPostingIdDiff
+            offset, position = VBCodeToIntAt(self.buffer, position)
+            maxTf, position = VBCodeToIntAt(self.buffer, position)
+            blocks.append((lastPostingId, offset, maxTf))
+        return nbPostings, blocks, position, size
+
+    def _readPostings(self, key):
+        nbPostings, blocks, position, size = self._cached(("header", key[0]), self._readHeader)
+        return PostingList.fromPostings(decodeBlocks(self.codec, self.buffer[position:position + size], blocks,
+                                                     nbPostings))
+
+    def _readBlockPostings(self, key):
+        termId, block = key
+        nbPostings, blocks, position, size = self._cached(("header", termId), self._readHeader)
+        previousPostingId = blocks[block - 1][0] if block > 0 else 0
+        end = blocks[block + 1][1] if block + 1 < len(blocks) else size
+        return self.codec.decodePostings(self.buffer[position + blocks[block][1]:position + end],
+                                         min(postingBlockSize, nbPostings - block * postingBlockSize),
+                                         previousPostingId)
+
+    def getPostingBlocks(self, termId):
+        return self._cached(("header", termId), self._readHeader)[1]
+
+    def getBlockPostings(self, termId, block):
+        if ("postings", termId) in self.cache:
+            return self.cache[("postings", termId)][block * postingBlockSize:(block + 1) * postingBlockSize]
+        return self._cached(("block", termId, block), self._readBlockPostings)
+
+
+class PositionsFile:
+    """ Positions of the terms read lazily from a memory-mapped file: the positions of a term are returned as a view
+    of the file, without being copied nor decoded """
+
+    def __init__(self, fileName, positionOffsets):
+        with open(fileName, mode="rb") as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.positionOffsets = positionOffsets
+
+    def __len__(self):
+        return len(self.positionOffsets)
+
+    def __getitem__(self, termId):
+        _, position = VBCodeToIntAt(self.buffer, self.positionOffsets[termId])  # Term id
+        size, position = VBCodeToIntAt(self.buffer, position)
+        return memoryview(self.buffer)[position:position + size]
+
+
+class PostingCursor:
+    """ Cursor over the postings of one term. It moves block by block: a block of postings is only read when the cursor
+    lands in it, the block headers are enough to jump over the others """
+
+    def __init__(self, collection, termId):
+        self.collection = collection
+        self.termId = termId
+        self.blocks = collection.getPostingBlocks(termId)
+        self.df = collection.documentFrequency[termId]
+        self.block = 0
+        self.postings = []
+        self.index = 0
+        self.docId = None
+        self.tf = 0
+        self._readBlock(0)
+
+    def _readBlock(self, block):
+        self.block = block
+        self.index = 0
+        self.postings = []
+        # Blocks can be empty when postings are filtered (deleted documents of a segment)
+        while len(self.postings) == 0 and self.block < len(self.blocks):
+            self.postings = self.collection.getBlockPostings(self.termId, self.block)
+            if len(self.postings) == 0:
+                self.block += 1
+        if len(self.postings) > 0:
+            self.docId, self.tf = self.postings[0]
+        else:
+            self.docId = None
+
+    def position(self):
+        """ Number of postings before the current one """
+        if self.docId is None:
+            return self.df
+        return self.block * postingBlockSize + self.index
+
+    def postingPosition(self):
+        """ Position of the current posting in the postings list of the term (where data aligned with the postings,
+        such as weights, is found), None when the blocks of the collection do not give it """
+        return self.position() if self.collection.uniformBlocks and self.docId is not None else None
+
+    def remaining(self):
+        """ Number of postings from the current one to the end """
+        return self.df - self.position()
+
+    def next(self):
+        """ Move to the next posting (docId is None at the end) """
+        self.index += 1
+        if self.index < len(self.postings):
+            self.docId, self.tf = self.postings[self.index]
+        else:
+            self._readBlock(self.block + 1)
+
+    def blockOf(self, docId):
+        """ Index of the block where docId would be, from the current block (number of blocks if after the end) """
+        return bisect_left(self.blocks, (docId,), self.block)
+
+    def skipTo(self, docId):
+        """ Move to the first posting with a doc id greater than or equal to docId, using block headers to jump over
+        whole blocks. Returns the number of postings skipped """
+        if self.docId is None or self.docId >= docId:
+            return 0
+        start = self.position()
+        block = self.blockOf(docId)
+        if block != self.block:
+            self._readBlock(block)
+        if self.docId is not None:
+            self.index = bisect_left(self.postings, (docId,), self.index)
+            if self.index < len(self.postings):
+                self.docId, self.tf = self.postings[self.index]
+            else:
+                # The postings of the block after docId were filtered out
+                self._readBlock(self.block + 1)
+        return self.position() - start
+
+
+class Collection(ABC):
+    """ Main class to deal with collections. A collection type tells how its documents are read (readDocuments) """
+
+    def __init__(self, indexLocation = None, positional = False):
         self.indexLocation = indexLocation # Location on hard-drive to save the inverted index
+        self.positional = positional # Whether positions of terms in documents are indexed (phrase and NEAR queries)
         self.termId = {}
         self.termLen = 0
         self.docId = {}
         self.docLen = 0
         self.list = []
         self.invertedIndex = []
-        self.commonWords = []
+        self.postingBlocks = []
+        self.termOffsets = array('Q')
+        self.documentFrequency = array('I')
+        self.documentLength = array('I')
+        self.documentNorm = {}
+        self.positions = []
+        self.positionOffsets = array('Q')
+        self.uniformBlocks = True # Whether all blocks of postings but the last of a term hold postingBlockSize postings
+        self.generation = 0 # Number of changes of the documents of the index, weights computed before are stale
+        self.commonWords = frozenset()
         self._getCommonWords()
+        self.analyzer = Analyzer(self.commonWords, stemmer()) # Tokenization, common words and stemming of all texts
+        self.wildcardIndex = None # Permuterm index of the terms, for wildcard queries
+        self.spellingIndex = None # k-gram index of the terms, for spelling correction
+        self.spellingCache = {}
         if self.indexLocation is not None and not os.path.exists(self.indexLocation):
             os.makedirs(self.indexLocation)
 
     def _getCommonWords(self):
         """ Get common words from a file in the CACM folder """
         with open("Data/CACM/common_words", mode='r') as file:
-            self.commonWords = file.read().splitlines()
-            self.commonWords += list(string.punctuation)
+            self.commonWords = frozenset(file.read().splitlines() + list(string.punctuation))
 
     def _indexToBinary(self, file):
-        """ Convert the inverted index in VB Code to be saved in an open file """
-
+        """ Convert the inverted index in VB Code (or with the codec chosen in postingCodec) to be saved in an open
+        file """
+
+        codec = codecs[codecIds[postingCodec]]
+        header = indexHeader(codec)
+        file.write(header)
+        self.postingBlocks = []
+        # Term ids of a block index are global, the table is sized by the largest one
+        self.termOffsets = array('Q', [0] * (self.invertedIndex[-1][0] + 1 if self.invertedIndex else 0))
+        position = len(header)
         for indexTerm in self.invertedIndex:
-            vbcode = bytearray([])
-            term_code = intToVBCode(indexTerm[0])
-            previous_posting_id = 0
-            for posting in indexTerm[1]:
-                posting_id_diff = posting[0] - previous_posting_id
-                previous_posting_id = posting[0]
-                term_code.extend(intToVBCode(posting_id_diff))
-                term_code.extend(intToVBCode(posting[1]))
-            # An integer is put at the beginning of this byte array for the current term in order to know how many
-            # postings there are before the next term
-            vbcode.extend(intToVBCode(len(indexTerm[1])))
-            vbcode.extend(term_code)
+            vbcode, blocks = self._postingListToBinary(codec, indexTerm[0], indexTerm[1])
+            self.postingBlocks.append(blocks)
             file.write(vbcode)
+            self.termOffsets[indexTerm[0]] = position
+            position += len(vbcode)
+
+    @staticmethod
+    def _postingListToBinary(codec, termId, postings):
+        """ Encode the postings of a term as written in an index file, returns the bytes and the block headers (last
+        doc id, byte offset, maximum tf) """
+        vbcode = bytearray([])
+        # Postings are cut in blocks of postingBlockSize postings. Each block has a header (gap from the last doc
+        # id of the previous block to its own last doc id, byte offset of its postings, maximum tf) and all
+        # headers are written before the postings, so that a reader can jump over whole blocks.
+        headers = bytearray([])
+        term_code = bytearray([])
+        blocks = []
+        previous_posting_id = 0
+        previous_last_id = 0
+        for start in range(0, len(postings), postingBlockSize):
+            block = postings[start:start + postingBlockSize]
+            offset = len(term_code)
+            gaps = []
+            for posting in block:
+                gaps.append(posting[0] - previous_posting_id)
+                previous_posting_id = posting[0]
+            term_code.extend(codec.encodePostings(gaps, [x[1] for x in block]))
+            max_tf = max([x[1] for x in block])
+            headers.extend(intToVBCode(block[-1][0] - previous_last_id))
+            headers.extend(intToVBCode(offset))
+            headers.extend(intToVBCode(max_tf))
+            previous_last_id = block[-1][0]
+            blocks.append((block[-1][0], offset, max_tf))
+        # An integer is put at the beginning of this byte array for the current term in order to know how many
+        # postings there are before the next term, then the term id and the size of its postings in bytes
+        vbcode.extend(intToVBCode(len(postings)))
+        vbcode.extend(intToVBCode(termId))
+        vbcode.extend(intToVBCode(len(term_code)))
+        vbcode.extend(headers)
+        vbcode.extend(term_code)
+        return vbcode, blocks
+
+    @staticmethod
+    def _readFileHeader(file):
+        """ Read the header of an open index file, returns the codec of its postings """
+        codec, position = readIndexHeader(file.read(16))
+        file.seek(position)
+        return codec
+
+    def _readPostingList(self, file, codec):
+        """ Read the next term of an open file in VB Code, returns its term id, its postings and its block headers
+        (last doc id, byte offset, maximum tf), or None at the end of the file """
+        nbPostings = VBCodeToFirstInt(file)
+        if nbPostings is None:
+            return None
+        termId = VBCodeToFirstInt(file)
+        size = VBCodeToFirstInt(file)
+        blocks = []
+        lastPostingId = 0
+        for i in range(-(-nbPostings // postingBlockSize)):
+            lastPostingId += VBCodeToFirstInt(file)
+            offset = VBCodeToFirstInt(file)
+            blocks.append((lastPostingId, offset, VBCodeToFirstInt(file)))
+        postings = decodeBlocks(codec, file.read(size), blocks, nbPostings)
+        return termId, postings, blocks
 
     def _binaryToIndex(self, file):
         """ Read an open file in VB Code to get the inverted index """
-        nbPostings = VBCodeToFirstInt(file)
-        while nbPostings is not None:
-            termId = VBCodeToFirstInt(file)
-            postings = []
-            previousPostingId = 0
-            for i in range(nbPostings):
-                postingId = VBCodeToFirstInt(file) + previousPostingId
-                postingCount = VBCodeToFirstInt(file)
-                postings.append((postingId, postingCount))
-                previousPostingId = postingId
-            self.invertedIndex.append((termId, postings))
-            nbPostings = VBCodeToFirstInt(file)
+        self.postingBlocks = []
+        codec = self._readFileHeader(file)
+        postingLists = []
+        postingList = self._readPostingList(file, codec)
+        while postingList is not None:
+            postingLists.append(postingList[:2])
+            self.postingBlocks.append(postingList[2])
+            postingList = self._readPostingList(file, codec)
+        self.invertedIndex = PostingArrays.fromPostingLists(postingLists)
+
+    def _termOffsetsToBinary(self, file):
+        """ Write the term offset table in an open file: number of terms, then byte offset of each term in the
+        inverted index file and its df, by term id """
+        file.write(struct.pack("=I", len(self.termOffsets)))
+        self.termOffsets.tofile(file)
+        self.documentFrequency.tofile(file)
+
+    def _binaryToTermOffsets(self, file):
+        """ Read the term offset table from an open file """
+        termLen, = struct.unpack("=I", file.read(4))
+        self.termOffsets = array('Q')
+        self.termOffsets.fromfile(file, termLen)
+        self.documentFrequency = array('I')
+        self.documentFrequency.fromfile(file, termLen)
+
+    def _encodePositions(self, positions):
+        """ Encode the positions (dictionary of sorted positions by (termId, docId)) of the terms of the inverted
+        index, in the order of their postings """
+        self.positions = [b"".join([encodePositions(positions[(termId, docId)]) for docId, tf in postings])
+                          for termId, postings in self.invertedIndex]
+
+    def _positionsToBinary(self, file):
+        """ Write the positions in an open file, by term in the order of the inverted index (see _positionsRecord).
+        They are kept apart from the postings so that queries without phrases never read them """
+        self.positionOffsets = array('Q', [0] * (self.invertedIndex[-1][0] + 1 if self.invertedIndex else 0))
+        position = 0
+        for indexTerm, termPositions in zip(self.invertedIndex, self.positions):
+            code = self._positionsRecord(indexTerm[0], termPositions)
+            file.write(code)
+            self.positionOffsets[indexTerm[0]] = position
+            position += len(code)
+
+    @staticmethod
+    def _positionsRecord(termId, termPositions):
+        """ Positions of a term as written in a file: term id, size in bytes, then the positions of each posting (see
+        Codec.encodePositions) """
+        return intToVBCode(termId) + intToVBCode(len(termPositions)) + termPositions
+
+    def _positionOffsetsToBinary(self, file):
+        """ Write the position offset table in an open file: number of terms, then byte offset of each term in the
+        positions file, by term id """
+        file.write(struct.pack("=I", len(self.positionOffsets)))
+        self.positionOffsets.tofile(file)
+
+    def _binaryToPositionOffsets(self, file):
+        """ Read the position offset table from an open file """
+        termLen, = struct.unpack("=I", file.read(4))
+        self.positionOffsets = array('Q')
+        self.positionOffsets.fromfile(file, termLen)
+
+    @staticmethod
+    def _readPositions(file):
+        """ Read the positions of the next term of an open file, returns its term id and its encoded positions, or
+        None at the end of the file """
+        termId = VBCodeToFirstInt(file)
+        if termId is None:
+            return None
+        return termId, file.read(VBCodeToFirstInt(file))
+
+    def getPositions(self, termId, docIds):
+        """ Positions of a term in some documents (sorted sequence of doc ids), as a dictionary by doc id. Only the
+        positions of these documents are decoded, the others are jumped over """
+        termPositions = self.positions[termId]
+        result = {}
+        wanted = iter(docIds)
+        nextDocId = next(wanted, None)
+        position = 0
+        for docId, tf in self.invertedIndex[termId][1]:
+            while nextDocId is not None and nextDocId < docId:
+                nextDocId = next(wanted, None)
+            if nextDocId is None:
+                break
+            size, position = VBCodeToIntAt(termPositions, position)
+            if docId == nextDocId:
+                result[docId] = decodePositions(termPositions[position:position + size])
+            position += size
+        return result
+
+    def getPostingBlocks(self, termId):
+        """ Headers (last doc id, byte offset, maximum tf) of the blocks of postings of a term """
+        if isinstance(self.invertedIndex, InvertedIndexFile):
+            return self.invertedIndex.getPostingBlocks(termId)
+        # An index built in memory and not saved gets the headers of the blocks of a term when they are first needed
+        if len(self.postingBlocks) != len(self.invertedIndex):
+            self.postingBlocks = [None] * len(self.invertedIndex)
+        if self.postingBlocks[termId] is None:
+            self.postingBlocks[termId] = self._postingListToBinary(codecs[codecIds[postingCodec]], termId,
+                                                                   self.invertedIndex[termId][1])[1]
+        return self.postingBlocks[termId]
+
+    def getBlockPostings(self, termId, block):
+        """ Postings of one block of a term """
+        if isinstance(self.invertedIndex, InvertedIndexFile):
+            return self.invertedIndex.getBlockPostings(termId, block)
+        return self.invertedIndex[termId][1][block * postingBlockSize:(block + 1) * postingBlockSize]
+
+    def computeStatistics(self):
+        """ Compute df for each term, length of each document and norm of each document for every weighting scheme
+        so that they are not recomputed at query time """
+        N = self.docLen
+        size = max(self.docId.values()) + 1 if self.docId else 0
+        self.documentFrequency = array('I', [0] * len(self.invertedIndex))
+        self.documentLength = array('I', [0] * size)
+        self.documentNorm = {weightType: array('d', [0.0] * size) for weightType in statisticsWeightTypes}
+        tfIdfNorm = self.documentNorm['tf_idf']
+        normalizedTfNorm = self.documentNorm['normalized_tf']
+        normalizedTfIdfNorm = self.documentNorm['normalized_tf_idf']
+        for termId, postings in self.invertedIndex:
+            df = len(postings)
+            if df == 0:
+                continue
+            self.documentFrequency[termId] = df
+            idf = math.log10(N / df)
+            max_tf = max(postings.tfs)
+            for docId, tf in postings:
+                self.documentLength[docId] += tf
+                tfIdfNorm[docId] += tf * idf
+                normalizedTfNorm[docId] += tf / max_tf
+                normalizedTfIdfNorm[docId] += (1 + math.log10(tf)) * idf
+
+    def _statisticsToBinary(self, file):
+        """ Write collection statistics in an open file: a header (N, number of terms, size of the document arrays)
+        followed by the raw df, length and norm arrays """
+        file.write(struct.pack("=III", self.docLen, len(self.documentFrequency), len(self.documentLength)))
+        self.documentFrequency.tofile(file)
+        self.documentLength.tofile(file)
+        for weightType in statisticsWeightTypes:
+            self.documentNorm[weightType].tofile(file)
+
+    def _binaryToStatistics(self, file):
+        """ Read collection statistics from an open file """
+        N, termLen, size = struct.unpack("=III", file.read(12))
+        self.documentFrequency = array('I')
+        self.documentFrequency.fromfile(file, termLen)
+        self.documentLength = array('I')
+        self.documentLength.fromfile(file, size)
+        self.documentNorm = {}
+        for weightType in statisticsWeightTypes:
+            self.documentNorm[weightType] = array('d')
+            self.documentNorm[weightType].fromfile(file, size)
 
     def saveIndex(self):
         """ Save the inverted index on hard-drive """
         if self.indexLocation is not None:
-            # Save invertedIndex in variable byte code
-            with open(self.indexLocation + "/invertedIndex", mode="wb") as file:
-                self._indexToBinary(file)
-            # Save termId
-            _termById = {self.termId[term]: term for term in self.termId}
-            _termLen = len(_termById)
-            with open(self.indexLocation + "/termId", mode="w") as file:
-                for termId in range(_termLen):
-                    file.write(str(termId) + " " + str(_termById[termId]) + "\n")
+            # Statistics (and df for the term offset table)
+            self.computeStatistics()
+            # Save invertedIndex in variable byte code, with the term offsets in the inverted index and the positions
+            # for a positional index, unless it is already on hard-drive (written by a merge of block indexes, or
+            # loaded from it)
+            if not isinstance(self.invertedIndex, InvertedIndexFile):
+                with open(self.indexLocation + "/invertedIndex", mode="wb") as file:
+                    self._indexToBinary(file)
+                with open(self.indexLocation + "/termOffsets", mode="wb") as file:
+                    self._termOffsetsToBinary(file)
+                if self.positional:
+                    with open(self.indexLocation + "/positions", mode="wb") as file:
+                        self._positionsToBinary(file)
+                    with open(self.indexLocation + "/positionOffsets", mode="wb") as file:
+                        self._positionOffsetsToBinary(file)
+            if not self.positional and os.path.isfile(self.indexLocation + "/positionOffsets"):
+                os.remove(self.indexLocation + "/positionOffsets")
+            # Save statistics
+            with open(self.indexLocation + "/statistics", mode="wb") as file:
+                self._statisticsToBinary(file)
+            # Save termId in a binary term dictionary, unless it is the one loaded from it
+            if not isinstance(self.termId, TermDictionary):
+                with open(self.indexLocation + "/terms", mode="wb") as file:
+                    writeTermDictionary(file, self.termId)
+                with open(self.indexLocation + "/permuterm", mode="wb") as file:
+                    writePermutermIndex(file, self.termId)
+                with open(self.indexLocation + "/kgrams", mode="wb") as file:
+                    file.write(kgramIndexToBinary(self.termId))
             # Save docId
             _docById = {self.docId[doc]: doc for doc in self.docId}
             with open(self.indexLocation + "/docId", mode="w") as file:
@@ -120,20 +637,44 @@ class Collection:
     def loadIndex(self):
         """ Load inverted index from hard-drive """
         if self.indexLocation is not None:
-            # Load invertedIndex
+            # Load invertedIndex: memory-mapped and decoded lazily with the term offsets, or entirely decoded for an
+            # index saved without them
             self.invertedIndex = []
-            with open(self.indexLocation + "/invertedIndex", mode="rb") as file:
-                self._binaryToIndex(file)
-            # Load termId
+            if os.path.isfile(self.indexLocation + "/termOffsets"):
+                with open(self.indexLocation + "/termOffsets", mode="rb") as file:
+                    self._binaryToTermOffsets(file)
+                self.invertedIndex = InvertedIndexFile(self.indexLocation + "/invertedIndex", self.termOffsets,
+                                                       postingCacheSize)
+            else:
+                with open(self.indexLocation + "/invertedIndex", mode="rb") as file:
+                    self._binaryToIndex(file)
+            # Load positions (memory-mapped) if the index is positional
+            self.positional = os.path.isfile(self.indexLocation + "/positionOffsets")
+            if self.positional:
+                with open(self.indexLocation + "/positionOffsets", mode="rb") as file:
+                    self._binaryToPositionOffsets(file)
+                self.positions = PositionsFile(self.indexLocation + "/positions", self.positionOffsets)
+            # Load termId: memory-mapped term dictionary, or text file of an index saved without it
             self.termId = {}
-            with open(self.indexLocation + "/termId", mode="r") as file:
-                line = file.readline().replace("\n", "")
-                while line != "":
-                    termId = line.split(" ")[0]
-                    term = line.split(" ")[1]
-                    self.termId[term] = int(termId)
-                    line = file.readline().replace("\n", "")
+            self.wildcardIndex = None
+            self.spellingIndex = None
+            self.spellingCache = {}
+            if os.path.isfile(self.indexLocation + "/terms"):
+                self.termId = TermDictionary(self.indexLocation + "/terms")
                 self.termLen = len(self.termId)
+            else:
+                with open(self.indexLocation + "/termId", mode="r") as file:
+                    line = file.readline().replace("\n", "")
+                    while line != "":
+                        termId = line.split(" ")[0]
+                        term = line.split(" ")[1]
+                        self.termId[term] = int(termId)
+                        line = file.readline().replace("\n", "")
+                    self.termLen = len(self.termId)
+            if os.path.isfile(self.indexLocation + "/permuterm"):
+                self.wildcardIndex = PermutermIndex.load(self.indexLocation + "/permuterm", self.termLen)
+            if os.path.isfile(self.indexLocation + "/kgrams"):
+                self.spellingIndex = KgramIndex.load(self.indexLocation + "/kgrams")
             # Load docId
             self.docId = {}
             with open(self.indexLocation + "/docId", mode="r") as file:
@@ -144,60 +685,101 @@ class Collection:
                     self.docId[doc] = int(docId)
                     line = file.readline().replace("\n", "")
                 self.docLen = len(self.docId)
+            # Load statistics, or compute them for an index saved without
+            if os.path.isfile(self.indexLocation + "/statistics"):
+                with open(self.indexLocation + "/statistics", mode="rb") as file:
+                    self._binaryToStatistics(file)
+            else:
+                self.computeStatistics()
         else:
             print("No location specified to load inverted index.")
 
     def getTermId(self, term):
         return self.termId[term]
 
-
-class CACMCollection(Collection):
-
-    def __init__(self, indexLocation = "indexCACM"):
-        Collection.__init__(self, indexLocation)
+    def getCollectionSize(self):
+        """ Number of documents the df are counted on, N of the idf """
+        return self.docLen
+
+    def getDocumentFrequency(self, termId):
+        """ df of a term, counted from its postings when the statistics were not computed """
+        if termId < len(self.documentFrequency):
+            return self.documentFrequency[termId]
+        return len(self.invertedIndex[termId][1])
+
+    def getWildcardIndex(self):
+        """ Permuterm index of the terms, built in memory for an index which was not saved with one (and rebuilt when
+        terms are added) """
+        if self.wildcardIndex is None or self.wildcardIndex.termLen != self.termLen:
+            self.wildcardIndex = PermutermIndex.fromTerms(self.termId)
+        return self.wildcardIndex
+
+    def getSpellingIndex(self):
+        """ k-gram index of the terms, built in memory for an index which was not saved with one (and rebuilt when
+        terms are added) """
+        if self.spellingIndex is None or len(self.spellingIndex) != self.termLen:
+            self.spellingIndex = KgramIndex.fromTerms(self.termId)
+            self.spellingCache = {}
+        return self.spellingIndex
+
+    def spellingCandidates(self, term):
+        """ Terms of the collection closest to a term which is not in it, the most frequent first: the terms one edit
+        away if there are some, else the terms two edits away... up to the maximum distance """
+        maxDistance = min(spellingMaxDistance, len(term) // 3)
+        if len(term) < spellingMinLength or term in self.commonWords or maxDistance == 0:
+            return []
+        index = self.getSpellingIndex()
+        # Terms whose documents were all deleted are not suggested (df are unknown before statistics are computed)
+        df = self.documentFrequency
+        # A lookup at a larger distance reads more postings and compares more terms, so that it is only done when
+        # there is no closer term
+        for distance in range(1, maxDistance + 1):
+            candidates = [(termDistance, -(df[termId] if termId < len(df) else 0), termId)
+                          for termDistance, termId in index.similar(term, distance)
+                          if termId >= len(df) or df[termId] > 0]
+            if len(candidates) > 0:
+                return [index.term(termId) for _, _, termId in sorted(candidates)]
+        return []
+
+    def correctTerm(self, term):
+        """ Spelling correction of a term which is not in the collection, None if no term is close enough """
+        # The cache is emptied when the k-gram index is rebuilt
+        self.getSpellingIndex()
+        if term not in self.spellingCache:
+            candidates = self.spellingCandidates(term)
+            self.spellingCache[term] = candidates[0] if len(candidates) > 0 else None
+        return self.spellingCache[term]
+
+    def indexVersion(self):
+        """ Checksum of the number of documents and of the df of every term, identifying the layout of the postings
+        that data saved next to the index (such as weights) is aligned with """
+        return zlib.crc32(struct.pack("=I", self.docLen) + array('I', self.documentFrequency).tobytes())
+
+    @abstractmethod
+    def readDocuments(self):
+        """ Stream of (docKey, fields) of the documents of the collection """
 
     def answerQuestion(self):
-        """ To answer the questions from the exercise about collections """
-
-        common_words = self.commonWords
-        nb_documents = 0
-        tokens = []
-        vocabulary_frequency = {}
-        half_tokens = []
-        half_vocabulary_frequency = {}
-
-        with open("Data/CACM/cacm.all", mode="r") as all:
-            readLine = False
-            for line in all:
-                if line[:1] == ".":
-                    readLine = False
-                if readLine:
-                    new_tokens = [x for x in nltk.wordpunct_tokenize(line.lower()) if x not in common_words]
-                    tokens += new_tokens
-                    if nb_documents % 2 == 1:
-                        half_tokens += new_tokens
-                if line[:2] == ".I":
-                    nb_documents += 1
-                if line[:2] in [".T", ".W", ".K"]:
-                    readLine = True
-
-        for token in tokens:
-            if token not in vocabulary_frequency:
-                vocabulary_frequency[token] = 1
-            else:
-                vocabulary_frequency[token] += 1
+        """ To answer the questions from the exercise about collections. Documents are read and analyzed one at a
+        time, only the frequency of each term is kept """
+
+        analyzer = self.analyzer
+        nb_tokens = 0
+        vocabulary_frequency = Counter()
+        nb_half_tokens = 0
+        half_vocabulary_frequency = Counter()
+
+        for nb_documents, (docKey, fields) in enumerate(self.readDocuments()):
+            tokens = analyzer.analyze(documentText(fields))
+            nb_tokens += len(tokens)
+            vocabulary_frequency.update(tokens)
+            if nb_documents % 2 == 0:
+                nb_half_tokens += len(tokens)
+                half_vocabulary_frequency.update(tokens)
 
-        nb_tokens = len(tokens)
         size_vocabulary = len(vocabulary_frequency)
-
-        for token in half_tokens:
-            if token not in half_vocabulary_frequency:
-                half_vocabulary_frequency[token] = 1
-            else:
-                half_vocabulary_frequency[token] += 1
-
-        nb_half_tokens = len(half_tokens)
         size_half_vocabulary = len(half_vocabulary_frequency)
+        del half_vocabulary_frequency
 
         b = math.log(size_vocabulary / size_half_vocabulary) / math.log(nb_tokens / nb_half_tokens)
         k = size_vocabulary/(math.pow(nb_tokens, b))
@@ -237,77 +819,52 @@ class CACMCollection(Collection):
 
         plt.show()
 
+
+class CACMCollection(Collection):
+
+    def __init__(self, indexLocation = "indexCACM", positional = False):
+        Collection.__init__(self, indexLocation, positional)
+
+    def readDocuments(self):
+        return readCACMDocuments()
+
     def constructIndex(self):
-        """ Construct inverted index for CACM Collection (in memory) """
-
-        # Class to describe a CACM document
-        class _Document:
-            def __init__(self, ID):
-                self.ID = ID
-                self.title = ""
-                self.summary = ""
-                self.keywords = ""
-
-        # Common words
-        common_words = self.commonWords
-
-        # Reading all documents line by line
-        all = open("Data/CACM/cacm.all", mode="r")
-
-        documents = []
-        readTitle = False
-        readSummary = False
-        readKeywords = False
-
-        for line in all:
-            if line[:1] == ".":
-                readTitle = False
-                readSummary = False
-                readKeywords = False
-            if readTitle:
-                document.title = document.title + "\n" + line.lower()
-            if readSummary:
-                document.summary = document.summary + "\n" + line.lower()
-            if readKeywords:
-                document.keywords = document.keywords + "\n" + line.lower()
-            if line[:2] == ".I":
-                document = _Document(int(line.split(" ")[-1].replace("\n","")))
-                documents.append(document)
-            if line[:2] == ".T":
-                readTitle = True
-                readSummary = False
-                readKeywords = False
-            if line[:2] == ".W":
-                readTitle = False
-                readSummary = True
-                readKeywords = False
-            if line[:2] == ".K":
-                readTitle = False
-                readSummary = False
-                readKeywords = True
-        self.docLen = len(documents)
-
-        # Token identification and list of term id / doc id
-        for document in documents:
-            self.docId[document.ID] = document.ID
-            documentTokens = []
-            documentTokens += nltk.wordpunct_tokenize(document.title)
-            documentTokens += nltk.wordpunct_tokenize(document.summary)
-            documentTokens += nltk.wordpunct_tokenize(document.keywords)
-            documentTokens = [x for x in documentTokens if not x in common_words]
-            for token in documentTokens:
+        """ Construct inverted index for CACM Collection (in memory), reading the documents one at a time """
+
+        # Token identification and list of term id / doc id / tf: tf are counted as each document is tokenized, so
+        # that there is one element per distinct term of a document (and positions of the tokens, counted before
+        # common words are removed, for a positional index)
+        positions = {}
+        for docId, fields in self.readDocuments():
+            self.docId[docId] = docId
+            self.docLen += 1
+            documentTokens = self.analyzer.analyzeWithPositions(documentText(fields))
+            tfs = {}
+            for position, token in documentTokens:
                 if token in self.termId:
                     termId = self.termId[token]
                 else:
                     termId = self.termLen
                     self.termLen += 1
                     self.termId[token] = termId
-                self.list.append((termId,document.ID))
+                tfs[termId] = tfs.get(termId, 0) + 1
+                if self.positional:
+                    positions.setdefault((termId, docId), []).append(position)
+            self.list.extend([(termId, docId, tf) for termId, tf in tfs.items()])
         self.list.sort()
 
-        # Inverted index creation
-        self.invertedIndex = [(key, [x[1] for x in group]) for key, group in groupby(self.list, key=lambda x: x[0])]
-        self.invertedIndex = [(y[0], sorted(set([(z, y[1].count(z)) for z in y[1]]))) for y in self.invertedIndex]
+        # Inverted index creation, by concatenation of the postings of each term in arrays
+        offsets = array('Q', [0] * (self.termLen + 1))
+        for termId, _, _ in self.list:
+            offsets[termId + 1] += 1
+        for termId in range(self.termLen):
+            offsets[termId + 1] += offsets[termId]
+        self.invertedIndex = PostingArrays(array('I', [x[1] for x in self.list]),
+                                           compactArray([x[2] for x in self.list]), offsets)
+        if self.positional:
+            self._encodePositions(positions)
+        # Statistics are also needed by an index which is queried without being saved
+        self.computeStatistics()
 
     def queryTest(self):
         """ To get queries and awaited responses for test """
@@ -341,326 +898,251 @@ class CACMCollection(Collection):
         return queries
 
 
-class CS276Collection(Collection):
-
-    def __init__(self, indexLocation = "indexCS276"):
-        Collection.__init__(self, indexLocation)
-
-    def answerQuestion(self):
-        """ To answer the questions from the exercise about collections """
-
-        common_words = self.commonWords
-        nb_documents = 0
-        tokens = []
-        vocabulary_frequency = {}
-        half_tokens = []
-        half_vocabulary_frequency = {}
-
-        for blockID in range(10):
-            documentsNames = os.listdir("Data/CS276/pa1-data/" + str(blockID))
-            for documentName in documentsNames:
-                with open("Data/CS276/pa1-data/" + str(blockID) + "/" + documentName, mode="r") as documentFile:
-                    nb_documents += 1
-                    documentContent = documentFile.read().replace("\n", " ")
-                    new_tokens = [x for x in nltk.wordpunct_tokenize(documentContent.lower()) if x not in common_words]
-                    tokens += new_tokens
-                    if nb_documents % 2 == 1:
-                        half_tokens += new_tokens
-
-        for token in tokens:
-            if token not in vocabulary_frequency:
-                vocabulary_frequency[token] = 1
+def parseCS276Documents(task):
+    """ Parse and invert some documents of CS276 (task: document names, doc id of the first one, analyzer and whether
+    positions are indexed), in a worker process which shares nothing with the others. Terms get local ids, in the
+    order they are found. Returns a sorted run keyed by local term id: the terms, and for each of them the doc ids and
+    tf of its postings (and their encoded positions for a positional index) """
+
+    documentNames, firstDocId, analyzer, positional = task
+    termId = {}
+    terms = []
+    docIds = []
+    tfs = []
+    positions = []
+    for docId, (documentName, fields) in enumerate(readCS276Documents(documentNames), firstDocId):
+        # Tokenize document content, counting the tf of each term in the document (in-mapper combining): there is
+        # no reduce step left, postings only have to be concatenated
+        documentTfs = {}
+        documentPositions = {}
+        for position, token in analyzer.analyzeWithPositions(documentText(fields)):
+            if token in termId:
+                term_id = termId[token]
             else:
-                vocabulary_frequency[token] += 1
+                term_id = len(terms)
+                termId[token] = term_id
+                terms.append(token)
+                docIds.append([])
+                tfs.append([])
+                if positional:
+                    positions.append(bytearray([]))
+            documentTfs[term_id] = documentTfs.get(term_id, 0) + 1
+            if positional:
+                documentPositions.setdefault(term_id, []).append(position)
+        # Documents are parsed in doc id order, so the postings of each term are sorted
+        for term_id, tf in documentTfs.items():
+            docIds[term_id].append(docId)
+            tfs[term_id].append(tf)
+        for term_id, termPositions in documentPositions.items():
+            positions[term_id].extend(encodePositions(termPositions))
+    return terms, [array('I', x) for x in docIds], [array('I', x) for x in tfs], positions
+
+
+class PostingBuffers:
+    """ Inverted index of a run being built in memory (SPIMI): each term has growable buffers of doc ids and tf (and
+    of encoded positions), to which postings are added in doc id order, and the memory they use is estimated """
+
+    # Estimated memory used by a term (dictionary entry and buffers) besides its postings
+    termMemory = 200
+
+    def __init__(self, positional):
+        self.positional = positional
+        self.docIds = {}
+        self.tfs = {}
+        self.positions = {}
+        self.size = 0
+
+    def __len__(self):
+        return len(self.docIds)
+
+    def extend(self, termId, docIds, tfs, positions=None):
+        """ Add postings of a term, whose doc ids are greater than the ones it already has """
+        if termId not in self.docIds:
+            self.docIds[termId] = array('I')
+            self.tfs[termId] = array('I')
+            self.positions[termId] = bytearray([])
+        self.docIds[termId].extend(docIds)
+        self.tfs[termId].extend(tfs)
+        self.size += len(docIds) * (self.docIds[termId].itemsize + self.tfs[termId].itemsize)
+        if self.positional:
+            self.positions[termId].extend(positions)
+            self.size += len(positions)
+
+    def memory(self):
+        """ Estimated memory used by the buffers, in bytes """
+        return self.size + self.termMemory * len(self.docIds)
+
+    def invertedIndex(self):
+        """ List of (termId, postings) sorted by term id, and the encoded positions of each term in the same order """
+        termIds = sorted(self.docIds)
+        return [(termId, PostingList(self.docIds[termId], self.tfs[termId])) for termId in termIds], \
+               [self.positions[termId] for termId in termIds] if self.positional else []
 
-        nb_tokens = len(tokens)
-        size_vocabulary = len(vocabulary_frequency)
-
-        for token in half_tokens:
-            if token not in half_vocabulary_frequency:
-                half_vocabulary_frequency[token] = 1
-            else:
-                half_vocabulary_frequency[token] += 1
 
-        nb_half_tokens = len(half_tokens)
-        size_half_vocabulary = len(half_vocabulary_frequency)
-
-        del half_tokens
-        del half_vocabulary_frequency
-
-        b = math.log(size_vocabulary / size_half_vocabulary) / math.log(nb_tokens / nb_half_tokens)
-        k = size_vocabulary/(math.pow(nb_tokens, b))
-
-        token_estimation = 1000000
-        estimated_size = int(k * math.pow(token_estimation, b))
-
-        print('\nExercice 1')
-        print(f'{nb_tokens} tokens found in this collection.')
-
-        print('\nExercice 2')
-        print(f'{size_vocabulary} words in the vocabulary.')
-
-        print('\nExercice 3')
-        print('For half of the collection, we get:')
-        print(f'{nb_half_tokens} tokens')
-        print(f'{size_half_vocabulary} words in the vocabulary.')
-        print("Parameters for Heaps' law are therefore:")
-        print(f"    k = {k}         b = {b}")
-
-        print('\nExercice 4')
-        print(f"With Heaps' law, vocabulary size for {token_estimation} tokens would be {estimated_size} words.")
-
-        frequencies = list(vocabulary_frequency.values())
-        frequencies.sort()
-        frequencies = frequencies[::-1]
-        ranks = range(1, len(frequencies) + 1)
-
-        logfrequencies = [math.log(x) for x in frequencies]
-        logranks = [math.log(x) for x in ranks]
-
-        f, (ax1, ax2) = plt.subplots(2, 1)
-        ax1.plot(ranks, frequencies)
-        ax1.set_title('Frequencies in relation to Ranks')
-        ax2.scatter(logranks, logfrequencies)
-        ax2.set_title('log(Frequencies) in relation to log(Ranks)')
-
-        plt.show()
+class CS276Collection(Collection):
 
-    def parseBlock(self, blockID):
-        """ Create a partial inverted index (in memory) for one block """
+    def __init__(self, indexLocation = "indexCS276", positional = False):
+        Collection.__init__(self, indexLocation, positional)
 
-        global nbThreadMap, nbThreadReduce
+    def readDocuments(self):
+        return readCS276Documents()
 
-        self.invertedIndex = []
+    def invertDocuments(self, buffers, documentNames, parsedDocuments):
+        """ Add the run of documents inverted by parseCS276Documents to the posting buffers of the current run: each
+        local term id is mapped once to a global one (new terms get the next global term ids) and its postings are
+        appended as a whole. The documents were given the next doc ids by the worker """
 
-        # Common words list
-        common_words = open("Data/CACM/common_words", mode='r').read().splitlines()
-        common_words += list(string.punctuation)
-
-        print("Generating index for block " + str(blockID) + "...")
-
-        list_after_mapper = []
-        docLen = self.docLen
-        docId = self.docId
-        termLen = self.termLen
-        termId = self.termId
-
-        locker_list = RLock()
-        locker_doc = RLock()
-        locker_term = RLock()
-        locker_index = RLock()
-
-        class Mapper(Thread):
-            """ Mapper for the map reduce to get tokens in documents """
-
-            def __init__(self, documentsNames):
-                super().__init__()
-                self.tasks = documentsNames
-                self.daemon = True
-                self.start()
-
-            def run(self):
-                nonlocal list_after_mapper, docLen, docId, termLen, termId, common_words
-                while True:
-                    documentName = self.tasks.get()
-                    try:
-                        # Open the document
-                        documentFile = open("Data/CS276/pa1-data/" + str(blockID) + "/" + documentName, mode="r")
-                        documentContent = documentFile.read().replace("\n", " ")
-                        documentFile.close()
-                        # Add this document's name to the list of doc id
-                        with locker_doc:
-                            doc_id = docLen
-                            docId[str(blockID) + "/" + documentName] = doc_id
-                            docLen += 1
-                        # Tokenize document content
-                        documentTokens = nltk.wordpunct_tokenize(documentContent)
-                        documentTokens = [x for x in documentTokens if not x in common_words]
-                        for token in documentTokens:
-                            with locker_term:
-                                if token in termId:
-                                    term_id = termId[token]
-                                else:
-                                    term_id = termLen
-                                    termLen += 1
-                                    termId[token] = term_id
-                            with locker_list:
-                                list_after_mapper.append((term_id, doc_id))
-                    finally:
-                        # Mark this task as done, whether an exception happened or not
-                        self.tasks.task_done()
-
-        class MapperPool:
-            """ Pool of mappers consuming tasks from a queue (of document names) """
-
-            def __init__(self, num_threads):
-                self.tasks = Queue(num_threads)
-                for _ in range(num_threads):
-                    Mapper(self.tasks)
-
-            def add_task(self, documentName):
-                """ Add a task to the queue """
-                self.tasks.put(documentName)
-
-            def wait_completion(self):
-                """ Wait for completion of all the tasks in the queue """
-                self.tasks.join()
-
-        # Loading all documents of the current block in a mapper
-        documentsNames = os.listdir("Data/CS276/pa1-data/" + str(blockID))
-        mapper_pool = MapperPool(nbThreadMap)
-        for name in documentsNames:
-            mapper_pool.add_task(name)
-        mapper_pool.wait_completion()
-
-        self.docId = docId
-        self.docLen = docLen
-        self.termId = termId
-        self.termLen = termLen
-
-        list_after_mapper.sort()
-        list_before_reducer = [(key, [x[1] for x in group]) for key, group in groupby(list_after_mapper, key=lambda x: x[0])]
-        invertedIndex = []
-
-        class Reducer(Thread):
-            """ Reducer for the map reduce to get have a list of postings for each term """
-
-            def __init__(self, postings):
-                super().__init__()
-                self.tasks = postings
-                self.daemon = True
-                self.start()
-
-            def run(self):
-                nonlocal invertedIndex
-                while True:
-                    postings_list = self.tasks.get()
-                    try:
-                        with locker_index:
-                            invertedIndex.append(
-                                (postings_list[0], sorted(set([(z, postings_list[1].count(z)) for z in postings_list[1]]))))
-                    finally:
-                        # Mark this task as done, whether an exception happened or not
-                        self.tasks.task_done()
-
-        class ReducerPool:
-            """ Pool of reducers consuming tasks from a queue (of lists of postings) """
-
-            def __init__(self, num_threads):
-                self.tasks = Queue(num_threads)
-                for _ in range(num_threads):
-                    Reducer(self.tasks)
-
-            def add_task(self, postings):
-                """ Add a task to the queue """
-                self.tasks.put(postings)
-
-            def wait_completion(self):
-                """ Wait for completion of all the tasks in the queue """
-                self.tasks.join()
-
-        reducer_pool = ReducerPool(nbThreadReduce)
-        for postings in list_before_reducer:
-            reducer_pool.add_task(postings)
-        reducer_pool.wait_completion()
-
-        # Creating inverted index
-        invertedIndex.sort()
-        self.invertedIndex = invertedIndex
-
-        print("Index for block " + str(blockID) + " generated.")
+        terms, docIds, tfs, positions = parsedDocuments
 
-        # Release memory
-        del documentsNames
-        del list_after_mapper
-        del list_before_reducer
+        self.docId.update(zip(documentNames, range(self.docLen, self.docLen + len(documentNames))))
+        self.docLen += len(documentNames)
+        for term_id, term in enumerate(terms):
+            if term not in self.termId:
+                self.termId[term] = self.termLen
+                self.termLen += 1
+            buffers.extend(self.termId[term], docIds[term_id], tfs[term_id],
+                           positions[term_id] if self.positional else None)
 
     def saveBlockIndex(self, blockID):
-        """ Save the current partial inverted index for one block """
+        """ Save the current partial inverted index for one block (a run of the index construction) """
 
         if self.indexLocation is not None:
             # Save invertedIndex in variable byte code
             with open(self.indexLocation + "/" + str(blockID), mode="wb") as file:
                 self._indexToBinary(file)
+            if self.positional:
+                with open(self.indexLocation + "/" + str(blockID) + ".positions", mode="wb") as file:
+                    self._positionsToBinary(file)
         else:
             print("No location specified to save inverted index for block " + str(blockID) + ".")
 
         # Release memory
         self.invertedIndex = []
+        self.positions = []
 
-    def mergeBlockIndex(self, blockIndexFiles):
-        """ Merge all partial inverted index previously saved to get the whole inverted index """
+    def mergeBlockIndex(self, blockIndexFiles, blockPositionFiles=None):
+        """ Merge all partial inverted index previously saved into the inverted index file, with its term offset table
+        (and the positions of the terms, read from blockPositionFiles for a positional index). A heap gives the
+        blocks with the smallest next term id, and each merged posting list is written as soon as it is complete: only
+        the current posting list of each block is kept in memory. The merged index is then read lazily from disk """
 
-        # Reading the first element from each index
-        currentTermId = {}
+        codec = codecs[codecIds[postingCodec]]
+        blockCodecs = {blockID: self._readFileHeader(blockIndexFiles[blockID]) for blockID in blockIndexFiles}
+        heap = []
         currentPostings = {}
-        for blockID in blockIndexFiles.keys():
-            nbPostings = VBCodeToFirstInt(blockIndexFiles[blockID])
-            if nbPostings is not None:
-                currentTermId[blockID] = VBCodeToFirstInt(blockIndexFiles[blockID])
-                currentPostings[blockID] = []
-                previousPostingId = 0
-                for i in range(nbPostings):
-                    postingId = VBCodeToFirstInt(blockIndexFiles[blockID]) + previousPostingId
-                    postingCount = VBCodeToFirstInt(blockIndexFiles[blockID])
-                    currentPostings[blockID].append((postingId, postingCount))
-                    previousPostingId = postingId
+        currentPositions = {}
+
+        def readNext(blockID):
+            """ Read the next term of a block and push it on the heap, or close the block if it was the last one """
+            postingList = self._readPostingList(blockIndexFiles[blockID], blockCodecs[blockID])
+            if postingList is not None:
+                currentPostings[blockID] = postingList[1]
+                if blockPositionFiles is not None:
+                    # Positions of a block are written in the same term order as its postings
+                    currentPositions[blockID] = self._readPositions(blockPositionFiles[blockID])[1]
+                heapq.heappush(heap, (postingList[0], blockID))
             else:
-                # Closing the block if not any term id is found
                 blockIndexFiles[blockID].close()
+                if blockPositionFiles is not None:
+                    blockPositionFiles[blockID].close()
                 print("Block " + str(blockID) + " has been closed.")
-                del blockIndexFiles[blockID]
-                del currentTermId[blockID]
-                del currentPostings[blockID]
-
-        # Merging all elements with the smallest term id and reading the next element of those blocks
-        # (or close the file if it was the last element)
-        termId = 0
-        while termId < self.termLen:
-            blocksToMerge = [blockID for blockID in currentTermId.keys() if currentTermId[blockID] == termId]
-            self.invertedIndex.append([termId, []])
-            for blockID in blocksToMerge:
-                # Add postings from this block for this term id to the list
-                self.invertedIndex[termId][1].extend(currentPostings[blockID])
-                # Reading the next line or closing this block.
-                nbPostings = VBCodeToFirstInt(blockIndexFiles[blockID])
-                if nbPostings is not None:
-                    currentTermId[blockID] = VBCodeToFirstInt(blockIndexFiles[blockID])
-                    currentPostings[blockID] = []
-                    previousPostingId = 0
-                    for i in range(nbPostings):
-                        postingId = VBCodeToFirstInt(blockIndexFiles[blockID]) + previousPostingId
-                        postingCount = VBCodeToFirstInt(blockIndexFiles[blockID])
-                        currentPostings[blockID].append((postingId, postingCount))
-                        previousPostingId = postingId
-                else:
-                    # Closing the block
-                    blockIndexFiles[blockID].close()
-                    print("Block " + str(blockID) + " has been closed.")
-                    del blockIndexFiles[blockID]
-                    del currentTermId[blockID]
-                    del currentPostings[blockID]
-            termId += 1
 
-    def constructIndex(self):
-        """ Construct the inverted index block by block """
-
-        # Write inverted index for each block
-        for blockID in range(10):
-            self.parseBlock(blockID)
-
-            # Write index in Hard Drive
-            self.saveBlockIndex(blockID)
-            print("Index for block " + str(blockID) + " saved.")
+        # Reading the first element from each index
+        for blockID in list(blockIndexFiles.keys()):
+            readNext(blockID)
+
+        self.termOffsets = array('Q', [0] * self.termLen)
+        self.documentFrequency = array('I', [0] * self.termLen)
+        self.positionOffsets = array('Q', [0] * self.termLen)
+        indexFile = open(self.indexLocation + "/invertedIndex", mode="wb")
+        positionsFile = open(self.indexLocation + "/positions", mode="wb") if blockPositionFiles is not None else None
+        header = indexHeader(codec)
+        indexFile.write(header)
+        position = len(header)
+        positionsPosition = 0
+
+        # Merging all elements with the smallest term id and reading the next element of those blocks (or close the
+        # file if it was the last element). Blocks come out of the heap in order for a term id, and doc ids of a block
+        # are all greater than the doc ids of the previous blocks, so postings (and positions, without being decoded)
+        # are merged by concatenation
+        while len(heap) > 0:
+            termId = heap[0][0]
+            postings = []
+            termPositions = bytearray([])
+            while len(heap) > 0 and heap[0][0] == termId:
+                blockID = heapq.heappop(heap)[1]
+                postings.extend(currentPostings[blockID])
+                if positionsFile is not None:
+                    termPositions.extend(currentPositions[blockID])
+                readNext(blockID)
+            code = self._postingListToBinary(codec, termId, postings)[0]
+            indexFile.write(code)
+            self.termOffsets[termId] = position
+            self.documentFrequency[termId] = len(postings)
+            position += len(code)
+            if positionsFile is not None:
+                code = self._positionsRecord(termId, termPositions)
+                positionsFile.write(code)
+                self.positionOffsets[termId] = positionsPosition
+                positionsPosition += len(code)
+
+        indexFile.close()
+        with open(self.indexLocation + "/termOffsets", mode="wb") as file:
+            self._termOffsetsToBinary(file)
+        self.invertedIndex = InvertedIndexFile(self.indexLocation + "/invertedIndex", self.termOffsets,
+                                               postingCacheSize)
+        if positionsFile is not None:
+            positionsFile.close()
+            with open(self.indexLocation + "/positionOffsets", mode="wb") as file:
+                self._positionOffsetsToBinary(file)
+            self.positions = PositionsFile(self.indexLocation + "/positions", self.positionOffsets)
 
-        # Open files to merge all inverted index
+    def constructIndex(self):
+        """ Construct the inverted index in a single pass (SPIMI): documents are parsed in parallel by worker processes,
+        their postings are added to in-memory posting buffers, and a sorted run is written to hard-drive each time the
+        buffers reach indexMemoryBudget. Runs are then merged """
+
+        documentNames = list(cs276DocumentNames())
+        tasks = [(documentNames[start:start + documentsPerTask], start, self.analyzer, self.positional)
+                 for start in range(0, len(documentNames), documentsPerTask)]
+
+        # Worker results are inverted in the order of the documents, the doc id of a document is its rank
+        print("Generating index with " + str(nbProcesses) + " processes...")
+        nbRuns = 0
+        buffers = PostingBuffers(self.positional)
+        with Pool(nbProcesses) as pool:
+            for task, parsedDocuments in zip(tasks, pool.imap(parseCS276Documents, tasks)):
+                self.invertDocuments(buffers, task[0], parsedDocuments)
+                if buffers.memory() >= indexMemoryBudget:
+                    self.invertedIndex, self.positions = buffers.invertedIndex()
+                    buffers = PostingBuffers(self.positional)
+                    # Write run in Hard Drive
+                    self.saveBlockIndex(nbRuns)
+                    print("Run " + str(nbRuns) + " saved.")
+                    nbRuns += 1
+        if len(buffers) > 0:
+            self.invertedIndex, self.positions = buffers.invertedIndex()
+            self.saveBlockIndex(nbRuns)
+            print("Run " + str(nbRuns) + " saved.")
+            nbRuns += 1
+        del buffers
+
+        # Open files to merge all inverted index, read through buffers of mergeBufferSize bytes
         blockIndexFiles = {}
-        for blockID in range(10):
-            blockIndexFiles[blockID] = open(self.indexLocation + "/" + str(blockID), mode="rb")
+        for blockID in range(nbRuns):
+            blockIndexFiles[blockID] = open(self.indexLocation + "/" + str(blockID), mode="rb",
+                                            buffering=mergeBufferSize)
+
+        blockPositionFiles = None
+        if self.positional:
+            blockPositionFiles = {}
+            for blockID in range(nbRuns):
+                blockPositionFiles[blockID] = open(self.indexLocation + "/" + str(blockID) + ".positions", mode="rb",
+                                                   buffering=mergeBufferSize)
 
         # Merging
         print("Merging index from all blocks...")
-        self.mergeBlockIndex(blockIndexFiles)
+        self.mergeBlockIndex(blockIndexFiles, blockPositionFiles)
         print("Index merged.")
 
 
@@ -682,12 +1164,16 @@ if __name__ == "__main__":
 
     if answer_questions in ['Y', 'YES']:
         collection.answerQuestion()
-    elif os.path.isfile('index' + collection_name + '/docId') and os.path.isfile('index' + collection_name + '/termId') \
+    elif os.path.isfile('index' + collection_name + '/docId') and os.path.isfile('index' + collection_name + '/terms') \
             and os.path.isfile('index' + collection_name + '/invertedIndex'):
         print("Start loading...")
         collection.loadIndex()
         print("Index loaded.")
     else:
+        positional = ""
+        while positional not in ['Y', 'YES', 'N', 'NO']:
+            positional = input("Do you want a positional index (for phrase and NEAR queries) ? (YES or NO)\n> ").upper()
+        collection.positional = positional in ['Y', 'YES']
         start_time = datetime.datetime.now()
         collection.constructIndex()
         print(f"Index constructed. Time elapsed: {(datetime.datetime.now()-start_time).seconds}s")
@@ -0,0 +1,142 @@
+import mmap
+import struct
+from bisect import bisect_right
+from Codec import intToVBCode, VBCodeToIntAt
+
+
+# First bytes of term dictionary files
+dictionaryMagic = b"RIWD"
+
+# Header of a term dictionary file after the magic: number of terms per block, number of terms, number of blocks
+dictionaryHeader = struct.Struct("=III")
+
+# Number of terms in each front-coded block of the dictionary: a lookup decodes one block
+dictionaryBlockSize = 16
+
+
+def writeTermDictionary(file, termIds):
+    """ Write a term dictionary (mapping of terms to term ids) in an open file. Terms are sorted (by their UTF-8 bytes,
+    which is the order of the strings) and cut in blocks of dictionaryBlockSize terms. In a block, each term is written
+    as the length of the prefix it shares with the previous term, the length and the bytes of the rest of the term,
+    and its term id (in VB code). The byte offset of each block is written before the blocks, for a binary search on
+    their first terms """
+    terms = sorted([(term.encode(), termId) for term, termId in termIds.items()])
+    blocks = bytearray([])
+    blockOffsets = []
+    previous = b""
+    for i, (term, termId) in enumerate(terms):
+        if i % dictionaryBlockSize == 0:
+            blockOffsets.append(len(blocks))
+            previous = b""
+        prefix = 0
+        while prefix < min(len(term), len(previous)) and term[prefix] == previous[prefix]:
+            prefix += 1
+        blocks.extend(intToVBCode(prefix))
+        blocks.extend(intToVBCode(len(term) - prefix))
+        blocks.extend(term[prefix:])
+        blocks.extend(intToVBCode(termId))
+        previous = term
+    file.write(dictionaryMagic + dictionaryHeader.pack(dictionaryBlockSize, len(terms), len(blockOffsets)))
+    file.write(struct.pack("=" + str(len(blockOffsets)) + "Q", *blockOffsets))
+    file.write(blocks)
+
+
+class TermDictionary:
+    """ Term dictionary read from a memory-mapped file (see writeTermDictionary): a term is found by a binary search
+    on the first terms of the blocks, then by decoding its block. It can be used like the dictionary of term ids of a
+    collection, and iterates over terms in sorted order, also from a term or over the terms with a prefix """
+
+    def __init__(self, fileName):
+        with open(fileName, mode="rb") as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buffer[:len(dictionaryMagic)] != dictionaryMagic:
+            raise ValueError(f"{fileName} is not a term dictionary")
+        self.blockSize, self.termLen, nbBlocks = dictionaryHeader.unpack_from(self.buffer, len(dictionaryMagic))
+        start = len(dictionaryMagic) + dictionaryHeader.size
+        self.blockOffsets = memoryview(self.buffer)[start:start + 8 * nbBlocks].cast('Q')
+        self.blocksStart = start + 8 * nbBlocks
+
+    def __len__(self):
+        return self.termLen
+
+    def _decodeBlock(self, block, first=False):
+        """ Terms (in bytes) and term ids of a block, or only its first term """
+        position = self.blocksStart + self.blockOffsets[block]
+        end = self.blocksStart + self.blockOffsets[block + 1] if block + 1 < len(self.blockOffsets) \
+            else len(self.buffer)
+        terms = []
+        term = b""
+        while position < end:
+            prefix, position = VBCodeToIntAt(self.buffer, position)
+            size, position = VBCodeToIntAt(self.buffer, position)
+            term = term[:prefix] + self.buffer[position:position + size]
+            termId, position = VBCodeToIntAt(self.buffer, position + size)
+            terms.append((term, termId))
+            if first:
+                break
+        return terms
+
+    def _findBlock(self, term):
+        """ Index of the last block whose first term is lower than or equal to a term (in bytes), -1 if none is """
+        firstTerms = _FirstTerms(self)
+        return bisect_right(firstTerms, term) - 1
+
+    def get(self, term, default=None):
+        key = term.encode()
+        block = self._findBlock(key)
+        if block >= 0:
+            for blockTerm, termId in self._decodeBlock(block):
+                if blockTerm == key:
+                    return termId
+        return default
+
+    def __getitem__(self, term):
+        termId = self.get(term)
+        if termId is None:
+            raise KeyError(term)
+        return termId
+
+    def __contains__(self, term):
+        return self.get(term) is not None
+
+    def items(self, start=None, end=None):
+        """ (term, termId) in term order, from the term start (included) to the term end (excluded) """
+        startKey = start.encode() if start is not None else b""
+        endKey = end.encode() if end is not None else None
+        for block in range(max(0, self._findBlock(startKey)), len(self.blockOffsets)):
+            for term, termId in self._decodeBlock(block):
+                if endKey is not None and term >= endKey:
+                    return
+                if term >= startKey:
+                    yield term.decode(), termId
+
+    def prefix(self, prefix):
+        """ (term, termId) of the terms starting with a prefix, in term order """
+        for term, termId in self.items(prefix):
+            if not term.startswith(prefix):
+                return
+            yield term, termId
+
+    def __iter__(self):
+        for term, _ in self.items():
+            yield term
+
+    def keys(self):
+        return iter(self)
+
+    def values(self):
+        for _, termId in self.items():
+            yield termId
+
+
+class _FirstTerms:
+    """ First term (in bytes) of each block of a dictionary, read when the binary search needs it """
+
+    def __init__(self, dictionary):
+        self.dictionary = dictionary
+
+    def __len__(self):
+        return len(self.dictionary.blockOffsets)
+
+    def __getitem__(self, block):
+        return self.dictionary._decodeBlock(block, first=True)[0][0]
@@ -0,0 +1,57 @@
+import os
+
+
+# Size in bytes of the read buffer of each document file
+readBufferSize = 1 << 20
+
+# Location of the documents of each collection
+cacmFile = "Data/CACM/cacm.all"
+cs276Directory = "Data/CS276/pa1-data"
+
+# Indexed fields of a CACM document, by the line that starts them
+cacmFields = {".T": "title", ".W": "summary", ".K": "keywords"}
+
+
+def documentText(fields):
+    """ Text of a document to analyze, from its fields """
+    return "\n".join(fields.values())
+
+
+def readCACMDocuments(fileName=cacmFile):
+    """ Stream of (docId, fields) of the CACM documents, read one at a time. The lines of each field are collected in
+    a list and only joined once the document is complete """
+    with open(fileName, mode="r", buffering=readBufferSize) as file:
+        docId = None
+        fields = None
+        currentField = None
+        for line in file:
+            if line[:1] == ".":
+                currentField = None
+                if line[:2] == ".I":
+                    if docId is not None:
+                        yield docId, {name: "".join(lines) for name, lines in fields.items()}
+                    docId = int(line.split(" ")[-1])
+                    fields = {name: [] for name in cacmFields.values()}
+                elif line[:2] in cacmFields and fields is not None:
+                    currentField = fields[cacmFields[line[:2]]]
+            elif currentField is not None:
+                currentField.append(line)
+        if docId is not None:
+            yield docId, {name: "".join(lines) for name, lines in fields.items()}
+
+
+def cs276DocumentNames(directory=cs276Directory):
+    """ Names ("<block>/<file>") of the CS276 documents, block by block and in file name order in each block """
+    for block in sorted([x for x in os.listdir(directory) if x.isdigit()], key=int):
+        for name in sorted(os.listdir(directory + "/" + block)):
+            yield block + "/" + name
+
+
+def readCS276Documents(documentNames=None, directory=cs276Directory):
+    """ Stream of (document name, fields) of CS276 documents (all of them if no names are given), read one at a
+    time. A document only has a content field """
+    if documentNames is None:
+        documentNames = cs276DocumentNames(directory)
+    for documentName in documentNames:
+        with open(directory + "/" + documentName, mode="r", buffering=readBufferSize) as file:
+            yield documentName, {"content": file.read()}
@@ -1,6 +1,10 @@
 from Collection import *
 import VectorRequest
 import matplotlib.pyplot as plt
+import time
+
+# Budgets in postings per query of score-at-a-time evaluation for the quality/latency curve (None: exhaustive)
+latency_curve_budgets = [100, 200, 500, 1000, 2000, 5000, 10000, None]
 
 class Evaluation():
     def __init__(self, coll, req):
@@ -140,11 +144,44 @@ class Evaluation():
         result /= len(self.collection.queryTest())
         return result
 
+    def latency_curve(self, vector_request, budgets=latency_curve_budgets, number=10):
+        """ Quality and latency of score-at-a-time evaluation for each postings budget, as (budget, mean time per
+        query in seconds, Mean Average Precision, mean precision of the top number results against the ones of
+        exhaustive scoring) """
+        previous_settings = vector_request.score_at_a_time, vector_request.postings_budget, vector_request.time_budget
+        vector_request.score_at_a_time = True
+        vector_request.time_budget = None
+        vector_request.postings_budget = None
+        queries = self.collection.queryTest()
+        exhaustive_results = [[r[0] for r in vector_request.full_ranked_vector_request(query.query, number)]
+                              for query in queries]
+        curve = []
+        for budget in budgets:
+            vector_request.postings_budget = budget
+            latency, average_precision, top_precision = 0, 0, 0
+            for query, expected_results in zip(queries, exhaustive_results):
+                start_time = time.perf_counter()
+                results = [r[0] for r in vector_request.full_ranked_vector_request(query.query, number)]
+                latency += time.perf_counter() - start_time
+                top_precision += self.precision_measure(results, expected_results) if expected_results else 1
+                all_results = [r[0] for r in vector_request.full_ranked_vector_request(query.query,
+                                                                                        self.collection.docLen)]
+                average_precision += self.average_precision(all_results, query.results, self.collection.docLen)
+            n = len(queries)
+            curve.append((budget, latency / n, average_precision / n, top_precision / n))
+        vector_request.score_at_a_time, vector_request.postings_budget, vector_request.time_budget = previous_settings
+        return curve
+
+    def plot_latency_curve(self, curve):
+        plt.plot([point[1] * 1000 for point in curve], [point[2] for point in curve], marker="o")
+        plt.xlabel("Mean time per query (ms)")
+        plt.ylabel("Mean Average Precision")
+
 
 if __name__ == '__main__':
     collection_name = "CACM"
     collection = CACMCollection()
-    if os.path.isfile('index' + collection_name + '/docId') and os.path.isfile('index' + collection_name + '/termId') \
+    if os.path.isfile('index' + collection_name + '/docId') and os.path.isfile('index' + collection_name + '/terms') \
             and os.path.isfile('index' + collection_name + '/invertedIndex'):
         collection.loadIndex()
     else:
@@ -152,17 +189,26 @@ if __name__ == '__main__':
         collection.saveIndex()
 
     v = VectorRequest.VectorRequest(collection)
+
+    # Scoring method choice
+    weight_type = ""
+    while weight_type not in v.weight_types:
+        weight_type = input(f"Select a scoring method among {', '.join(v.weight_types)}\n> ")
+    v.weight_type = weight_type
+
     try:
         v.load_weights()
-    except FileNotFoundError:
+    except (FileNotFoundError, ValueError):
         v.all_weights()
+        v.save_weights()
 
     e = Evaluation(collection, v)
 
     # precision-recall
     while True:
         action = input("Select a measure:\nA: precision-recall for all queries\nQ: precision-recall for one query\n"
-                       "E: E-measure for one query\nF: F-measure for one query\nM: Mean Average Precision for all queries\n> ")
+                       "E: E-measure for one query\nF: F-measure for one query\nM: Mean Average Precision for all queries\n"
+                       "L: quality/latency curve of score-at-a-time evaluation\n> ")
 
         action = action.lower()
         if action == "a":
@@ -190,6 +236,17 @@ if __name__ == '__main__':
                 print(e.F_measure(results, query.results, alpha))
         elif action == "m":
             print(f"Mean Average Precision:\n{e.mean_average_precision(v)}")
+        elif action == "l":
+            if not v.is_impact_model():
+                print(f"Score-at-a-time evaluation needs an impact model: {', '.join(v.impact_weight_types)}.")
+                continue
+            curve = e.latency_curve(v)
+            print("Budget (postings) | Time per query (ms) | MAP | Precision against exhaustive top 10")
+            for budget, latency, mean_average_precision, top_precision in curve:
+                print(f"{budget if budget is not None else 'exhaustive'} | {latency * 1000:.3f} | "
+                      f"{mean_average_precision:.4f} | {top_precision:.3f}")
+            e.plot_latency_curve(curve)
+            plt.show()
         elif "quit" in action:
             break
         else:
@@ -0,0 +1,142 @@
+import heapq
+import mmap
+import struct
+import time
+from array import array
+
+
+# First bytes of impact-ordered index files
+impactsMagic = b"RIWI"
+
+# Header of an impact-ordered index file: magic, weighting scheme, index version, number of terms, number of segments,
+# number of postings and quantization step, padded to headerSize bytes so that the arrays which follow it are aligned
+impactsHeader = struct.Struct("=4s24sIIIQd")
+headerSize = 64
+
+# Number of postings read between two checks of the time budget
+impactChunkSize = 1 << 10
+
+# Share of the time budget kept for the selection of the best documents once the postings are read
+impactSelectionShare = 0.3
+
+
+def impactIndexToBinary(store, weightType):
+    """ Impact-ordered index of a quantized weight store (see Weights.py), as written in a file: the postings of each
+    term are grouped in segments of equal impact, by decreasing impact, and the doc ids of a segment are sorted.
+    Postings of impact 0 are left out. After the header come the offsets of the segments of each term, the offsets of
+    the doc ids of each segment, the impact of each segment, then the doc ids of all the segments """
+    if store.step is None:
+        raise ValueError("impact-ordered postings need quantized weights")
+    collection = store.collection
+    termSegments = array('Q', [0])
+    segmentOffsets = array('Q', [0])
+    segmentImpacts = array('I')
+    docIds = array('I')
+    for termId in range(len(store.termOffsets) - 1):
+        segments = {}
+        for docId, impact in zip(collection.invertedIndex[termId][1].docIds, store.impacts(termId)):
+            if impact > 0:
+                segments.setdefault(impact, []).append(docId)
+        for impact in sorted(segments, reverse=True):
+            segmentImpacts.append(impact)
+            docIds.extend(segments[impact])
+            segmentOffsets.append(len(docIds))
+        termSegments.append(len(segmentImpacts))
+    header = impactsHeader.pack(impactsMagic, weightType.encode(), collection.indexVersion(), len(termSegments) - 1,
+                                len(segmentImpacts), len(docIds), store.step)
+    return header + bytes(headerSize - len(header)) + termSegments.tobytes() + segmentOffsets.tobytes() + \
+        segmentImpacts.tobytes() + docIds.tobytes()
+
+
+class ImpactIndex:
+    """ Impact-ordered postings (see impactIndexToBinary), read from a buffer or a memory-mapped file, and evaluated
+    score at a time: the segments of the request terms are read from the highest contribution (impact times the weight
+    of the term in the request) down, so that documents get the largest parts of their scores first, and the
+    evaluation can stop at any time with the best documents found so far """
+
+    def __init__(self, buffer):
+        if len(buffer) < headerSize or bytes(buffer[:len(impactsMagic)]) != impactsMagic:
+            raise ValueError("not an impact-ordered index")
+        self.buffer = buffer
+        _, weightType, self.indexVersion, nbTerms, nbSegments, nbPostings, self.step = \
+            impactsHeader.unpack_from(buffer)
+        self.weightType = weightType.rstrip(b"\0").decode()
+        position = headerSize
+        view = memoryview(buffer)
+
+        def table(typeCode, size):
+            nonlocal position
+            itemSize = struct.calcsize(typeCode)
+            position += itemSize * size
+            return view[position - itemSize * size:position].cast(typeCode)
+
+        self.termSegments = table('Q', nbTerms + 1)
+        self.segmentOffsets = table('Q', nbSegments + 1)
+        self.segmentImpacts = table('I', nbSegments)
+        self.docIds = table('I', nbPostings)
+
+    @classmethod
+    def fromWeights(cls, store, weightType):
+        """ Impact-ordered index of a quantized weight store, kept in memory """
+        return cls(impactIndexToBinary(store, weightType))
+
+    @classmethod
+    def load(cls, collection, fileName, weightType):
+        """ Memory-map an impact-ordered index, raises ValueError if the file does not hold the impacts of this
+        weighting scheme for the current index """
+        with open(fileName, mode="rb") as file:
+            index = cls(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+        if index.weightType != weightType:
+            raise ValueError(f"{fileName} holds {index.weightType} impacts, not {weightType}")
+        if index.indexVersion != collection.indexVersion():
+            raise ValueError(f"{fileName} was computed for another version of the index")
+        return index
+
+    def save(self, fileName):
+        with open(fileName, mode="wb") as file:
+            file.write(self.buffer)
+
+    def __len__(self):
+        return len(self.docIds)
+
+    def segments(self, termId):
+        """ (impact, start, end) of the segments of a term by decreasing impact, start and end being the positions of
+        their doc ids """
+        if termId + 1 >= len(self.termSegments):
+            return []
+        return [(self.segmentImpacts[segment], self.segmentOffsets[segment], self.segmentOffsets[segment + 1])
+                for segment in range(self.termSegments[termId], self.termSegments[termId + 1])]
+
+    def scoreAtATime(self, requestWeights, number=10, postingsBudget=None, timeBudget=None):
+        """ Best (docId, score) of a request (mapping of term ids to integer weights), best first, and the number of
+        postings read and whether all of them were. The evaluation stops once postingsBudget postings have been read
+        or timeBudget seconds have passed (the time is checked every impactChunkSize postings, and part of the budget
+        is kept for the selection of the best documents) """
+        start = time.perf_counter()
+        deadline = start + timeBudget * (1 - impactSelectionShare) if timeBudget is not None else None
+        segments = sorted([(impact * weight, begin, end) for termId, weight in requestWeights.items()
+                           for impact, begin, end in self.segments(termId)], reverse=True)
+        accumulator = {}
+        processedPostings = 0
+        complete = True
+        for contribution, begin, end in segments:
+            if not complete:
+                break
+            if postingsBudget is not None and processedPostings + end - begin > postingsBudget:
+                # Only the start of the segment fits in the budget
+                end = begin + max(0, postingsBudget - processedPostings)
+                complete = False
+            for chunk in range(begin, end, impactChunkSize):
+                if deadline is not None and time.perf_counter() > deadline:
+                    complete = False
+                    break
+                chunkEnd = min(end, chunk + impactChunkSize)
+                for docId in self.docIds[chunk:chunkEnd]:
+                    accumulator[docId] = accumulator.get(docId, 0) + contribution
+                processedPostings += chunkEnd - chunk
+        # Only the documents with one of the number best scores are sorted, the highest doc id first on ties
+        threshold = heapq.nlargest(number, accumulator.values())
+        threshold = threshold[-1] if len(threshold) > 0 else 0
+        best = sorted([(score, docId) for docId, score in accumulator.items() if score >= threshold],
+                      reverse=True)[:number]
+        return [(docId, round(score * self.step, 6)) for score, docId in best], processedPostings, complete
@@ -0,0 +1,332 @@
+import Analysis
+import re
+from collections import deque
+from Wildcard import isWildcard
+
+
+operators = ['and', 'or', 'not']
+
+# Proximity operator: 'near/k' matches two terms at most k positions apart
+_nearOperator = re.compile(r"near/(\d+)$")
+
+# Tokens of a query: quoted phrases, parentheses, and words
+_queryToken = re.compile(r'"[^"]*"|[()]|[^\s()"]+')
+
+
+class QueryNode:
+    """ Node of a boolean query tree: a term, a wildcard pattern (in term), a phrase (its words in term), or an
+    operator ('and', 'or', 'not', 'near' with its distance in term) with its operands """
+
+    def __init__(self, operator, children=None, term=None):
+        self.operator = operator
+        self.children = children if children is not None else []
+        self.term = term
+        self.key = None
+        self.estimate = None
+        self.actual = None
+        self.intersection = None # Size of the intermediate result of a conjunction once this operand is applied
+        self.plan = []
+        self.cached = False
+        self.skipped = False
+
+    def __repr__(self):
+        return self.key if self.key is not None else f"{self.operator}({self.children or self.term})"
+
+
+def tokenize(query):
+    """ Split a query into lowercase tokens, parentheses and quoted phrases being tokens of their own """
+    query = query.lower()
+    if query.count('"') % 2 == 1:
+        raise ValueError("missing closing quote")
+    return _queryToken.findall(query)
+
+
+def nearDistance(token):
+    """ Distance k of a 'near/k' token, None for other tokens """
+    match = _nearOperator.match(token)
+    return int(match.group(1)) if match is not None else None
+
+
+def operand(token):
+    """ Query tree of a token which is not an operator: a phrase, a wildcard pattern or a term """
+    if token[0] == '"':
+        words = Analysis.tokenize(token[1:-1])
+        if len(words) == 0:
+            raise ValueError("empty phrase")
+        if len(words) == 1:
+            return QueryNode('term', term=words[0])
+        return QueryNode('phrase', term=words)
+    if isWildcard(token):
+        return QueryNode('wildcard', term=token)
+    return QueryNode('term', term=token)
+
+
+def proximity(k, a, b):
+    """ Query tree of 'a near/k b', whose operands must be terms """
+    if a.operator != 'term' or b.operator != 'term':
+        raise ValueError("operands of near must be terms")
+    return QueryNode('near', [a, b], term=k)
+
+
+def parsePrefix(tokens):
+    """ Query tree of a query in Polish (prefix) notation, from a deque of tokens """
+    token = tokens.popleft()
+    if token in ['and', 'or']:
+        return QueryNode(token, [parsePrefix(tokens), parsePrefix(tokens)])
+    if token == 'not':
+        return QueryNode(token, [parsePrefix(tokens)])
+    if nearDistance(token) is not None:
+        return proximity(nearDistance(token), parsePrefix(tokens), parsePrefix(tokens))
+    if token in ['(', ')']:
+        raise ValueError("parentheses are only allowed in infix notation")
+    return operand(token)
+
+
+def parseInfix(tokens):
+    """ Query tree of a query in infix notation with parentheses, from a deque of tokens. NEAR/k binds tighter than
+    NOT, which binds tighter than AND, which binds tighter than OR """
+
+    def orExpression():
+        node = andExpression()
+        while len(tokens) > 0 and tokens[0] == 'or':
+            tokens.popleft()
+            node = QueryNode('or', [node, andExpression()])
+        return node
+
+    def andExpression():
+        node = notExpression()
+        while len(tokens) > 0 and tokens[0] == 'and':
+            tokens.popleft()
+            node = QueryNode('and', [node, notExpression()])
+        return node
+
+    def notExpression():
+        if len(tokens) > 0 and tokens[0] == 'not':
+            tokens.popleft()
+            return QueryNode('not', [notExpression()])
+        return nearExpression()
+
+    def nearExpression():
+        node = atom()
+        while len(tokens) > 0 and nearDistance(tokens[0]) is not None:
+            node = proximity(nearDistance(tokens.popleft()), node, atom())
+        return node
+
+    def atom():
+        token = tokens.popleft()
+        if token == '(':
+            node = orExpression()
+            if len(tokens) == 0 or tokens.popleft() != ')':
+                raise ValueError("missing closing parenthesis")
+            return node
+        if token in operators or token == ')' or nearDistance(token) is not None:
+            raise ValueError(f"unexpected '{token}'")
+        return operand(token)
+
+    node = orExpression()
+    if len(tokens) > 0:
+        raise ValueError(f"unexpected '{tokens[0]}'")
+    return node
+
+
+def parseQuery(query):
+    """ Query tree of a query in prefix notation (starting with an operator) or in infix notation """
+    tokens = tokenize(query)
+    if len(tokens) == 0:
+        raise ValueError("empty query")
+    if '(' not in tokens:
+        prefixTokens = deque(tokens)
+        try:
+            node = parsePrefix(prefixTokens)
+            if len(prefixTokens) == 0:
+                return node
+        except IndexError:
+            pass
+    try:
+        return parseInfix(deque(tokens))
+    except IndexError:
+        raise ValueError("incomplete query")
+
+
+class QueryPlanner:
+    """ Plan and evaluate boolean queries with the operators of a BooleanRequest: nested AND and OR are flattened,
+    the operands of a conjunction are evaluated from the smallest estimated cardinality upward, stopping as soon as the
+    result is empty, 'a AND NOT b' is computed as a difference, and repeated subexpressions are evaluated once """
+
+    def __init__(self, booleanRequest):
+        self.booleanRequest = booleanRequest
+        self.collection = booleanRequest.collection
+        self.root = None
+        self.cache = {}
+
+    def termId(self, term):
+        """ Term id of a query term, normalized like the terms of the collection or corrected (None if it is not in
+        the collection) """
+        return self.booleanRequest.termIdOf(term)
+
+    def flatten(self, node):
+        """ Merge nested operators of the same kind, remove double negations and repeated operands, and compute the
+        key (canonical form) and estimated cardinality of each node """
+        N = self.collection.docLen
+        if node.operator == 'term':
+            node.key = node.term
+            termId = self.termId(node.term)
+            node.estimate = self.collection.getDocumentFrequency(termId) if termId is not None else 0
+            return node
+        if node.operator == 'wildcard':
+            # A wildcard matches at most the documents of all the terms it is expanded to
+            node.key = node.term
+            node.estimate = min(N, sum([self.collection.getDocumentFrequency(termId)
+                                        for termId in self.booleanRequest.wildcardTerms(node.term)]))
+            return node
+        if node.operator == 'phrase':
+            # A phrase matches at most the documents of its rarest word (common words are not indexed)
+            node.key = '"' + " ".join(node.term) + '"'
+            node.estimate = min([self.collection.getDocumentFrequency(self.collection.termId[term])
+                                 if term in self.collection.termId else 0
+                                 for term in self.collection.analyzer.analyze(" ".join(node.term))] or [0])
+            return node
+        children = [self.flatten(child) for child in node.children]
+        if node.operator == 'near':
+            node.children = children
+            node.key = f"near/{node.term}(" + ", ".join(sorted([child.key for child in children])) + ")"
+            node.estimate = min([child.estimate for child in children])
+            return node
+        if node.operator == 'not':
+            if children[0].operator == 'not':
+                return children[0].children[0]
+            node.children = children
+            node.key = "not " + children[0].key
+            node.estimate = N - children[0].estimate
+            return node
+        flatChildren = {}
+        for child in children:
+            for grandChild in (child.children if child.operator == node.operator else [child]):
+                flatChildren[grandChild.key] = grandChild
+        if len(flatChildren) == 1:
+            return list(flatChildren.values())[0]
+        node.children = list(flatChildren.values())
+        node.key = node.operator + "(" + ", ".join(sorted(flatChildren)) + ")"
+        if node.operator == 'and':
+            node.estimate = min([child.estimate for child in node.children])
+        else:
+            node.estimate = min(N, sum([child.estimate for child in node.children]))
+        return node
+
+    def plan(self, query):
+        """ Query tree of a query, flattened and with estimated cardinalities """
+        self.root = self.flatten(parseQuery(query))
+        return self.root
+
+    def request(self, query):
+        """ Evaluate a query in prefix or infix notation, returns a sorted sequence of doc ids """
+        self.plan(query)
+        self.cache = {}
+        return self.evaluate(self.root)
+
+    @staticmethod
+    def _materialize(result):
+        """ Lazy results (negations) are turned into lists so that they can be cached and counted """
+        return result if hasattr(result, '__len__') else list(result)
+
+    def evaluate(self, node):
+        if node.key in self.cache:
+            node.cached = True
+            result = self.cache[node.key]
+        elif node.operator == 'term':
+            termId = self.termId(node.term)
+            result = self.booleanRequest.termRequest(termId) if termId is not None else []
+        elif node.operator == 'wildcard':
+            result = self.booleanRequest.wildcardRequest(node.term)
+        elif node.operator == 'phrase':
+            result = self.booleanRequest.phraseRequest(node.term)
+        elif node.operator == 'near':
+            result = self.booleanRequest.nearRequest(node.children[0].term, node.children[1].term, node.term)
+        elif node.operator == 'not':
+            node.plan = node.children
+            result = self.booleanRequest.notRequest(self.evaluate(node.children[0]))
+        elif node.operator == 'or':
+            node.plan = sorted(node.children, key=lambda x: x.estimate)
+            result = []
+            for child in node.plan:
+                result = self.booleanRequest.orRequest(result, self.evaluate(child))
+        else:
+            result = self._evaluateConjunction(node)
+        result = self._materialize(result)
+        node.actual = len(result)
+        self.cache[node.key] = result
+        return result
+
+    def _evaluateConjunction(self, node):
+        """ Positive operands from the smallest estimated cardinality upward, then negated operands as differences
+        from the largest upward. Stops as soon as the result is empty """
+        positive = sorted([x for x in node.children if x.operator != 'not'], key=lambda x: x.estimate)
+        negative = sorted([x for x in node.children if x.operator == 'not'], key=lambda x: x.children[0].estimate,
+                          reverse=True)
+        node.plan = positive + negative
+        if len(positive) == 0:
+            # Only negations: NOT (a OR b ...)
+            result = self.booleanRequest.allDocuments
+        else:
+            result = self.evaluate(positive[0])
+            positive[0].intersection = len(result)
+        for child in node.plan[1 if len(positive) > 0 else 0:]:
+            if len(result) == 0:
+                child.skipped = True
+                continue
+            if child.operator == 'not':
+                result = self.booleanRequest.andNotRequest(result, self.evaluate(child.children[0]))
+                child.actual = None
+                operand = child.children[0]
+            elif child.operator == 'term' and child.key not in self.cache and self.termId(child.term) is not None \
+                    and not self.booleanRequest.useBitmap(child.estimate):
+                # Postings of a term stored as a list are skipped block by block: they are not all read, only the
+                # intermediate result is counted
+                result = self.booleanRequest.andTermRequest(result, self.termId(child.term))
+                operand = child
+            else:
+                result = self.booleanRequest.andRequest(result, self.evaluate(child))
+                operand = child
+            result = self._materialize(result)
+            operand.intersection = len(result)
+        return result
+
+    def explain(self):
+        """ Description of the last query: operands in the order they were evaluated, with their estimated and actual
+        cardinalities """
+        lines = []
+
+        def describe(node, depth, difference=False):
+            if node.operator == 'term':
+                label = f"term '{node.term}'"
+            elif node.operator == 'wildcard':
+                label = f"wildcard '{node.term}'"
+            elif node.operator == 'phrase':
+                label = f"phrase {node.key}"
+            elif node.operator == 'near':
+                label = f"NEAR/{node.term}({node.children[0].term}, {node.children[1].term})"
+            else:
+                label = node.operator.upper()
+            label = ("AND NOT " if difference else "") + label
+            if node.skipped:
+                status = "skipped (empty intermediate result)"
+            elif node.actual is None and node.intersection is not None:
+                status = "intersected block by block"
+            elif node.actual is None:
+                status = "not evaluated"
+            else:
+                status = f"actual {node.actual}" + (" (cached)" if node.cached else "")
+            if not node.skipped and node.intersection is not None:
+                status += f", {node.intersection} documents left"
+            lines.append("    " * depth + f"{label}: estimated {node.estimate}, {status}")
+            for child in node.plan:
+                if node.operator == 'and' and child.operator == 'not':
+                    if child.skipped:
+                        child.children[0].skipped = True
+                    describe(child.children[0], depth + 1, True)
+                else:
+                    describe(child, depth + 1)
+
+        if self.root is not None:
+            describe(self.root, 0)
+        return "\n".join(lines)
@@ -0,0 +1,489 @@
+from Collection import *
+from Bitmap import RoaringBitmap
+from BooleanRequest import BooleanRequest
+from itertools import groupby
+from QueryPlanner import QueryPlanner
+from queue import Queue
+import shutil
+from threading import Thread, RLock
+
+
+# Number of adjacent segments of the same tier merged together by the background merge
+mergeFactor = 4
+
+# Size (in live documents) of the segments of the lowest tier: segments up to this size are all in the first tier
+minSegmentSize = 100
+
+
+def tier(size):
+    """ Tier of a segment of size live documents: segments of a tier are up to mergeFactor times larger than those of
+    the previous one """
+    return int(math.log(max(size, minSegmentSize) / minSegmentSize, mergeFactor))
+
+
+def findMerge(sizes):
+    """ Range (start, end) of the first mergeFactor adjacent segments of the same tier, from their sizes, or None.
+    Only adjacent segments are merged so that doc ids stay in increasing order from one segment to the next """
+    tiers = [tier(size) for size in sizes]
+    for start in range(len(tiers) - mergeFactor + 1):
+        if len(set(tiers[start:start + mergeFactor])) == 1:
+            return start, start + mergeFactor
+    return None
+
+
+class SegmentIndex(Collection):
+    """ Index of a segment, saved like the index of a collection but with global doc ids. Only df and the length of
+    the documents are kept as statistics (norms depend on the whole collection), the lengths being indexed from the
+    first doc id of the segment """
+
+    def readDocuments(self):
+        """ A segment is written from documents already inverted, it has none to read """
+        return iter([])
+
+    def computeStatistics(self):
+        firstDocId = min(self.docId.values()) if self.docId else 0
+        size = max(self.docId.values()) + 1 - firstDocId if self.docId else 0
+        self.documentFrequency = array('I', [0] * len(self.invertedIndex))
+        self.documentLength = array('I', [0] * size)
+        for termId, postings in self.invertedIndex:
+            self.documentFrequency[termId] = len(postings)
+            for docId, tf in postings:
+                self.documentLength[docId - firstDocId] += tf
+        self.documentNorm = {}
+
+    def _statisticsToBinary(self, file):
+        """ Write the statistics of the segment in an open file: a header (N, number of terms, number of document
+        lengths) followed by the raw df and length arrays """
+        file.write(struct.pack("=III", self.docLen, len(self.documentFrequency), len(self.documentLength)))
+        self.documentFrequency.tofile(file)
+        self.documentLength.tofile(file)
+
+    def _binaryToStatistics(self, file):
+        """ Read the statistics of the segment from an open file """
+        N, termLen, size = struct.unpack("=III", file.read(12))
+        self.documentFrequency = array('I')
+        self.documentFrequency.fromfile(file, termLen)
+        self.documentLength = array('I')
+        self.documentLength.fromfile(file, size)
+        self.documentNorm = {}
+
+    def loadIndex(self):
+        """ Load the segment, and compute the document lengths of a segment saved without them """
+        Collection.loadIndex(self)
+        # Segments written before the document lengths were kept have none in their statistics
+        if len(self.documentLength) == 0 and self.docLen > 0:
+            self.computeStatistics()
+
+
+class Segment:
+    """ Immutable segment of a segmented collection: an index of some documents (with its own term ids) in a range of
+    doc ids, and a bitmap of the documents of this range deleted since the segment was written """
+
+    def __init__(self, name, index, globalTermId):
+        self.name = name
+        self.index = index
+        # Term ids of the segment by global term id
+        self.localTermIds = {globalTermId[term]: termId for term, termId in index.termId.items()}
+        self.firstDocId = min(index.docId.values())
+        self.lastDocId = max(index.docId.values())
+        self.deleted = RoaringBitmap()
+        self.nbDeleted = 0
+
+    def __len__(self):
+        """ Number of live documents """
+        return self.index.docLen - self.nbDeleted
+
+    def __contains__(self, docId):
+        return self.firstDocId <= docId <= self.lastDocId
+
+    def postings(self, termId):
+        """ Postings of the live documents of the segment for a global term id """
+        localTermId = self.localTermIds.get(termId)
+        if localTermId is None:
+            return []
+        postings = self.index.invertedIndex[localTermId][1]
+        if self.nbDeleted == 0:
+            return postings
+        return [posting for posting in postings if posting[0] not in self.deleted]
+
+    def postingBlocks(self, termId):
+        localTermId = self.localTermIds.get(termId)
+        return self.index.getPostingBlocks(localTermId) if localTermId is not None else []
+
+    def blockPostings(self, termId, block):
+        postings = self.index.getBlockPostings(self.localTermIds[termId], block)
+        if self.nbDeleted == 0:
+            return postings
+        return [posting for posting in postings if posting[0] not in self.deleted]
+
+    def documentLength(self, docId):
+        """ Length of a document of the segment, 0 if it was deleted """
+        if docId in self.deleted:
+            return 0
+        return self.index.documentLength[docId - self.firstDocId]
+
+    def documentLengths(self):
+        """ Length of the documents of the doc id range of the segment, 0 for those which were deleted """
+        lengths = self.index.documentLength
+        if self.nbDeleted == 0:
+            return lengths
+        return [0 if self.firstDocId + i in self.deleted else length for i, length in enumerate(lengths)]
+
+    def delete(self, docId):
+        self.deleted = self.deleted | RoaringBitmap.fromSorted([docId])
+        self.nbDeleted = len(self.deleted)
+
+    def saveDeleted(self):
+        with open(self.index.indexLocation + "/deleted", mode="wb") as file:
+            array('I', self.deleted).tofile(file)
+
+    def loadDeleted(self):
+        if os.path.isfile(self.index.indexLocation + "/deleted"):
+            deleted = array('I')
+            with open(self.index.indexLocation + "/deleted", mode="rb") as file:
+                deleted.frombytes(file.read())
+            self.deleted = RoaringBitmap.fromSorted(deleted)
+            self.nbDeleted = len(self.deleted)
+
+
+class SegmentedPostings:
+    """ Posting lists of a segmented collection: the postings of the live documents of each segment, concatenated in
+    the order of the segments. It can be used like the list of (termId, postings) of a collection """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.cache = {} # Concatenated posting lists by term id, for the segments of cacheGeneration
+        self.cacheGeneration = None
+
+    def __len__(self):
+        return self.collection.termLen
+
+    def __iter__(self):
+        for termId in range(len(self)):
+            yield self[termId]
+
+    def __getitem__(self, termId):
+        """ Postings of a term, concatenated once per term until the segments change """
+        generation, segments = self.collection.generation, self.collection.segments
+        if generation != self.cacheGeneration:
+            self.cache = {}
+            self.cacheGeneration = generation
+        cache = self.cache
+        if termId not in cache:
+            postings = []
+            for segment in segments:
+                postings.extend(segment.postings(termId))
+            cache[termId] = PostingList.fromPostings(postings)
+        return termId, cache[termId]
+
+
+class SegmentedDocumentLengths:
+    """ Length of the documents of a segmented collection, read from the segment of each doc id. It can be used like
+    the documentLength array of a collection, deleted documents having a length of 0 """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __len__(self):
+        return self.collection.nextDocId
+
+    def __iter__(self):
+        docId = 0
+        for segment in self.collection.segments:
+            yield from [0] * (segment.firstDocId - docId)
+            yield from segment.documentLengths()
+            docId = segment.lastDocId + 1
+        yield from [0] * (len(self) - docId)
+
+    def __getitem__(self, docId):
+        for segment in self.collection.segments:
+            if docId in segment:
+                return segment.documentLength(docId)
+        return 0
+
+
+class SegmentedCollection(Collection):
+    """ Collection indexed incrementally: each batch of added documents is written as a new immutable segment, with
+    its own term ids and the next doc ids, and deleted documents are marked in a bitmap of their segment. Queries see
+    the live documents of all segments, and a background thread merges adjacent segments of the same tier (dropping
+    deleted documents). df include deleted documents until their segment is merged """
+
+    def __init__(self, indexLocation = "indexSegments"):
+        Collection.__init__(self, indexLocation)
+        self.segments = []
+        self.nextDocId = 0
+        self.nextSegment = 0
+        self.termById = []
+        self.invertedIndex = SegmentedPostings(self)
+        self.documentLength = SegmentedDocumentLengths(self)
+        # Blocks of each segment end with the segment, and deleted postings are filtered out of them
+        self.uniformBlocks = False
+        self.lock = RLock()
+        self.merges = Queue()
+        merger = Thread(target=self._mergeSegments)
+        merger.daemon = True
+        merger.start()
+
+    def readDocuments(self):
+        """ Documents are given to addDocuments, their text is not kept: there are none to read """
+        return iter([])
+
+    def _segmentLocation(self, name):
+        return self.indexLocation + "/" + name
+
+    def _addTerms(self, terms):
+        """ Give global term ids to new terms, appended to the termId file """
+        newTerms = [term for term in terms if term not in self.termId]
+        with open(self.indexLocation + "/termId", mode="a" if self.termLen > 0 else "w") as file:
+            for term in newTerms:
+                self.termId[term] = self.termLen
+                self.termById.append(term)
+                file.write(str(self.termLen) + " " + term + "\n")
+                self.termLen += 1
+        self.documentFrequency.extend([0] * len(newTerms))
+
+    def _writeSegment(self, invertedIndex, docId, termById):
+        """ Write a segment from its inverted index (by term id of the segment), its doc ids and its terms, and
+        load it """
+        name = "segment" + str(self.nextSegment)
+        self.nextSegment += 1
+        index = SegmentIndex(self._segmentLocation(name))
+        index.invertedIndex = invertedIndex
+        index.termId = {term: termId for termId, term in enumerate(termById)}
+        index.termLen = len(termById)
+        index.docId = docId
+        index.docLen = len(docId)
+        index.saveIndex()
+        index = SegmentIndex(self._segmentLocation(name))
+        index.loadIndex()
+        return Segment(name, index, self.termId)
+
+    def _saveSegments(self):
+        """ Write the list of segments (after the next doc id and segment number), which is the commit point of the
+        collection """
+        with open(self.indexLocation + "/segments.tmp", mode="w") as file:
+            file.write(str(self.nextDocId) + " " + str(self.nextSegment) + "\n")
+            for segment in self.segments:
+                file.write(segment.name + "\n")
+        os.replace(self.indexLocation + "/segments.tmp", self.indexLocation + "/segments")
+
+    def _updateDocumentFrequency(self, segments, sign):
+        for segment in segments:
+            for termId, localTermId in segment.localTermIds.items():
+                self.documentFrequency[termId] += sign * segment.index.documentFrequency[localTermId]
+
+    def addDocuments(self, documents):
+        """ Index a batch of documents (docKey, text) in a new segment. A document already in the collection is
+        replaced """
+        termId = {}
+        termById = []
+        pairs = []
+        docId = {}
+        for docKey, text in documents:
+            docKey = str(docKey)
+            if " " in docKey or docKey == "":
+                raise ValueError("document keys cannot be empty nor contain spaces")
+            if docKey in docId:
+                raise ValueError(f"document '{docKey}' is twice in the batch")
+            docId[docKey] = self.nextDocId + len(docId)
+            tfs = {}
+            for token in self.analyzer.analyze(text):
+                if token not in termId:
+                    termId[token] = len(termById)
+                    termById.append(token)
+                tfs[termId[token]] = tfs.get(termId[token], 0) + 1
+            pairs.extend([(term_id, docId[docKey], tf) for term_id, tf in tfs.items()])
+        if len(docId) == 0:
+            return
+        pairs.sort()
+        invertedIndex = [(key, [(x[1], x[2]) for x in group]) for key, group in groupby(pairs, key=lambda x: x[0])]
+
+        with self.lock:
+            for docKey in docId:
+                if docKey in self.docId:
+                    self.deleteDocument(docKey)
+            self._addTerms(termById)
+            self.nextDocId += len(docId)
+            segment = self._writeSegment(invertedIndex, docId, termById)
+            self._updateDocumentFrequency([segment], 1)
+            self.segments = self.segments + [segment]
+            self.docId.update(docId)
+            self.docLen += len(docId)
+            self.generation += 1
+            self._saveSegments()
+        self.merges.put(True)
+
+    def deleteDocument(self, docKey):
+        """ Mark a document as deleted in the bitmap of its segment """
+        with self.lock:
+            docId = self.docId.pop(str(docKey))
+            self.docLen -= 1
+            for segment in self.segments:
+                if docId in segment:
+                    segment.delete(docId)
+                    segment.saveDeleted()
+            self.generation += 1
+
+    def _mergeSegments(self):
+        """ Background merge: wait for new segments, then merge adjacent segments of the same tier as long as the
+        merge policy finds some """
+        while True:
+            self.merges.get()
+            try:
+                merge = findMerge([len(segment) for segment in self.segments])
+                while merge is not None:
+                    self.mergeSegments(*merge)
+                    merge = findMerge([len(segment) for segment in self.segments])
+            finally:
+                # Mark this task as done, whether an exception happened or not
+                self.merges.task_done()
+
+    def waitMerges(self):
+        """ Wait for the end of the background merges """
+        self.merges.join()
+
+    def mergeSegments(self, start, end):
+        """ Merge the segments from start to end (excluded) into one, without their deleted documents. Queries keep
+        using the old segments until the merged one replaces them """
+        segments = self.segments[start:end]
+        deleted = [segment.deleted for segment in segments]
+
+        # Live documents and postings of the merged segments, by term id of the new segment
+        docId = {}
+        for segment, segmentDeleted in zip(segments, deleted):
+            docId.update({docKey: x for docKey, x in segment.index.docId.items() if x not in segmentDeleted})
+        termIds = sorted(set().union(*[segment.localTermIds.keys() for segment in segments]))
+        invertedIndex = []
+        termById = []
+        for termId in termIds:
+            postings = []
+            for segment, segmentDeleted in zip(segments, deleted):
+                if termId in segment.localTermIds:
+                    postings.extend([posting for posting in segment.index.invertedIndex[segment.localTermIds[termId]][1]
+                                     if posting[0] not in segmentDeleted])
+            if len(postings) > 0:
+                invertedIndex.append((len(termById), postings))
+                termById.append(self.termById[termId])
+
+        with self.lock:
+            merged = [self._writeSegment(invertedIndex, docId, termById)] if len(docId) > 0 else []
+            # Documents deleted during the merge are deleted in the merged segment
+            for segment, segmentDeleted in zip(segments, deleted):
+                for x in segment.deleted - segmentDeleted:
+                    merged[0].delete(x)
+            if len(merged) > 0 and merged[0].nbDeleted > 0:
+                merged[0].saveDeleted()
+            index = self.segments.index(segments[0])
+            self._updateDocumentFrequency(segments, -1)
+            self._updateDocumentFrequency(merged, 1)
+            self.segments = self.segments[:index] + merged + self.segments[index + len(segments):]
+            self.generation += 1
+            self._saveSegments()
+        for segment in segments:
+            shutil.rmtree(self._segmentLocation(segment.name), ignore_errors=True)
+
+    def getPostingBlocks(self, termId):
+        """ Block headers of the segments, in the order of the segments """
+        blocks = []
+        for segment in self.segments:
+            blocks.extend(segment.postingBlocks(termId))
+        return blocks
+
+    def getBlockPostings(self, termId, block):
+        """ Postings of the live documents of one block (numbered over all the segments) """
+        for segment in self.segments:
+            nbBlocks = len(segment.postingBlocks(termId))
+            if block < nbBlocks:
+                return segment.blockPostings(termId, block)
+            block -= nbBlocks
+        return []
+
+    def getCollectionSize(self):
+        """ Deleted documents are counted in df until their segment is merged, and in N as well so that the idf of
+        a term does not drop when documents without it are deleted """
+        return self.docLen + sum([segment.nbDeleted for segment in self.segments])
+
+    def computeStatistics(self):
+        """ Only df are kept up to date, norms are computed with the weights """
+        self.documentNorm = {}
+
+    def saveIndex(self):
+        """ Segments are saved as soon as they are written, only the list of segments is saved again """
+        with self.lock:
+            self._saveSegments()
+
+    def loadIndex(self):
+        """ Load the segments listed in the segments file """
+        self.generation += 1
+        self.segments = []
+        self.termId = {}
+        self.termById = []
+        self.termLen = 0
+        self.docId = {}
+        self.docLen = 0
+        self.documentFrequency = array('I')
+        self.documentNorm = {}
+        if not os.path.isfile(self.indexLocation + "/segments"):
+            return
+        with open(self.indexLocation + "/termId", mode="r") as file:
+            for line in file.read().splitlines():
+                termId, term = line.split(" ")
+                self.termId[term] = int(termId)
+                self.termById.append(term)
+        self.termLen = len(self.termId)
+        self.documentFrequency = array('I', [0] * self.termLen)
+        with open(self.indexLocation + "/segments", mode="r") as file:
+            names = file.read().splitlines()
+        nextDocId, nextSegment = names.pop(0).split(" ")
+        self.nextDocId = int(nextDocId)
+        self.nextSegment = int(nextSegment)
+        for name in names:
+            index = SegmentIndex(self._segmentLocation(name))
+            index.loadIndex()
+            segment = Segment(name, index, self.termId)
+            segment.loadDeleted()
+            self.segments.append(segment)
+            self.docId.update({docKey: x for docKey, x in index.docId.items() if x not in segment.deleted})
+        self.docLen = len(self.docId)
+        self._updateDocumentFrequency(self.segments, 1)
+
+
+if __name__ == "__main__":
+
+    collection = SegmentedCollection()
+    collection.loadIndex()
+    print(f"{len(collection.segments)} segments, {collection.docLen} documents.")
+
+    while True:
+        action = input("Enter 'add <key> <text>', 'delete <key>', a boolean query, 'segments' or '!' to quit:\n> ")
+        start_time = datetime.datetime.now()
+        if '!' in action:
+            collection.waitMerges()
+            print("Exiting...")
+            break
+        if action.startswith("add "):
+            docKey, _, text = action[len("add "):].partition(" ")
+            try:
+                collection.addDocuments([(docKey, text)])
+                print(f"Document added in {(datetime.datetime.now() - start_time).microseconds / 1000}ms.")
+            except ValueError as error:
+                print(f"Invalid document ({error}).")
+        elif action.startswith("delete "):
+            try:
+                collection.deleteDocument(action[len("delete "):].strip())
+                print("Document deleted.")
+            except KeyError:
+                print("No such document.")
+        elif action == "segments":
+            for segment in collection.segments:
+                print(f"{segment.name}: doc ids {segment.firstDocId} to {segment.lastDocId}, {len(segment)} live "
+                      f"documents, {segment.nbDeleted} deleted")
+        else:
+            doc_by_id = {collection.docId[doc_name]: doc_name for doc_name in collection.docId}
+            try:
+                response = list(QueryPlanner(BooleanRequest(collection)).request(action))
+                print(f"Request found in {len(response)} documents:")
+                for docId in response:
+                    print(doc_by_id[docId])
+            except ValueError as error:
+                print(f"Invalid request ({error}).")
@@ -0,0 +1,202 @@
+import mmap
+import struct
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+
+# First bytes of k-gram index files
+kgramMagic = b"RIWS"
+
+# Header of a k-gram index file after the magic: k, number of terms, largest term length, number of (length, k-gram)
+# entries
+kgramHeader = struct.Struct("=IIII")
+
+# Number of characters of the k-grams, and marker of the beginning and the end of a term in its k-grams
+kgramSize = 3
+kgramMarker = "\0"
+
+
+def kgrams(term, k=kgramSize):
+    """ k-grams of a term, with the markers of its beginning and end (a term of n characters has n + k - 1 of them) """
+    term = kgramMarker * (k - 1) + term + kgramMarker * (k - 1)
+    return [term[i:i + k] for i in range(len(term) - k + 1)]
+
+
+def levenshtein(a, b, limit=None):
+    """ Edit distance (insertions, deletions and substitutions) between two strings, or limit + 1 as soon as it is
+    known to be greater than limit. The columns of the table are computed a whole at a time, as bit vectors of the
+    differences between consecutive cells (Myers' algorithm), the last cell of the column being the distance between a
+    and the characters of b read so far """
+    if limit is None:
+        limit = max(len(a), len(b))
+    elif abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if len(a) == 0:
+        return min(len(b), limit + 1)
+    # Positions of each character in a
+    masks = {}
+    for i, x in enumerate(a):
+        masks[x] = masks.get(x, 0) | 1 << i
+    full = (1 << len(a)) - 1
+    last = 1 << (len(a) - 1)
+    # Cells of the current column one more (positive) and one less (negative) than the cell above them
+    positive, negative = full, 0
+    distance = len(a)
+    for j, y in enumerate(b, 1):
+        equal = masks.get(y, 0)
+        vertical = equal | negative
+        horizontal = (((equal & positive) + positive) ^ positive) | equal
+        horizontalPositive = negative | ~(horizontal | positive) & full
+        horizontalNegative = positive & horizontal
+        if horizontalPositive & last:
+            distance += 1
+        elif horizontalNegative & last:
+            distance -= 1
+        # The distance can decrease by one at most for each of the characters of b left
+        if distance - (len(b) - j) > limit:
+            return limit + 1
+        horizontalPositive = (horizontalPositive << 1 | 1) & full
+        horizontalNegative = horizontalNegative << 1 & full
+        positive = horizontalNegative | ~(vertical | horizontalPositive) & full
+        negative = horizontalPositive & vertical
+    return min(distance, limit + 1)
+
+
+def kgramIndexToBinary(termIds, k=kgramSize):
+    """ k-gram index of a term dictionary (mapping of terms to term ids), as written in a file. The postings of a k-gram
+    are split by the length of the terms, so that a lookup only reads the terms of a length close to the one of the
+    word. After the header come the offsets of the terms (by term id), of the entries of each term length, of the
+    sorted k-grams of the entries and of their postings, then the terms, the k-grams, and the postings of each entry
+    (the sorted ids of the terms of this length containing the k-gram, as 32-bit integers) """
+    termById = [""] * (max(termIds.values()) + 1 if len(termIds) > 0 else 0)
+    postings = {}
+    for term, termId in termIds.items():
+        termById[termId] = term
+        for kgram in set(kgrams(term, k)):
+            postings.setdefault((len(term), kgram), []).append(termId)
+    entries = sorted(postings)
+    maxLength = max([len(term) for term in termById], default=0)
+
+    def table(items):
+        """ Offsets and concatenation of byte strings """
+        offsets = array('Q', [0])
+        for item in items:
+            offsets.append(offsets[-1] + len(item))
+        return offsets, b"".join(items)
+
+    lengthOffsets = array('Q', [bisect_left(entries, (length,)) for length in range(maxLength + 2)])
+    termOffsets, terms = table([term.encode() for term in termById])
+    kgramOffsets, kgramBytes = table([kgram.encode() for _, kgram in entries])
+    postingOffsets = array('Q', [0])
+    postingIds = array('I')
+    for entry in entries:
+        postingIds.extend(sorted(postings[entry]))
+        postingOffsets.append(len(postingIds))
+    binary = kgramMagic + kgramHeader.pack(k, len(termById), maxLength, len(entries)) + termOffsets.tobytes() + \
+        lengthOffsets.tobytes() + kgramOffsets.tobytes() + postingOffsets.tobytes() + terms + kgramBytes
+    return binary + bytes(-len(binary) % postingIds.itemsize) + postingIds.tobytes()
+
+
+class KgramIndex:
+    """ k-gram index of the terms of a collection (see kgramIndexToBinary), read from a buffer or a memory-mapped
+    file, to find the terms close to a word: the candidates are the terms of a close length sharing enough k-grams
+    with it (an edit changes at most k of the k-grams of a term), and only them are compared to the word """
+
+    def __init__(self, buffer):
+        if bytes(buffer[:len(kgramMagic)]) != kgramMagic:
+            raise ValueError("not a k-gram index")
+        self.buffer = buffer
+        self.k, nbTerms, self.maxLength, nbEntries = kgramHeader.unpack_from(buffer, len(kgramMagic))
+        position = len(kgramMagic) + kgramHeader.size
+        view = memoryview(buffer)
+
+        def offsets(size):
+            nonlocal position
+            position += 8 * size
+            return view[position - 8 * size:position].cast('Q')
+
+        self.termOffsets = offsets(nbTerms + 1)
+        self.lengthOffsets = offsets(self.maxLength + 2)
+        self.kgramOffsets = offsets(nbEntries + 1)
+        self.postingOffsets = offsets(nbEntries + 1)
+        self.termsStart = position
+        self.kgramsStart = self.termsStart + self.termOffsets[-1]
+        postingsStart = self.kgramsStart + self.kgramOffsets[-1]
+        postingsStart += -postingsStart % 4
+        self.postingIds = view[postingsStart:postingsStart + 4 * self.postingOffsets[-1]].cast('I')
+        # Entry of each k-gram, by term length, read the first time a term length is looked up
+        self.entries = {}
+
+    @classmethod
+    def fromTerms(cls, termIds):
+        """ k-gram index of a term dictionary, kept in memory """
+        return cls(kgramIndexToBinary(termIds))
+
+    @classmethod
+    def load(cls, fileName):
+        """ k-gram index read from a file """
+        with open(fileName, mode="rb") as file:
+            return cls(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def __len__(self):
+        return len(self.termOffsets) - 1
+
+    def term(self, termId):
+        """ Term of a term id """
+        return bytes(self.buffer[self.termsStart + self.termOffsets[termId]:
+                                 self.termsStart + self.termOffsets[termId + 1]]).decode()
+
+    def postings(self, kgram, length):
+        """ Sorted ids of the terms of a length containing a k-gram """
+        if length < 0 or length > self.maxLength:
+            return []
+        if length not in self.entries:
+            self.entries[length] = self._readEntries(length)
+        index = self.entries[length].get(kgram)
+        if index is None:
+            return []
+        return self.postingIds[self.postingOffsets[index]:self.postingOffsets[index + 1]]
+
+    def _readEntries(self, length):
+        """ Entry of each k-gram of the terms of a length """
+        start, end = self.lengthOffsets[length], self.lengthOffsets[length + 1]
+        offsets = self.kgramOffsets
+        kgramBytes = bytes(self.buffer[self.kgramsStart + offsets[start]:self.kgramsStart + offsets[end]])
+        base = offsets[start]
+        return {kgramBytes[offsets[i] - base:offsets[i + 1] - base].decode(): i for i in range(start, end)}
+
+    def similar(self, word, maxDistance):
+        """ (distance, termId) of the terms at most maxDistance edits away from a word """
+        wordKgrams = set(kgrams(word, self.k))
+        # An edit removes at most k of the k-grams of the word: a term at most maxDistance edits away shares all the
+        # others with it, and its length differs from the one of the word by at most maxDistance
+        threshold = max(1, len(wordKgrams) - self.k * maxDistance)
+        result = []
+        for length in range(len(word) - maxDistance, len(word) + maxDistance + 1):
+            lists = sorted([self.postings(kgram, length) for kgram in wordKgrams], key=len)
+            # A candidate is missing from at most misses of the lists, so it is in one of the misses + 1 shortest:
+            # only those are read, and the candidates are then looked up in the others, shortest first, until they
+            # are missing from too many of them
+            misses = len(lists) - threshold
+            if misses < 0:
+                continue
+            counts = Counter()
+            for postings in lists[:misses + 1]:
+                counts.update(postings)
+            others = lists[misses + 1:]
+            for termId, count in counts.items():
+                # Number of the other lists the term may still be missing from
+                allowed = count - 1
+                for postings in others:
+                    index = bisect_left(postings, termId)
+                    if index == len(postings) or postings[index] != termId:
+                        allowed -= 1
+                        if allowed < 0:
+                            break
+                else:
+                    distance = levenshtein(word, self.term(termId), maxDistance)
+                    if distance <= maxDistance:
+                        result.append((distance, termId))
+        return result
+
@@ -1,11 +1,31 @@
 from Collection import *
+from Impacts import ImpactIndex
+from Weights import WeightStore
+from array import array
 from collections import Counter
 import datetime
-from math import log10, sqrt
-import nltk
+import heapq
+from math import inf, log10, sqrt
 
-common_words = open("Data/CACM/common_words", mode='r').read().splitlines()
-common_words += list(string.punctuation)
+# Margin under the top k threshold for WAND: a document whose score upper bound is below the threshold minus this
+# margin cannot enter the top k, even after scores are rounded to 6 decimals
+wand_margin = 1e-6
+
+# Whether a request term which is not in the collection is replaced by its spelling correction
+spelling_correction = True
+
+# Storage of the saved weights: 'float32', or quantized on 'uint16' or 'uint8'
+weight_quantization = 'float32'
+
+# BM25 parameters: saturation of the term frequency (k1) and strength of the document length normalization (b)
+bm25_k1 = 1.2
+bm25_b = 0.75
+
+# Slope of the pivoted document length normalization: the lower it is, the less long documents are penalized
+pivoted_slope = 0.2
+
+# Storage of the impacts of the BM25 and pivoted normalization models: quantized on 'uint8' or 'uint16'
+impact_quantization = 'uint8'
 
 
 class VectorRequest:
@@ -13,50 +33,97 @@ class VectorRequest:
         self.collection = Collection
         self.allTerms = range(self.collection.termLen)
         self.allDocuments = range(self.collection.docLen)
-        self.index_weights = {}
-        self.weight_type = 'tf_idf'
+        self.index_weights = WeightStore.fromTerms(Collection, [])
+        self.documents_norm = {}
+        self.term_max_weights = {}
+        self.block_max_weights = {}
+        self.weight_type = weight_type
+        self.dynamic_pruning = False
+        self.skipped_postings = 0
+        self.impact_index = None
+        self.score_at_a_time = False
+        self.postings_budget = None # Maximum number of postings read by score-at-a-time evaluation
+        self.time_budget = None # Maximum time in seconds of score-at-a-time evaluation
+        self.processed_postings = 0
+        self.budget_exhausted = False
+        self.corrections = {}
+        self.average_document_length = None
+        self.weights_generation = self.collection.generation # Generation of the collection the weights were computed on
+
+    def postings_weights(self, termId, weights):
+        """ Weights of the postings of a term, in the order of its postings, computed by weights(postings, N, df).
+        N and df are the ones of the request weights, which count the deleted documents of a segmented collection
+        until they are merged """
+        postings = self.collection.invertedIndex[termId][1]
+        if len(postings) == 0:
+            # All the documents of the term were deleted (in a segmented collection): it has no idf
+            return []
+        return weights(postings, self.collection.getCollectionSize(), self.collection.getDocumentFrequency(termId))
 
     def tf_idf_weights(self, termId):
-        N = self.collection.docLen
-        # for docId in range(N):
-        #     self.index_weights[(docId, termId)] = 0
-        postings = self.collection.invertedIndex[termId][1]
-        df = len(postings)
-        idf = log10(N/df)
-        for posting in postings:
-            docId = posting[0]
-            tf = posting[1]
-            self.index_weights[(termId, docId)] = tf*idf
+        """ Weights of the postings of a term, in the order of its postings """
+        def weights(postings, N, df):
+            idf = log10(N/df)
+            return [tf*idf for tf in postings.tfs]
+        return self.postings_weights(termId, weights)
 
     def normalized_tf_idf_weights(self, termId):
-        N = self.collection.docLen
-        postings = self.collection.invertedIndex[termId][1]
-        df = len(postings)
-        idf = log10(N/df)
-        for posting in postings:
-            docId = posting[0]
-            tf = posting[1]
-            self.index_weights[(termId, docId)] = (1+log10(tf))*idf
-
+        def weights(postings, N, df):
+            idf = log10(N/df)
+            return [(1+log10(tf))*idf for tf in postings.tfs]
+        return self.postings_weights(termId, weights)
 
-    def normalized_tf_weights(self):
-        for termId in self.allTerms:
-            postings = self.collection.invertedIndex[termId][1]
-            max_tf = max([x[1] for x in postings])
-            for posting in postings:
-                docId = posting[0]
-                tf = posting[1]
-                self.index_weights[(termId, docId)] = tf/max_tf
+    def normalized_tf_weights(self, termId):
+        postings = self.collection.invertedIndex[termId][1]
+        max_tf = max(postings.tfs, default=0)
+        return [tf/max_tf for tf in postings.tfs]
+
+    def document_length_ratios(self, docIds):
+        """ Length of documents (number of term occurrences) divided by the average length """
+        if len(self.collection.documentLength) == 0:
+            self.collection.computeStatistics()
+        document_length = self.collection.documentLength
+        if self.average_document_length is None:
+            self.average_document_length = sum(document_length)/max(self.collection.docLen, 1) or 1
+        return [document_length[docId]/self.average_document_length for docId in docIds]
+
+    def bm25_weights(self, termId):
+        """ BM25 impact of the postings of a term: idf times a saturated tf, normalized by the document length """
+        def weights(postings, N, df):
+            idf = log10(1 + (N - df + 0.5)/(df + 0.5))
+            return [idf*tf*(bm25_k1 + 1)/(tf + bm25_k1*(1 - bm25_b + bm25_b*length_ratio))
+                    for tf, length_ratio in zip(postings.tfs, self.document_length_ratios(postings.docIds))]
+        return self.postings_weights(termId, weights)
+
+    def pivoted_weights(self, termId):
+        """ Pivoted normalization impact of the postings of a term: a doubly logarithmic tf times idf, divided by a
+        normalization pivoted around the average document length """
+        def weights(postings, N, df):
+            idf = log10((N + 1)/df)
+            return [(1 + log10(1 + log10(tf)))*idf/(1 - pivoted_slope + pivoted_slope*length_ratio)
+                    for tf, length_ratio in zip(postings.tfs, self.document_length_ratios(postings.docIds))]
+        return self.postings_weights(termId, weights)
+
+    def has_documents(self, termId):
+        """ Whether a term of the collection still has documents: the documents of a term can all be deleted (in a
+        segmented collection) while it keeps its term id """
+        return self.collection.getDocumentFrequency(termId) > 0
 
     def index_request(self, request):
-        request_tokens = nltk.wordpunct_tokenize(request)
+        request_tokens = self.collection.analyzer.analyze(request)
         request_terms = []
 
         for token in request_tokens:
-            try:
-                request_terms += [self.collection.termId[token.lower()]]
-            except:
-                pass
+            termId = self.collection.termId.get(token)
+            if termId is not None and not self.has_documents(termId):
+                termId = None
+            if termId is None and spelling_correction:
+                correction = self.collection.correctTerm(token)
+                if correction is not None:
+                    self.corrections[token] = correction
+                    termId = self.collection.termId.get(correction)
+            if termId is not None:
+                request_terms.append(termId)
 
         request_terms = list(Counter(request_terms).items())
         return request_terms
@@ -64,12 +131,13 @@ class VectorRequest:
     def request_normalized_tf_idf_weights(self, request_terms):
         weights = {}
 
-        N = self.collection.docLen
+        N = self.collection.getCollectionSize()
 
         for term in request_terms:
             tf = term[1]
-            df = len(self.collection.invertedIndex[term[0]][1])
-            idf = log10(N/df)
+            if not self.has_documents(term[0]):
+                continue
+            idf = log10(N/self.collection.getDocumentFrequency(term[0]))
 
             weights[term[0]] = (1+log10(tf))*idf
 
@@ -78,12 +146,13 @@ class VectorRequest:
     def request_tf_idf_weights(self, request_terms):
         weights = {}
 
-        N = self.collection.docLen
+        N = self.collection.getCollectionSize()
 
         for term in request_terms:
             tf = term[1]
-            df = len(self.collection.invertedIndex[term[0]][1])
-            idf = log10(N/df)
+            if not self.has_documents(term[0]):
+                continue
+            idf = log10(N/self.collection.getDocumentFrequency(term[0]))
 
             weights[term[0]] = tf*idf
 
@@ -96,31 +165,94 @@ class VectorRequest:
 
         for term in request_terms:
             tf = term[1]
+            if not self.has_documents(term[0]):
+                continue
 
             weights[term[0]] = tf/max_tf
 
         return weights
 
+    def request_impact_weights(self, request_terms):
+        """ Weights of the request terms for impact models: their frequency in the request """
+        return {termId: tf for termId, tf in request_terms if self.has_documents(termId)}
+
     weight_types = {'tf_idf': (tf_idf_weights, request_tf_idf_weights),
                     'normalized_tf': (normalized_tf_weights, request_normalized_tf_weights),
-                    'normalized_tf_idf': (normalized_tf_idf_weights, request_normalized_tf_idf_weights)}
+                    'normalized_tf_idf': (normalized_tf_idf_weights, request_normalized_tf_idf_weights),
+                    'bm25': (bm25_weights, request_impact_weights),
+                    'pivoted': (pivoted_weights, request_impact_weights)}
+
+    # Weighting schemes whose scores are sums of impacts, not cosine similarities: their weights are quantized when
+    # they are computed, and documents and requests are not normalized
+    impact_weight_types = ('bm25', 'pivoted')
+
+    def is_impact_model(self):
+        return self.weight_type in self.impact_weight_types
 
     def all_weights(self):
         start_time = datetime.datetime.now()
-        if self.weight_type == 'normalized_tf':
-            self.normalized_tf_weights()
-        else:
-            for termId in self.allTerms:
-                self.weight_types[self.weight_type][0](self, termId)
+        self.weights_generation = self.collection.generation
+        self.allTerms = range(self.collection.termLen)
+        self.allDocuments = range(self.collection.docLen)
+        self.average_document_length = None
+        weights = self.weight_types[self.weight_type][0]
+        self.index_weights = WeightStore.fromTerms(self.collection, (weights(self, termId) for termId in self.allTerms))
+        if self.is_impact_model():
+            self.index_weights = self.index_weights.quantized(impact_quantization)
+        self.impact_index = None
+        self.compute_documents_norm()
+        self.compute_term_max_weights()
         print(f"{self.weight_type} scores computed in {(datetime.datetime.now() - start_time).microseconds/1000000}s")
 
+    def refresh_weights(self):
+        """ Compute the weights again when documents were added, deleted or merged (in a segmented collection) since
+        they were computed: the weights, norms, maximum weights and impacts of the terms would otherwise be stale """
+        if self.weights_generation != self.collection.generation:
+            self.all_weights()
+
+    def compute_documents_norm(self):
+        """ Get the norm of each document used by the cosine normalization, precomputed with the index when
+        possible, otherwise summed once from the weights. Documents are not normalized by impact models """
+        if self.is_impact_model():
+            self.documents_norm = array('d', [1.0])*(max(self.collection.docId.values(), default=-1) + 1)
+            return
+        if self.weight_type in self.collection.documentNorm:
+            self.documents_norm = self.collection.documentNorm[self.weight_type]
+            return
+        self.documents_norm = {}
+        for termId in self.allTerms:
+            for docId, weight in zip(self.collection.invertedIndex[termId][1].docIds,
+                                     self.index_weights.termWeights(termId)):
+                self.documents_norm[docId] = self.documents_norm.get(docId, 0) + weight
+
+    def compute_term_max_weights(self):
+        """ Upper bounds of the contribution of each term to a cosine similarity, for the whole postings list and for
+        each block of postings: the maximum of the weight divided by the document norm """
+        self.term_max_weights = {}
+        self.block_max_weights = {}
+        for termId in self.allTerms:
+            block_max_weights = []
+            term_weights = dict(zip(self.collection.invertedIndex[termId][1].docIds,
+                                    self.index_weights.termWeights(termId)))
+            for block in range(len(self.collection.getPostingBlocks(termId))):
+                max_weight = 0
+                for docId, _ in self.collection.getBlockPostings(termId, block):
+                    try:
+                        normalized_weight = term_weights[docId]/sqrt(self.documents_norm[docId])
+                    except (ZeroDivisionError, KeyError, IndexError):
+                        normalized_weight = 0
+                    if normalized_weight > max_weight:
+                        max_weight = normalized_weight
+                block_max_weights.append(max_weight)
+            self.block_max_weights[termId] = block_max_weights
+            self.term_max_weights[termId] = max(block_max_weights, default=0)
+
     def cos_similarity(self, docId, request, request_weights):
 
         request_index = self.index_request(request)
 
         terms = [x[0] for x in request_index]
-        docs = [x[0] for x in sum([self.collection.invertedIndex[x][1] for x in terms], [])]
-        if docId not in docs:
+        if not any([docId in self.collection.invertedIndex[x][1].docIds for x in terms]):
             return 0
 
         #request_weights = self.request_tf_idf_weights(request_index)
@@ -128,21 +260,18 @@ class VectorRequest:
 
         res = 0
         documents_norm = 0
-        request_norm = 0
 
-        for i in range(self.collection.termLen):
-            try:
-                documents_norm += self.index_weights[(i, docId)]
-            except KeyError:
-                pass
+        try:
+            documents_norm = self.documents_norm[docId]
+        except (KeyError, IndexError):
+            pass
 
         for i in terms:
             try:
                 res += self.index_weights[(i, docId)]*request_weights[i]
             except KeyError:
                 pass
-            request_norm += request_weights[i]**2
-
+        request_norm = self.request_norm(request_index, request_weights)
 
         try:
             res = res/(sqrt(documents_norm*request_norm))
@@ -150,8 +279,186 @@ class VectorRequest:
             res = 0
         return round(res, 6)
 
-    def full_ranked_vector_request(self, request, number=10, measure=cos_similarity):
-        weights = self.weight_types[self.weight_type][1](self, self.index_request(request))
+    def request_norm(self, request_index, request_weights):
+        """ Square of the norm of the request weights, 1 for impact models which do not normalize requests """
+        if self.is_impact_model():
+            return 1
+        return sum([request_weights[termId]**2 for termId, _ in request_index])
+
+    def term_at_a_time_request(self, request_index, request_weights, number=10):
+        """ Cosine similarity computed term by term: only the postings of the request terms are read, partial
+        scores are summed in an accumulator and the best documents are kept in a bounded heap """
+        accumulator = {}
+        request_norm = self.request_norm(request_index, request_weights)
+
+        for termId, _ in request_index:
+            request_weight = request_weights[termId]
+            for docId, weight in zip(self.collection.invertedIndex[termId][1].docIds,
+                                     self.index_weights.termWeights(termId)):
+                accumulator[docId] = accumulator.get(docId, 0) + weight*request_weight
+
+        heap = []
+        for docId, res in accumulator.items():
+            try:
+                res = round(res/(sqrt(self.documents_norm[docId]*request_norm)), 6)
+            except (ZeroDivisionError, KeyError, IndexError):
+                res = 0
+            if res > 0:
+                self._push_top_k(heap, (res, docId), number)
+
+        return self._sorted_top_k(heap)
+
+    def impact_request(self, request_index, request_weights, number=10):
+        """ Score of impact models computed term by term from the stored impacts: the accumulator only adds
+        integers (quantized impacts times the frequency of the term in the request), which are scaled by the
+        quantization step once for the best documents """
+        accumulator = {}
+
+        for termId, _ in request_index:
+            request_weight = request_weights[termId]
+            for docId, impact in zip(self.collection.invertedIndex[termId][1].docIds,
+                                     self.index_weights.impacts(termId)):
+                accumulator[docId] = accumulator.get(docId, 0) + impact*request_weight
+
+        heap = []
+        for docId, res in accumulator.items():
+            if res > 0:
+                self._push_top_k(heap, (res, docId), number)
+
+        step = self.index_weights.step or 1
+        return [(docId, round(res*step, 6)) for docId, res in self._sorted_top_k(heap)]
+
+    def get_impact_index(self):
+        """ Impact-ordered postings of an impact model, built from its weights if they were not loaded with them """
+        if self.impact_index is None:
+            self.impact_index = ImpactIndex.fromWeights(self.index_weights, self.weight_type)
+        return self.impact_index
+
+    def score_at_a_time_request(self, request_index, request_weights, number=10):
+        """ Same scores as impact_request, computed from impact-ordered postings, the highest impacts first, within
+        self.postings_budget postings and self.time_budget seconds: when a budget is exhausted, the best documents
+        found so far are returned and self.budget_exhausted is set """
+        results, self.processed_postings, complete = self.get_impact_index().scoreAtATime(
+            request_weights, number, self.postings_budget, self.time_budget)
+        self.budget_exhausted = not complete
+        return results
+
+    def wand_request(self, request_index, request_weights, number=10):
+        """ Cosine similarity computed document at a time with block-max WAND dynamic pruning: documents whose upper
+        bound (from the maximum weights of the terms, then of the blocks of postings) cannot reach the current top k
+        are skipped. Gives the same top k as term_at_a_time_request and counts the skipped postings in
+        self.skipped_postings """
+        self.skipped_postings = 0
+        request_norm = self.request_norm(request_index, request_weights)
+        if request_norm == 0 or number < 1:
+            return []
+
+        # A cursor is [posting cursor, upper bound, position of the term in the request]
+        cursors = []
+        for order, (termId, _) in enumerate(request_index):
+            cursor = PostingCursor(self.collection, termId)
+            upper_bound = request_weights[termId]*self.term_max_weights.get(termId, 0)/sqrt(request_norm)
+            if cursor.docId is not None:
+                cursors.append([cursor, upper_bound, order])
+
+        heap = []
+        while cursors:
+            cursors.sort(key=lambda x: x[0].docId)
+            threshold = heap[0][0] - wand_margin if len(heap) == number else None
+
+            # Pivot: first cursor from which the sum of upper bounds can reach the threshold
+            pivot = None
+            upper_bound = 0
+            for i, (_, term_upper_bound, _) in enumerate(cursors):
+                upper_bound += term_upper_bound
+                if threshold is None or upper_bound >= threshold:
+                    pivot = i
+                    break
+            if pivot is None:
+                self.skipped_postings += sum([x[0].remaining() for x in cursors])
+                break
+            pivot_doc = cursors[pivot][0].docId
+            while pivot + 1 < len(cursors) and cursors[pivot + 1][0].docId == pivot_doc:
+                pivot += 1
+
+            if threshold is not None:
+                # Upper bound from the blocks where the pivot document would be: if it is too low, no document until
+                # the end of the first of those blocks can enter the top k
+                block_upper_bound = 0
+                next_doc = cursors[pivot + 1][0].docId if pivot + 1 < len(cursors) else inf
+                for cursor, _, _ in cursors[:pivot + 1]:
+                    block = cursor.blockOf(pivot_doc)
+                    if block < len(cursor.blocks):
+                        block_upper_bound += request_weights[cursor.termId] \
+                                             * self.block_max_weights[cursor.termId][block]/sqrt(request_norm)
+                        next_doc = min(next_doc, cursor.blocks[block][0] + 1)
+                if block_upper_bound < threshold:
+                    for cursor, _, _ in cursors[:pivot + 1]:
+                        self.skipped_postings += cursor.skipTo(next_doc)
+                    cursors = [x for x in cursors if x[0].docId is not None]
+                    continue
+
+            if cursors[0][0].docId == pivot_doc:
+                # Full evaluation, summing term contributions in request order like the accumulator
+                matching = sorted([x for x in cursors if x[0].docId == pivot_doc], key=lambda x: x[2])
+                res = 0
+                for cursor, _, _ in matching:
+                    # The weight is read at the position of the cursor, without decoding the whole postings list
+                    position = cursor.postingPosition()
+                    try:
+                        weight = self.index_weights.weight(cursor.termId, position) if position is not None \
+                            else self.index_weights[(cursor.termId, pivot_doc)]
+                        res += weight*request_weights[cursor.termId]
+                    except KeyError:
+                        pass
+                try:
+                    res = round(res/(sqrt(self.documents_norm[pivot_doc]*request_norm)), 6)
+                except (ZeroDivisionError, KeyError, IndexError):
+                    res = 0
+                if res > 0:
+                    self._push_top_k(heap, (res, pivot_doc), number)
+                for cursor, _, _ in matching:
+                    cursor.next()
+            else:
+                # No document before the pivot can enter the top k: jump to the pivot document
+                for cursor, _, _ in cursors[:pivot]:
+                    self.skipped_postings += cursor.skipTo(pivot_doc)
+
+            cursors = [x for x in cursors if x[0].docId is not None]
+
+        return self._sorted_top_k(heap)
+
+    @staticmethod
+    def _push_top_k(heap, scored_doc, number):
+        """ Keep the number best (score, docId) pairs in a min-heap """
+        if len(heap) < number:
+            heapq.heappush(heap, scored_doc)
+        elif scored_doc > heap[0]:
+            heapq.heapreplace(heap, scored_doc)
+
+    @staticmethod
+    def _sorted_top_k(heap):
+        """ Best documents first, ties broken on the highest document id as the full sort used to do """
+        return [(docId, res) for res, docId in sorted(heap, reverse=True)]
+
+    def full_ranked_vector_request(self, request, number=10, measure=None):
+        self.refresh_weights()
+        request_index = self.index_request(request)
+        if request_index == []:
+            return []
+        weights = self.weight_types[self.weight_type][1](self, request_index)
+        # Terms without weight (no documents left) are not part of the request
+        request_index = [x for x in request_index if x[0] in weights]
+        if request_index == []:
+            return []
+        if measure is None and self.score_at_a_time and self.is_impact_model():
+            return self.score_at_a_time_request(request_index, weights, number)
+        if measure is None and self.dynamic_pruning:
+            return self.wand_request(request_index, weights, number)
+        if measure is None and self.is_impact_model():
+            return self.impact_request(request_index, weights, number)
+        if measure is None:
+            return self.term_at_a_time_request(request_index, weights, number)
         res = [(x, measure(self, x, request, weights)) for x in self.allDocuments]
         res = [x for x in res if x[1] > 0]
         res = sorted(res, key=lambda x: x[1])[::-1]
@@ -162,22 +469,48 @@ class VectorRequest:
         return res
 
     def save_weights(self):
-        """ Save weights at the same location as inverted index """
+        """ Save weights at the same location as inverted index, in binary (see Weights.py) """
         if self.collection.indexLocation is not None:
-            with open(f"{self.collection.indexLocation}/{self.weight_type}", mode="w+") as f:
-                for (_termId, _docId) in self.index_weights:
-                    f.write(f"{_termId} {_docId} {self.index_weights[(_termId, _docId)]}\n")
+            quantization = impact_quantization if self.is_impact_model() else weight_quantization
+            self.index_weights.save(f"{self.collection.indexLocation}/{self.weight_type}", self.weight_type,
+                                    quantization)
+            if quantization != 'float32':
+                # Maximum weights are taken from the quantized weights, which are the ones read at query time
+                self.index_weights = WeightStore.load(self.collection,
+                                                      f"{self.collection.indexLocation}/{self.weight_type}",
+                                                      self.weight_type)
+                self.compute_term_max_weights()
+            with open(f"{self.collection.indexLocation}/{self.weight_type}_max", mode="w+") as f:
+                for _termId in self.term_max_weights:
+                    f.write(" ".join([str(x) for x in [_termId, self.term_max_weights[_termId]]
+                                      + self.block_max_weights[_termId]]) + "\n")
+            if self.is_impact_model():
+                # Impact-ordered postings, for score-at-a-time evaluation
+                self.get_impact_index().save(f"{self.collection.indexLocation}/{self.weight_type}_impacts")
 
     def load_weights(self):
-        """ Load weights from the same location as inverted index """
+        """ Load weights from the same location as inverted index: they are memory-mapped, not read. Raises
+        ValueError if they were not computed for this weighting scheme and this index """
         if self.collection.indexLocation is not None:
-            self.index_weights = {}
-            with open(f"{self.collection.indexLocation}/{self.weight_type}", mode="r+") as f:
-                for line in f.read().splitlines():
-                    _termId, _docId, _score = int(line.split(" ")[0]), int(line.split(" ")[1]), float(
-                        line.split(" ")[2])
-                    self.index_weights[(_termId, _docId)] = _score
-
+            self.weights_generation = self.collection.generation
+            self.index_weights = WeightStore.load(self.collection, f"{self.collection.indexLocation}/{self.weight_type}",
+                                                  self.weight_type)
+            self.compute_documents_norm()
+            if os.path.isfile(f"{self.collection.indexLocation}/{self.weight_type}_max"):
+                self.term_max_weights = {}
+                self.block_max_weights = {}
+                with open(f"{self.collection.indexLocation}/{self.weight_type}_max", mode="r+") as f:
+                    for line in f.read().splitlines():
+                        _termId, _maxWeight, *_blockMaxWeights = line.split(" ")
+                        self.term_max_weights[int(_termId)] = float(_maxWeight)
+                        self.block_max_weights[int(_termId)] = [float(x) for x in _blockMaxWeights]
+            else:
+                self.compute_term_max_weights()
+            self.impact_index = None
+            if self.is_impact_model() and os.path.isfile(f"{self.collection.indexLocation}/{self.weight_type}_impacts"):
+                self.impact_index = ImpactIndex.load(self.collection,
+                                                     f"{self.collection.indexLocation}/{self.weight_type}_impacts",
+                                                     self.weight_type)
 
 
 if __name__ == "__main__":
@@ -192,7 +525,7 @@ if __name__ == "__main__":
     else:
         collection = CACMCollection()
 
-    if os.path.isfile('index' + collection_name + '/docId') and os.path.isfile('index' + collection_name + '/termId') \
+    if os.path.isfile('index' + collection_name + '/docId') and os.path.isfile('index' + collection_name + '/terms') \
             and os.path.isfile('index' + collection_name + '/invertedIndex'):
         collection.loadIndex()
     else:
@@ -213,26 +546,54 @@ if __name__ == "__main__":
             f"Select a scoring method among {', '.join([str(k) for k, _ in request.weight_types.items()])}\n>")
     request.weight_type = weight_type
 
+    if request.is_impact_model():
+        score_at_a_time = ""
+        while score_at_a_time not in ['Y', 'YES', 'N', 'NO']:
+            score_at_a_time = input("Do you want to use score-at-a-time evaluation on impact-ordered postings ? "
+                                    "(YES or NO)\n> ").upper()
+        request.score_at_a_time = score_at_a_time in ['Y', 'YES']
+
+    if request.score_at_a_time:
+        postings_budget = input("Enter a budget in postings per query (nothing for no budget)\n> ")
+        request.postings_budget = int(postings_budget) if postings_budget.strip() else None
+        time_budget = input("Enter a budget in milliseconds per query (nothing for no budget)\n> ")
+        request.time_budget = float(time_budget)/1000 if time_budget.strip() else None
+    else:
+        dynamic_pruning = ""
+        while dynamic_pruning not in ['Y', 'YES', 'N', 'NO']:
+            dynamic_pruning = input("Do you want to use block-max WAND dynamic pruning ? (YES or NO)\n> ").upper()
+        request.dynamic_pruning = dynamic_pruning in ['Y', 'YES']
+
     #request.all_weights()
 
-    if os.path.isfile(f"{request.collection.indexLocation}/{request.weight_type}"):
+    try:
         request.load_weights()
-    else:
+    except (FileNotFoundError, ValueError):
+        # No weights saved, or saved for another index
         request.all_weights()
         request.save_weights()
 
     while True:
         query = input("Please enter your query:\n> ")
         start_time = datetime.datetime.now()
+        request.corrections = {}
         if 'quit' in query:
             print("Exiting...")
             break
         response = request.full_ranked_vector_request(query)
+        if len(request.corrections) > 0:
+            print("Showing results for " + ", ".join([f"'{correction}' instead of '{token}'"
+                                                      for token, correction in request.corrections.items()]))
 
         if response == []:
             print("No results found. Try being less specific. Some of the terms you looked for might not exist.")
         elif response is not None:
             print(f"Request found in {len(response)} documents in {(datetime.datetime.now()-start_time).seconds}s:")
+            if request.dynamic_pruning:
+                print(f"{request.skipped_postings} postings skipped by block-max WAND.")
+            if request.score_at_a_time:
+                print(f"{request.processed_postings} postings read"
+                      + (", budget exhausted: best documents found so far." if request.budget_exhausted else "."))
             for doc_and_measure in response:
                 print(f"{doc_by_id[doc_and_measure[0]]} with measure {doc_and_measure[1]}")
 
@@ -0,0 +1,122 @@
+import mmap
+import struct
+from array import array
+from bisect import bisect_left
+
+
+# First bytes of weight files
+weightsMagic = b"RIWW"
+
+# Header of a weight file: magic, quantization id, weighting scheme, index version, number of terms, number of
+# postings and quantization step, padded to headerSize bytes so that the arrays which follow it are aligned
+weightsHeader = struct.Struct("=4sB23sIIQd")
+headerSize = 64
+
+# Storage of the weights: (name, array type code, largest quantized value), a quantized weight being multiplied by the
+# quantization step (the largest weight divided by the largest quantized value)
+quantizations = [('float32', 'f', None), ('uint16', 'H', (1 << 16) - 1), ('uint8', 'B', (1 << 8) - 1)]
+quantizationIds = {name: quantizationId for quantizationId, (name, _, _) in enumerate(quantizations)}
+
+
+class WeightStore:
+    """ Weights of the postings for one weighting scheme, in a single array laid out like the postings of the inverted
+    index (term by term in term id order, then in doc id order): the weights of a term start at its offset in the
+    array, and the weight of a posting is found at this offset plus the position of the posting in its list. A saved
+    store is memory-mapped when it is loaded """
+
+    def __init__(self, collection, weights, termOffsets, step=None):
+        self.collection = collection
+        self.weights = weights
+        self.termOffsets = termOffsets
+        self.step = step
+        self.buffer = None
+
+    @classmethod
+    def fromTerms(cls, collection, termWeights):
+        """ Store built from the lists of weights of every term, in term id order """
+        weights = array('d')
+        termOffsets = array('Q', [0])
+        for weightsOfTerm in termWeights:
+            weights.extend(weightsOfTerm)
+            termOffsets.append(len(weights))
+        return cls(collection, weights, termOffsets)
+
+    def __len__(self):
+        return len(self.weights)
+
+    def weight(self, termId, position):
+        """ Weight of the posting at a position of the postings list of a term """
+        weight = self.weights[self.termOffsets[termId] + position]
+        return weight if self.step is None else weight * self.step
+
+    def termWeights(self, termId):
+        """ Weights of all the postings of a term, in the order of its postings """
+        weights = self.weights[self.termOffsets[termId]:self.termOffsets[termId + 1]].tolist()
+        if self.step is None:
+            return weights
+        return [weight * self.step for weight in weights]
+
+    def __getitem__(self, key):
+        """ Weight of a (termId, docId) posting, found by binary search in the postings of the term """
+        termId, docId = key
+        if termId + 1 >= len(self.termOffsets):
+            raise KeyError(key)
+        docIds = self.collection.invertedIndex[termId][1].docIds
+        position = bisect_left(docIds, docId)
+        if position == len(docIds) or docIds[position] != docId:
+            raise KeyError(key)
+        return self.weight(termId, position)
+
+    def impacts(self, termId):
+        """ Weights of all the postings of a term as they are stored: integers to multiply by the quantization step if
+        the store is quantized """
+        return self.weights[self.termOffsets[termId]:self.termOffsets[termId + 1]]
+
+    def quantized(self, quantization):
+        """ Copy of the store with its weights stored as float32, or quantized on the integers up to the largest value
+        of the quantization """
+        _, typeCode, largest = quantizations[quantizationIds[quantization]]
+        weights = self.weights
+        if self.step is not None:
+            weights = array('d', [weight * self.step for weight in weights])
+        if largest is None:
+            return WeightStore(self.collection, array(typeCode, weights), self.termOffsets)
+        step = max(weights, default=0) / largest or 1.0
+        return WeightStore(self.collection, array(typeCode, [min(largest, round(weight / step)) for weight in weights]),
+                           self.termOffsets, step)
+
+    def save(self, fileName, weightType, quantization='float32'):
+        """ Write the store in a file, the weights being quantized if asked """
+        store = self.quantized(quantization)
+        with open(fileName, mode="wb") as file:
+            header = weightsHeader.pack(weightsMagic, quantizationIds[quantization], weightType.encode(),
+                                        self.collection.indexVersion(), len(self.termOffsets) - 1, len(store.weights),
+                                        store.step or 0.0)
+            file.write(header + bytes(headerSize - len(header)))
+            file.write(self.termOffsets.tobytes())
+            file.write(store.weights.tobytes())
+
+    @classmethod
+    def load(cls, collection, fileName, weightType):
+        """ Memory-map a store saved for a weighting scheme, raises ValueError if the file does not hold the weights of
+        this scheme for the current index """
+        with open(fileName, mode="rb") as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(buffer) < headerSize or buffer[:len(weightsMagic)] != weightsMagic:
+            raise ValueError(f"{fileName} is not a weight file")
+        _, quantizationId, savedWeightType, indexVersion, termLen, nbPostings, step = \
+            weightsHeader.unpack_from(buffer)
+        savedWeightType = savedWeightType.rstrip(b"\0").decode()
+        if savedWeightType != weightType:
+            raise ValueError(f"{fileName} holds {savedWeightType} weights, not {weightType}")
+        if indexVersion != collection.indexVersion():
+            raise ValueError(f"{fileName} was computed for another version of the index")
+        _, typeCode, largest = quantizations[quantizationId]
+        view = memoryview(buffer)
+        termOffsets = view[headerSize:headerSize + 8 * (termLen + 1)].cast('Q')
+        weights = view[headerSize + 8 * (termLen + 1):].cast(typeCode)
+        if len(weights) != nbPostings:
+            raise ValueError(f"{fileName} is truncated")
+        store = cls(collection, weights, termOffsets, step if largest is not None else None)
+        store.buffer = buffer
+        return store
@@ -0,0 +1,71 @@
+import re
+from bisect import bisect_left
+from Dictionary import TermDictionary, writeTermDictionary
+
+
+# End of term marker in the rotations of the permuterm index (terms containing it are not indexed)
+termEnd = "\0"
+
+
+def isWildcard(token):
+    """ Whether a query token is a wildcard pattern ('*' standing for any sequence of characters) """
+    return "*" in token
+
+
+def rotations(term):
+    """ Rotations of a term followed by the end of term marker """
+    term += termEnd
+    return [term[i:] + term[:i] for i in range(len(term))]
+
+
+def writePermutermIndex(file, termIds):
+    """ Write the permuterm index of a term dictionary in an open file: every rotation of every term, with the term
+    id of the term, in a front-coded term dictionary """
+    writeTermDictionary(file, {rotation: termId for term, termId in termIds.items() if termEnd not in term
+                               for rotation in rotations(term)})
+
+
+class PermutermIndex:
+    """ Permuterm index: a wildcard pattern 'head*...*tail' is rotated into the prefix 'tail' + end of term + 'head',
+    and the terms matching it are the ones with a rotation starting with this prefix, found in order in the sorted
+    rotations. The cost of an expansion grows with the number of matching terms, not with the size of the
+    vocabulary. Patterns with more than one '*' are checked against the terms found for their head and tail """
+
+    def __init__(self, rotationsPrefix, termLen):
+        self.rotationsPrefix = rotationsPrefix
+        self.termLen = termLen # Number of terms of the dictionary the index was built from
+
+    @classmethod
+    def load(cls, fileName, termLen):
+        """ Permuterm index read from a file written by writePermutermIndex for termLen terms """
+        return cls(TermDictionary(fileName).prefix, termLen)
+
+    @classmethod
+    def fromTerms(cls, termIds):
+        """ Permuterm index of a term dictionary, kept in memory """
+        sortedRotations = sorted([(rotation, termId) for term, termId in termIds.items() if termEnd not in term
+                                  for rotation in rotations(term)])
+
+        def rotationsPrefix(prefix):
+            for i in range(bisect_left(sortedRotations, (prefix,)), len(sortedRotations)):
+                rotation, termId = sortedRotations[i]
+                if not rotation.startswith(prefix):
+                    return
+                yield rotation, termId
+
+        return cls(rotationsPrefix, len(termIds))
+
+    def expand(self, pattern, limit=None):
+        """ (term, termId) of the terms matching a wildcard pattern, in the order of the rotations, at most limit of
+        them """
+        parts = pattern.split("*")
+        check = re.compile(".*".join([re.escape(part) for part in parts]), re.DOTALL) if len(parts) > 2 else None
+        result = []
+        for rotation, termId in self.rotationsPrefix(parts[-1] + termEnd + parts[0]):
+            if limit is not None and len(result) >= limit:
+                break
+            end, start = rotation.split(termEnd)
+            term = start + end
+            if check is None or check.fullmatch(term):
+                result.append((term, termId))
+        return result
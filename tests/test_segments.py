@@ -0,0 +1,80 @@
+import os
+import pytest
+import Segments
+from Segments import SegmentedCollection
+from VectorRequest import VectorRequest
+
+
+@pytest.fixture
+def collection(tmp_path, monkeypatch):
+    """ Empty segmented collection in a temporary directory, without background merges """
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("Data/CACM")
+    with open("Data/CACM/common_words", mode="w") as file:
+        file.write("the\na\n")
+    monkeypatch.setattr(Segments, "mergeFactor", 100)
+    return SegmentedCollection(str(tmp_path / "indexSegments"))
+
+
+def deleteAndMerge(collection):
+    """ Collection where all the documents of 'apple' were deleted and dropped by a merge """
+    collection.addDocuments([("d1", "apple banana"), ("d2", "banana cherry")])
+    collection.addDocuments([("d3", "cherry date")])
+    collection.deleteDocument("d1")
+    collection.waitMerges()
+    collection.mergeSegments(0, len(collection.segments))
+    assert collection.documentFrequency[collection.termId["apple"]] == 0
+    return collection
+
+
+@pytest.mark.parametrize("weightType", ['tf_idf', 'normalized_tf', 'normalized_tf_idf', 'bm25', 'pivoted'])
+def test_query_term_dropped_by_merge(collection, weightType):
+    deleteAndMerge(collection)
+    request = VectorRequest(collection, weightType)
+    request.all_weights()
+    assert request.full_ranked_vector_request("apple") == []
+    assert [docId for docId, _ in request.full_ranked_vector_request("apple banana")] == [collection.docId["d2"]]
+
+
+def test_document_lengths_kept_by_merge(collection, tmp_path):
+    deleteAndMerge(collection)
+    collection.addDocuments([("d4", "the date date fig")])
+    lengths = {docKey: collection.documentLength[docId] for docKey, docId in collection.docId.items()}
+    assert lengths == {"d2": 2, "d3": 2, "d4": 3}
+    assert list(collection.documentLength) == [0, 2, 2, 3]
+    reloaded = SegmentedCollection(str(tmp_path / "indexSegments"))
+    reloaded.loadIndex()
+    assert list(reloaded.documentLength) == [0, 2, 2, 3]
+
+
+@pytest.mark.parametrize("weightType", ['tf_idf', 'normalized_tf_idf', 'bm25'])
+def test_query_after_delete_without_merge(collection, weightType):
+    collection.addDocuments([("d1", "apple banana"), ("d2", "apple cherry"), ("d3", "banana cherry")])
+    collection.deleteDocument("d3")
+    request = VectorRequest(collection, weightType)
+    request.all_weights()
+    results = [docId for docId, _ in request.full_ranked_vector_request("apple banana")]
+    assert results == [collection.docId["d1"], collection.docId["d2"]]
+
+
+@pytest.mark.parametrize("weightType", ['tf_idf', 'bm25'])
+def test_weights_follow_segment_changes(collection, weightType):
+    collection.addDocuments([("d1", "apple banana"), ("d2", "apple cherry apple")])
+    request = VectorRequest(collection, weightType)
+    request.all_weights()
+    collection.addDocuments([("d3", "banana date"), ("d4", "apple date")])
+    collection.deleteDocument("d2")
+    for query in ["apple", "banana date", "apple cherry date"]:
+        fresh = VectorRequest(collection, weightType)
+        fresh.all_weights()
+        assert request.full_ranked_vector_request(query) == fresh.full_ranked_vector_request(query)
+
+
+def test_postings_concatenated_once_per_generation(collection):
+    collection.addDocuments([("d1", "apple banana")])
+    collection.addDocuments([("d2", "apple cherry")])
+    apple = collection.termId["apple"]
+    postings = collection.invertedIndex[apple][1]
+    assert collection.invertedIndex[apple][1] is postings
+    collection.deleteDocument("d1")
+    assert list(collection.invertedIndex[apple][1].docIds) == [collection.docId["d2"]]